@@ -0,0 +1,55 @@
+"""
+Compares the streaming html rewriter with the previous BeautifulSoup implementation of process_html.
+Run from the repository root with python -m benchmarks.bench_process_html.
+"""
+import argparse
+import json
+import time
+
+from src.html_rewriter import rewrite_html
+from src.section_index import SectionIndexer
+from test.corpus import generate_latexml_html
+from test.process_html_soup import canonical, process_html_soup
+
+
+def best_of(function, content, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(content)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def rewrite_and_index(content):
+    """process_html without the file access: the rewrite, the section index fed by its parser, and the sidecar."""
+    indexer = SectionIndexer()
+    result = rewrite_html(content, indexer=indexer)
+    return result, json.dumps(indexer.build(), ensure_ascii=False, separators=(',', ':'))
+
+
+def bench(sections=300, repeat=3):
+    """Return (soup seconds, rewriter seconds, soup output bytes, rewriter output bytes, input bytes)."""
+    content = generate_latexml_html(sections)
+    soup_time, expected = best_of(process_html_soup, content, repeat)
+    rewriter_time, result = best_of(rewrite_html, content, repeat)
+    assert canonical(result) == canonical(expected), 'rewriter output differs from the BeautifulSoup implementation'
+    return soup_time, rewriter_time, len(expected.encode()), len(result.encode()), len(content.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sections', type=int, default=300, help='number of sections of the generated book.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    soup_time, rewriter_time, soup_size, rewriter_size, input_size = bench(args.sections, args.repeat)
+    print(f'{args.sections} sections, {input_size / 1e6:.1f}MB of html')
+    print(f'BeautifulSoup:     {soup_time:.3f}s, {soup_size / 1e6:.1f}MB output')
+    print(f'streaming rewrite: {rewriter_time:.3f}s ({soup_time / rewriter_time:.1f}x), '
+          f'{rewriter_size / 1e6:.1f}MB output')
+    index_time, (_, index) = best_of(rewrite_and_index, generate_latexml_html(args.sections), args.repeat)
+    print(f'with section index: {index_time:.3f}s, {len(index.encode()) / 1e6:.1f}MB index')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures the cold start of the command line interface and fails if it exceeds a time budget.
+Run from the repository root with python -m benchmarks.bench_startup.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from test.helpers import PROJECT_DIR, heavy_imports
+
+COMMANDS = {
+    'import': [sys.executable, '-c', 'import paper2speech'],
+    '--help': [sys.executable, 'paper2speech.py', '--help'],
+}
+
+
+def time_command(command, repeat):
+    """Return the wall time of each of repeat runs of command in a fresh interpreter."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=PROJECT_DIR, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench(repeat=10):
+    """Return the median seconds of each command."""
+    baseline = statistics.median(time_command([sys.executable, '-c', 'pass'], repeat))
+    return baseline, {name: statistics.median(time_command(command, repeat)) for name, command in COMMANDS.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-seconds', type=float, default=0.5,
+                        help='budget for the median time of each command on top of interpreter startup.')
+    args = parser.parse_args()
+
+    baseline, timings = bench(args.repeat)
+    print(f'python -c pass: {baseline * 1000:.0f}ms')
+    failed = False
+    for name, seconds in timings.items():
+        over_budget = seconds - baseline > args.max_seconds
+        failed |= over_budget
+        print(f'{name:<8} {seconds * 1000:.0f}ms (+{(seconds - baseline) * 1000:.0f}ms)'
+              f'{"  over budget" if over_budget else ""}')
+    heavy = heavy_imports()
+    if heavy:
+        print(f'importing paper2speech loads {", ".join(heavy)}')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares the compiled text rule engine with applying text_replacements one re.sub at a time.
+Run from the repository root with python -m benchmarks.bench_text_rules.
+"""
+import argparse
+import random
+import re
+import time
+
+from src.replacements import text_replacements
+from src.rules import RuleEngine
+
+SENTENCES = [
+    'We evaluate the model w.r.t. the baseline, i.e. the method of Smith et al. (2019).',
+    'As shown in Fig. 3 and Tab. 2, the loss decreases (see Sec. 4.1 and Eq. 7).',
+    'Samples are i.i.d. and w.l.o.g. we assume the (k)-th entry is positive [3, 4].',
+    'Other approaches, e.g. transformers (Vaswani et al., 2017; Devlin et al., 2019), vs. RNNs.',
+    'Code is available at https://github.com/example/repository for reproducibility.',
+    'The proof of Thm. 2 follows from the bound in eq. 12, cf. fig. 5 and sec. 3.',
+]
+
+
+def generate_ssml(size: int, seed: int = 0) -> str:
+    """Build an SSML-like document of roughly `size` characters, one segment per line."""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        paragraph = ' '.join(rng.choice(SENTENCES) for _ in range(rng.randint(3, 8)))
+        if rng.random() < 0.1:
+            paragraph = f'<break time="0.5s"></break><p>{rng.randint(1, 9)} Heading</p><break time="0.5s"></break>'
+        parts.append(f'<p>{paragraph}</p>\n')
+        length += len(parts[-1])
+    return ''.join(parts)
+
+
+def apply_sequentially(text: str) -> str:
+    for pattern, replacement, *_ in text_replacements:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+def best_of(function, segments, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = [function(segment) for segment in segments]
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def bench(size=5_000_000, repeat=3):
+    """Return (sequential seconds, engine seconds) for a document of `size` characters, applied segment by segment."""
+    segments = generate_ssml(size).splitlines(keepends=True)
+    engine = RuleEngine(text_replacements)
+    sequential_time, expected = best_of(apply_sequentially, segments, repeat)
+    engine_time, result = best_of(engine.apply, segments, repeat)
+    assert result == expected, 'rule engine output differs from sequential application'
+    return sequential_time, engine_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=5_000_000, help='document size in characters.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    sequential_time, engine_time = bench(args.size, args.repeat)
+    passes = len(RuleEngine(text_replacements).passes)
+    print(f'{len(text_replacements)} rules in {passes} passes on {args.size / 1e6:.1f}M characters of segments')
+    print(f'sequential re.sub: {sequential_time:.3f}s')
+    print(f'rule engine:       {engine_time:.3f}s ({sequential_time / engine_time:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
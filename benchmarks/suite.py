@@ -0,0 +1,230 @@
+"""
+Benchmarks the conversion steps on synthetic papers and books and fails if one got slower than its baseline.
+Baselines are stored in baselines.json together with the time of a calibration workload, which scales them to the
+machine the suite runs on. Store new baselines with --update after a change that is meant to change the timings.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from src import MarkdownModel
+from src.audio import atomic_write
+from src.convert import process_html
+from src.markdown_to_html import markdown_parser
+from src.replacements import text_rules
+from src.ssml import SSMLRenderer
+from src.text_to_speech import MP3Generator, merge_mp3_files
+from test.corpus import WORDS, generate_latexml_html, generate_markdown
+from test.fake_tts import FakeSpeech
+from test.helpers import heuristic_author_detection
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+# allowed slowdown over the scaled baseline
+DEFAULT_THRESHOLD = 0.5
+# slowdowns of less than this many seconds are timer noise, whatever the fraction of the baseline
+NOISE_S = 0.01
+# seconds of latency of each fake text-to-speech request
+DEFAULT_LATENCY = 0.05
+# sections of the generated documents by size
+SIZES = {'paper': 8, 'book': 200}
+
+
+def best_of(function, repeat, setup=None):
+    """
+    Shortest of repeat runs of function(*setup()), without the time of setup. Like timeit, garbage collection is
+    off while function runs, so that garbage of earlier benchmarks does not add to its time.
+    """
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function(*args)
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(timings)
+
+
+def calibrate(repeat=10):
+    """Seconds of a fixed workload of string, regex and json operations, the unit of the baselines."""
+    rng = random.Random(0)
+    text = ' '.join(rng.choice(WORDS) for _ in range(30_000))
+
+    def work():
+        words = re.findall(r'\w+', text)
+        json.loads(json.dumps(sorted(words)))
+        re.sub(r'(\w+) (\w+)', r'\2 \1', text).upper().split()
+
+    return best_of(work, repeat)
+
+
+def markdown_model(size) -> MarkdownModel:
+    model = MarkdownModel()
+    with heuristic_author_detection():
+        model.markdown_to_html(generate_markdown(SIZES[size]))
+    return model
+
+
+def bench_markdown_to_html(size, repeat, work_dir, latency):
+    content = generate_markdown(SIZES[size])
+    with heuristic_author_detection():
+        return best_of(lambda: MarkdownModel().markdown_to_html(content), repeat)
+
+
+def bench_get_chunk(size, repeat, work_dir, latency):
+    model = markdown_model(size)
+    return best_of(lambda: list(model.get_chunk()), repeat)
+
+
+def bench_text_rules(size, repeat, work_dir, latency):
+    # SSML as rendered, before the rules are applied by markdown_to_html
+    ssml = ''.join(SSMLRenderer().render(markdown_parser().parse(generate_markdown(SIZES[size]))))
+    return best_of(lambda: text_rules.apply(ssml), repeat)
+
+
+def bench_process_html(size, repeat, work_dir, latency):
+    content = generate_latexml_html(SIZES[size])
+    path = os.path.join(work_dir, f'{size}.html')
+
+    def setup():
+        with open(path, 'w') as f:
+            f.write(content)
+        return path,
+
+    return best_of(process_html, repeat, setup)
+
+
+def bench_merge_mp3_files(size, repeat, work_dir, latency):
+    speech = FakeSpeech(latency=0)
+    chunks = [speech.synthesize(chunk, str(id)) for id, chunk in enumerate(markdown_model(size).get_chunk())]
+
+    def setup():
+        paths = []
+        for id, audio in enumerate(chunks):
+            paths.append(os.path.join(work_dir, f'{size}-{id}.mp3'))
+            with open(paths[-1], 'wb') as f:
+                f.write(audio)
+        return work_dir, paths
+
+    return best_of(merge_mp3_files, repeat, setup)
+
+
+def bench_synthesis(size, repeat, work_dir, latency):
+    """MP3Generator.write_mp3 of the SSML segments with a text-to-speech API that takes latency per request."""
+    segments_file = os.path.join(work_dir, f'{size}.ssml.json')
+    markdown_model(size).save(segments_file)
+    generate = MP3Generator(segments_file, max_workers=4, backend=FakeSpeech(latency))
+    return best_of(lambda: generate.write_mp3(os.path.join(work_dir, f'{size}.mp3')), repeat)
+
+
+# name, function, sizes
+BENCHMARKS = [
+    ('markdown_to_html', bench_markdown_to_html, ('paper', 'book')),
+    ('get_chunk', bench_get_chunk, ('paper', 'book')),
+    ('text_rules', bench_text_rules, ('paper', 'book')),
+    ('process_html', bench_process_html, ('paper', 'book')),
+    ('merge_mp3_files', bench_merge_mp3_files, ('paper',)),
+    ('synthesis', bench_synthesis, ('paper',)),
+]
+# bound by the disk or by the latency of the fake API rather than the CPU, so their baselines are not scaled
+UNSCALED = {'merge_mp3_files', 'synthesis'}
+
+
+def scale_of(name, calibration, baselines) -> float:
+    """Factor from the baseline of benchmark `name` to its expected time on a machine with this calibration."""
+    if name.split('[')[0] in UNSCALED or not baselines.get('calibration_s'):
+        return 1.0
+    return calibration / baselines['calibration_s']
+
+
+def run(only=None, repeat=3, latency=DEFAULT_LATENCY):
+    """Return the best time in seconds of each benchmark whose name contains `only`, e.g. 'text_rules[book]'."""
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, function, sizes in BENCHMARKS:
+            for size in sizes:
+                key = f'{name}[{size}]'
+                if only and only not in key:
+                    continue
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results[key] = function(size, repeat, work_dir, latency)
+    return results
+
+
+def load_baselines(path=BASELINES_FILE) -> dict:
+    if not os.path.exists(path):
+        return {'calibration_s': None, 'benchmarks': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(baselines, path=BASELINES_FILE):
+    with atomic_write(path) as f:
+        f.write((json.dumps(baselines, indent=1, sort_keys=True) + '\n').encode())
+
+
+def compare(results, calibration, baselines, threshold=DEFAULT_THRESHOLD):
+    """
+    Return for each result its baseline scaled to this machine, None if it has none, and the names of the results
+    that are slower than their scaled baseline by more than threshold, e.g. 0.5 for 50%, and by more than NOISE_S.
+    """
+    expected = {name: baselines['benchmarks'][name] * scale_of(name, calibration, baselines)
+                if name in baselines['benchmarks'] else None
+                for name in results}
+    regressions = [name for name, seconds in results.items() if expected[name] is not None
+                   and seconds > max(expected[name] * (1 + threshold), expected[name] + NOISE_S)]
+    return expected, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', help='run the benchmarks whose name contains this, e.g. book or process_html.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                        help='seconds that each fake text-to-speech request takes.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fail if a benchmark is slower than its baseline by more than this fraction.')
+    parser.add_argument('--baselines', default=BASELINES_FILE)
+    parser.add_argument('--update', action='store_true', help='store the timings as the new baselines.')
+    args = parser.parse_args()
+
+    calibration = calibrate()
+    results = run(args.only, args.repeat, args.latency)
+    # the machine may have been busy during either calibration
+    calibration = min(calibration, calibrate())
+    baselines = load_baselines(args.baselines)
+    expected, regressions = compare(results, calibration, baselines, args.threshold)
+    print(f'calibration: {calibration * 1000:.1f}ms')
+    if baselines.get('latency_s', args.latency) != args.latency:
+        print(f'The synthesis baselines were measured with a latency of {baselines["latency_s"]}s')
+    for name, seconds in results.items():
+        baseline = f'baseline {expected[name] * 1000:8.1f}ms ({seconds / expected[name] - 1:+.0%})' \
+            if expected[name] else 'no baseline'
+        print(f'{name:<24} {seconds * 1000:8.1f}ms  {baseline}{"  regression" if name in regressions else ""}')
+
+    if args.update:
+        # keeps the calibration of the other baselines when only some benchmarks ran
+        baselines['calibration_s'] = baselines.get('calibration_s') or round(calibration, 6)
+        baselines['latency_s'] = args.latency
+        baselines['benchmarks'].update({name: round(seconds / scale_of(name, calibration, baselines), 6)
+                                        for name, seconds in results.items()})
+        save_baselines(baselines, args.baselines)
+        print(f'Baselines written to {args.baselines}')
+    elif regressions:
+        print(f'{len(regressions)} benchmarks slower than their baseline by more than {args.threshold:.0%}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,31 @@
 // =================== END FOR TESTING ===================
 
 const OPENAI_API_KEY = 'sk-XXX'
+const API_URL = 'https://api.openai.com';
+// local server that caches the responses, see src/proxy.py
+const PROXY_URL = 'http://localhost:8765';
+
+// token of the running proxy, which it only gives to the pages it serves
+let proxyToken = null;
+
+function getProxyToken() {
+  proxyToken = proxyToken || fetch(PROXY_URL + '/proxy-token', {cache: 'no-store'})
+    .then(response => response.ok ? response.json() : Promise.reject(response.status))
+    .then(json => json.token)
+    .catch(error => {
+      proxyToken = null;
+      return Promise.reject(error);
+    });
+  return proxyToken;
+}
+
+// send the request through the local proxy if it is running, and to the API otherwise
+function apiFetch(path, options) {
+  return getProxyToken()
+    .then(token => fetch(PROXY_URL + path, {...options, headers: {...options.headers, 'X-Proxy-Token': token}}))
+    .then(response => response.status === 404 || response.status === 403 ? Promise.reject(response.status) : response)
+    .catch(() => fetch(API_URL + path, options));
+}
 
 
 function getExplanation(text) {
@@ -43,7 +68,7 @@ function getExplanation(text) {
   // return;
   // =================== END COPY TO CLIPBOARD ===================
 
-  return fetch('https://api.openai.com/v1/chat/completions', {
+  return apiFetch('/v1/chat/completions', {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
@@ -84,16 +109,130 @@ function getSectionText(section) {
   return sectionCopy.textContent.replace(/\n/g, ' ').replace(/\s+/g, ' ');
 }
 
+// =================== SECTION INDEX ===================
+
+// the section index written next to the page by process_html, see src/section_index.py
+let sectionIndex = null;
+
+function loadSectionIndex() {
+  if (sectionIndex === null) {
+    const meta = document.querySelector('meta[name="section-index"]');
+    // fetching fails for pages opened as files in some browsers, the section text is then taken from the page
+    sectionIndex = !meta ? Promise.resolve(null) : fetch(meta.content)
+      .then(response => response.ok ? response.json() : null)
+      .then(index => {
+        if (index) {
+          index.tokenPattern = new RegExp(index.token, 'g');
+          index.stopwordSet = new Set(index.stopwords);
+          index.averageLength = index.lengths.reduce((a, b) => a + b, 0) / Math.max(index.lengths.length, 1);
+          index.passageNumbers = new Map(index.passages.map((passage, i) => [passage[0], i]));
+        }
+        return index;
+      })
+      .catch(() => null);
+  }
+  return sectionIndex;
+}
+
+function tokenize(index, text) {
+  return (text.toLowerCase().match(index.tokenPattern) || []).filter(token => !index.stopwordSet.has(token));
+}
+
+// BM25 ranking of the passages, the same as search in src/section_index.py
+function searchIndex(index, tokens, limit, excluded) {
+  const scores = new Map();
+  const count = index.lengths.length;
+  for (const token of new Set(tokens)) {
+    const posting = index.postings[token];
+    if (!posting) {
+      continue;
+    }
+    const frequency = posting.length / 2;
+    const idf = Math.log(1 + (count - frequency + 0.5) / (frequency + 0.5));
+    for (let i = 0; i < posting.length; i += 2) {
+      const passage = posting[i], tf = posting[i + 1];
+      const norm = index.k1 * (1 - index.b + index.b * index.lengths[passage] / index.averageLength);
+      scores.set(passage, (scores.get(passage) || 0) + idf * tf * (index.k1 + 1) / (tf + norm));
+    }
+  }
+  return [...scores.keys()]
+    .filter(passage => !excluded.has(passage))
+    .sort((a, b) => scores.get(b) - scores.get(a) || a - b)
+    .slice(0, limit);
+}
+
+// the prompt for an element with an explain button, with background passages from other parts of the document
+function getPrompt(index, element, maxLength = 4096) {
+  if (!index) {
+    return 'Explain this:\n' + getSectionText(element);
+  }
+  const entry = element.id ? index.sections[element.id] : undefined;
+  let text, tokens, passages;
+  if (entry) {
+    passages = [];
+    for (let i = entry.passages[0]; i < entry.passages[1]; i++) {
+      passages.push(i);
+    }
+    text = [entry.title].concat(passages.map(i => index.passages[i][2])).join(' ');
+    tokens = entry.terms;
+  } else {
+    // e.g. theorem sections, which are small
+    text = getSectionText(element);
+    tokens = tokenize(index, text);
+    passages = [...element.querySelectorAll('.ltx_para')]
+      .map(para => index.passageNumbers.get(para.id))
+      .filter(i => i !== undefined);
+  }
+  text = text.substring(0, Math.floor(maxLength * 0.7));
+  const excluded = new Set(passages);
+  const lowerText = text.toLowerCase();
+  const background = [];
+  for (const [term, passage] of Object.entries(index.definitions)) {
+    if (background.length < 2 && !excluded.has(passage) && lowerText.includes(term)) {
+      background.push(passage);
+      excluded.add(passage);
+    }
+  }
+  background.push(...searchIndex(index, tokens, 3, excluded));
+  let prompt = 'Explain this:\n' + text;
+  if (background.length) {
+    prompt += '\n\nBackground from other parts of the document:\n' + background.map(i => index.passages[i][2]).join('\n');
+  }
+  return prompt.substring(0, maxLength);
+}
+
+document.addEventListener('DOMContentLoaded', loadSectionIndex);
+
+// =================== END SECTION INDEX ===================
+
 function explainButton(button) {
   const loadingDiv = document.createElement('div');
   loadingDiv.className = 'loading';
   button.appendChild(loadingDiv);
   button.disabled = true; // Disable button
 
-  const prompt = 'Explain this:\n' + getSectionText(button.parentElement);
-  getExplanation(prompt).then(explanation => {
-    readAloud(explanation, button);
-  });
+  loadSectionIndex()
+    .then(index => Promise.all([getExplanation(getPrompt(index, button.parentElement)), loadMarkdownBundle()]))
+    .then(([explanation]) => {
+      readAloud(explanation, button);
+    });
+}
+
+// pages with static math do not load the markdown bundle with the page, it is loaded for the first explanation
+let markdownBundle = null;
+
+function loadMarkdownBundle() {
+  const meta = document.querySelector('meta[name="markdown-bundle"]');
+  if (markdownBundle === null) {
+    markdownBundle = typeof markdownToHTML !== 'undefined' || !meta ? Promise.resolve() : new Promise((resolve, reject) => {
+      const script = document.createElement('script');
+      script.src = meta.content;
+      script.onload = resolve;
+      script.onerror = reject;
+      document.head.appendChild(script);
+    });
+  }
+  return markdownBundle;
 }
 
 // replace LaTeX expressions with their spoken equivalent inside math-inline spans
@@ -255,6 +394,28 @@ function handleExplainButton(buttonElement) {
   }
 }
 
+// an audio url that plays the mp3 response while it arrives, or once it is complete if the browser cannot stream it
+function audioSource(response) {
+  if (!response.body || !window.MediaSource || !MediaSource.isTypeSupported('audio/mpeg')) {
+    return response.blob().then(blob => URL.createObjectURL(blob));
+  }
+  const mediaSource = new MediaSource();
+  mediaSource.addEventListener('sourceopen', () => {
+    const buffer = mediaSource.addSourceBuffer('audio/mpeg');
+    const reader = response.body.getReader();
+    const append = () => reader.read().then(({done, value}) => {
+      if (done) {
+        mediaSource.endOfStream();
+      } else {
+        buffer.addEventListener('updateend', append, {once: true});
+        buffer.appendBuffer(value);
+      }
+    });
+    append();
+  }, {once: true});
+  return Promise.resolve(URL.createObjectURL(mediaSource));
+}
+
 function readAloud(text, buttonElement) {
   const options = {
     htmlTags: true,
@@ -285,7 +446,7 @@ function readAloud(text, buttonElement) {
   }
   console.log(allTextContents);
 
-  fetch('https://api.openai.com/v1/audio/speech', {
+  apiFetch('/v1/audio/speech', {
     method: 'POST',
     headers: {
       'Authorization': 'Bearer ' + OPENAI_API_KEY,
@@ -297,11 +458,11 @@ function readAloud(text, buttonElement) {
       'voice': 'echo'
     })
   })
-    .then(response => response.blob())
-    .then(blob => {
+    .then(response => audioSource(response))
+    .then(src => {
       buttonElement.disabled = false; // Re-enable button
       var audio = document.createElement('audio');
-      audio.src = URL.createObjectURL(blob);
+      audio.src = src;
 
       buttonElement.parentElement.insertBefore(audio, buttonElement.nextElementSibling);
       // change button icon to pause
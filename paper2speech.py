@@ -1,56 +1,321 @@
 import os
 import argparse
-import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from src.text_to_speech import merge_mp3_files, MP3Generator, refine_mmd
-from src.convert import mmd_to_tex, tex_to_html, process_html
+from src.markdown_to_html import markdown_file_segments, save_segments
+from src.audio import SegmentPlaylist
+from src.cache import DiskCache
+from src.pipeline import Pipeline, Stage
+from src.profiling import profiler
+from src.speech_backends import BACKENDS, get_backend
+from src.text_to_speech import MP3Generator, PROGRESSIVE_CHUNK_BYTES, RateLimiter, refine_mmd, SPEECH_CACHE_DIR
+from src.convert import mmd_to_tex, tex_to_html, process_html, section_index_path
+from src.tex_split import included_files
+from src.ocr import convert_sharded, shared_worker, MODEL_TAG
 
+INPUT_TYPES = ['.pdf', '.mmd', '.tex']
+OUTPUT_TYPES = ['.mp3', '.html']
 
-def get_args():
-    """Parse arguments and check validity."""
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input_file', type=str, help='input file path. Can be a pdf, mmd or tex file.')
-    parser.add_argument('-o', '--output_file', type=str, help='output file path. Either an mp3 or html file.')
-    args = parser.parse_args()
-    assert os.path.isfile(args.input_file), f'Input file {args.input_file} does not exist.'
+
+def make_parser(parser_class=argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser = parser_class()
+    parser.add_argument('input_files', type=str, nargs='+', metavar='input_file',
+                        help='input file paths. Can be pdf, mmd or tex files, or directories containing them.')
+    parser.add_argument('-o', '--output_file', type=str, action='append', dest='output_files', metavar='OUTPUT_FILE',
+                        help='output file path. Either an mp3 or html file. Repeat -o to get both from one run, which '
+                             'runs the OCR once. For several input files, the path has to contain {name}, which is '
+                             'replaced by the name of each input file, e.g. out/{name}.mp3')
+    parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                        help='number of files whose OCR and markdown processing run in parallel, in batch mode.')
+    parser.add_argument('--io-workers', type=int, default=4,
+                        help='number of files whose speech is synthesized at the same time, in batch mode.')
+    parser.add_argument('--ocr-processes', type=int, default=1,
+                        help='number of processes that convert pages of a pdf in parallel, each loads its own model.')
+    parser.add_argument('--latexml-processes', type=int, default=1,
+                        help='number of LaTeXML processes that convert the chapters or sections of a tex file in '
+                             'parallel. Converted parts are reused while they are unchanged.')
+    parser.add_argument('--static-math', action='store_true',
+                        help='html output: render the math as static MathML instead of loading the math runtime with '
+                             'the page, and use local copies of the stylesheets, so that the page opens instantly '
+                             'and offline.')
+    parser.add_argument('--tts', choices=sorted(BACKENDS), default='google',
+                        help='text-to-speech engine: the Google Cloud API, or Piper, which runs locally on the CPU.')
+    parser.add_argument('--voice', type=str, default=None,
+                        help='voice of the engine: a Google voice name, e.g. en-US-Neural2-J, or the path of a Piper '
+                             '.onnx voice model (default: the PIPER_VOICE environment variable).')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of speech chunks synthesized concurrently (default: 4 for Google, the number of '
+                             'CPU cores for Piper).')
+    parser.add_argument('--requests-per-minute', type=int, default=None,
+                        help='maximum number of text-to-speech requests per minute.')
+    parser.add_argument('--cache-dir', type=str, default=SPEECH_CACHE_DIR,
+                        help='directory of the cache for synthesized speech chunks.')
+    parser.add_argument('--cache-size', type=int, default=1024, help='maximum size of the speech cache in MB.')
+    parser.add_argument('--no-cache', action='store_true', help='always synthesize speech, ignoring the cache.')
+    parser.add_argument('--progressive', action='store_true',
+                        help='also write an m3u8 playlist next to the mp3 file that gains an entry as each chunk is '
+                             'synthesized, so that listening can start before the mp3 file is complete.')
+    parser.add_argument('--profile', nargs='?', const='paper2speech-profile', metavar='PREFIX',
+                        help='record the wall time, CPU time and bytes read and written of each stage, chunk and API '
+                             'request, and the peak memory of each process, and write a report to PREFIX.json and a '
+                             'Chrome trace to PREFIX.trace.json (default prefix: paper2speech-profile).')
+    parser.add_argument('--force', action='store_true',
+                        help='run all stages, even those whose outputs are up to date with their inputs.')
+    return parser
+
+
+def get_args(argv=None, parser=None, cwd=None):
+    """
+    Parse arguments, sys.argv by default, and check validity.
+    Args:
+        cwd: directory that relative input and output paths are relative to, instead of the working directory
+    """
+    parser = parser or make_parser()
+    args = parser.parse_args(argv)
+    if cwd:
+        args.input_files = [os.path.join(cwd, path) for path in args.input_files]
+        args.output_files = args.output_files and [os.path.join(cwd, path) for path in args.output_files]
+    for path in args.input_files:
+        assert os.path.exists(path), f'Input file {path} does not exist.'
+    try:
+        get_backend(args.tts, args.voice)
+    except ValueError as e:
+        parser.error(str(e))
+    args.input_files = expand_inputs(args.input_files)
+    assert args.input_files, 'No pdf, mmd or tex files found.'
+    output_files = args.output_files or []
+    assert len(args.input_files) == 1 or all('{name}' in path for path in output_files), \
+        'The output file path has to contain {name} when converting several files.'
+    file_types = [os.path.splitext(path)[1].lower() for path in output_files]
+    assert len(set(file_types)) == len(file_types), 'Give at most one mp3 and one html output file.'
     return args
 
 
+def expand_inputs(paths):
+    """
+    Replace directories by the pdf, mmd and tex files in them. If a directory contains several of these
+    files with the same name, only the first in the order pdf, mmd, tex is converted, as the others are
+    intermediate files.
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        by_name = {}
+        for entry in sorted(os.listdir(path)):
+            name, extension = os.path.splitext(entry)
+            if extension.lower() in INPUT_TYPES and os.path.isfile(os.path.join(path, entry)):
+                by_name.setdefault(name, []).append(entry)
+        for name in sorted(by_name):
+            entry = min(by_name[name], key=lambda e: INPUT_TYPES.index(os.path.splitext(e)[1].lower()))
+            files.append(os.path.join(path, entry))
+    return files
+
+
+class Job:
+    """
+    Conversion of one input file to one or several output files. The shared stages, e.g. the OCR, run once, then the
+    branch of each output file. Stages that mainly use the CPU are separated from speech synthesis.
+    """
+    def __init__(self, input_file, output_files, args, rate_limiter=None, backend=None):
+        filename, file_extension = os.path.splitext(input_file)
+        assert file_extension.lower() in INPUT_TYPES, f'Input file type {file_extension} not supported.'
+        filename = os.path.basename(filename)
+        file_types = [os.path.splitext(output_file)[1].lower() for output_file in output_files]
+        for file_type in file_types:
+            assert file_type in OUTPUT_TYPES, f'Output file type {file_type} not supported.'
+        in_path = os.path.dirname(input_file)
+
+        self.input_file = input_file
+        self.output_files = output_files
+        self.file_types = file_types
+        self.out_paths = sorted({os.path.dirname(output_file) for output_file in output_files})
+        # the stages of all outputs share one manifest, next to the first output file
+        self.manifest_file = os.path.join(os.path.dirname(output_files[0]), f'.{filename}.pipeline.json')
+        self.shared_stages = []
+        # for each output file, the stages that mainly use the CPU and the speech synthesis
+        self.branches = []
+
+        mmd_file = os.path.join(in_path, filename + '.mmd')
+        if file_extension.lower() == '.pdf':
+            self.shared_stages.append(Stage('ocr', ocr, (input_file, in_path, args.ocr_processes),
+                                            inputs=[input_file], outputs=[mmd_file], params={'model': MODEL_TAG}))
+        if file_extension.lower() != '.tex':
+            # changes the markdown in place, so it runs for every output, and before the markdown is verbalized, so
+            # that the speech does not depend on whether html is converted as well
+            self.shared_stages.append(Stage('refine_mmd', refine_mmd, (mmd_file,), inputs=[mmd_file],
+                                            outputs=[mmd_file]))
+
+        for output_file, file_type in zip(output_files, file_types):
+            out_path = os.path.dirname(output_file)
+            if file_type == '.mp3':
+                # TODO: implement conversion from tex to mp3
+                ssml_file = os.path.join(in_path, filename + '.ssml.json')
+                backend = backend or get_backend(args.tts, args.voice)
+                self.branches.append((
+                    [Stage('verbalize', verbalize, (mmd_file, ssml_file), inputs=[mmd_file], outputs=[ssml_file])],
+                    [Stage('speech', synthesize, (ssml_file, output_file, args, rate_limiter, backend),
+                           inputs=[ssml_file], outputs=[output_file], params=backend.params)]))
+                continue
+            html_file = os.path.join(out_path, filename + '.html')
+            if file_extension.lower() != '.tex':
+                tex_file = os.path.join(in_path, filename, filename + '.tex')
+                cpu_stages = [Stage('mmd_to_tex', mmd_to_tex, (mmd_file,), inputs=[mmd_file], outputs=[tex_file])]
+                tex_inputs = [tex_file]
+            else:
+                tex_file = input_file
+                cpu_stages = []
+                tex_inputs = [tex_file] + included_files(tex_file)
+            cpu_stages += [
+                # process_html changes the html in place, so both run again if its parameters change
+                Stage('tex_to_html', tex_to_html, (tex_file, out_path, args.latexml_processes), inputs=tex_inputs,
+                      outputs=[html_file], params={'static_math': args.static_math}),
+                Stage('process_html', process_html, (output_file, args.static_math), inputs=[output_file],
+                      outputs=[output_file, section_index_path(output_file)], params={'static_math': args.static_math}),
+            ]
+            self.branches.append((cpu_stages, []))
+
+    @property
+    def cpu_stages(self):
+        return self.shared_stages + [stage for cpu_stages, _ in self.branches for stage in cpu_stages]
+
+    @property
+    def io_stages(self):
+        return [stage for _, io_stages in self.branches for stage in io_stages]
+
+
+def run_stages(stages, manifest_file, force, profile=False, branches=()):
+    """
+    Run stages with a pipeline, then the lists of stages in branches at the same time.
+    Returns:
+        names of the stages that ran, and the profiling events if this is a worker process of a profiled run
+    """
+    if profile:
+        profiler.enable()
+    pipeline = Pipeline(manifest_file, force=force)
+    pipeline.run(stages)
+    pipeline.run_branches(branches)
+    return pipeline.ran, profiler.drain() if profile and profiler.in_worker else []
+
+
+def ocr(pdf_file, out_path, processes):
+    """Convert the pdf to out_path/<name>.mmd with Nougat."""
+    if processes > 1:
+        convert_sharded(pdf_file, out_path, processes, recompute=True)
+    elif not list(shared_worker().convert([pdf_file], out_path, recompute=True)):
+        raise RuntimeError(f'Could not convert {pdf_file} to markdown.')
+
+
+def verbalize(mmd_file, ssml_file):
+    """Convert the markdown file to SSML segments and save them, one section at a time."""
+    save_segments(markdown_file_segments(mmd_file), ssml_file)
+
+
+def synthesize(ssml_file, output_file, args, rate_limiter=None, backend=None):
+    """Synthesize the speech of the SSML segments into output_file."""
+    cache = None if args.no_cache else DiskCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    mp3_gen = MP3Generator(ssml_file, max_workers=args.workers, requests_per_minute=args.requests_per_minute,
+                           cache=cache, rate_limiter=rate_limiter, backend=backend,
+                           chunk_bytes=PROGRESSIVE_CHUNK_BYTES if args.progressive else None)
+    playlist = None
+    if args.progressive:
+        playlist = SegmentPlaylist(os.path.splitext(output_file)[0] + '.m3u8')
+        print(f'Writing playlist {playlist.path}')
+    mp3_gen.write_mp3(output_file, playlist=playlist)
+    if mp3_gen.failed_chunks:
+        raise RuntimeError(f'Speech generation failed for chunks {sorted(mp3_gen.failed_chunks)}, '
+                           f'they are missing from the output.')
+
+
+def convert_batch(jobs, args):
+    """
+    Convert several files. OCR and markdown processing run on a process pool, and the speech of each file is
+    synthesized on an I/O thread pool as soon as its text is ready, while other files are still processed.
+    A failing file does not stop the others.
+    Returns:
+        dict of input file to status
+    """
+    status = {}
+    ran = {job.input_file: [] for job in jobs}
+    with ProcessPoolExecutor(max_workers=args.processes) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=args.io_workers) as io_pool:
+        profile = bool(args.profile)
+        cpu_futures = {cpu_pool.submit(run_stages, job.shared_stages, job.manifest_file, args.force, profile,
+                                       [cpu_stages for cpu_stages, _ in job.branches]): job
+                       for job in jobs}
+        io_futures = {}
+        for future in as_completed(cpu_futures):
+            job = cpu_futures[future]
+            try:
+                stages, events = future.result()
+            except Exception as e:
+                status[job.input_file] = f'failed: {e}'
+                continue
+            ran[job.input_file] += stages
+            profiler.extend(events)
+            io_futures[io_pool.submit(run_stages, [], job.manifest_file, args.force, profile,
+                                      [io_stages for _, io_stages in job.branches])] = job
+        for future in as_completed(io_futures):
+            job = io_futures[future]
+            try:
+                ran[job.input_file] += future.result()[0]
+            except Exception as e:
+                status[job.input_file] = f'failed: {e}'
+
+    for job in jobs:
+        if job.input_file not in status:
+            status[job.input_file] = 'converted' if ran[job.input_file] else 'up to date'
+    return status
+
+
 def main():
     args = get_args()
+    if args.profile:
+        profiler.enable(main=True)
+    try:
+        convert(args)
+    finally:
+        if args.profile:
+            profiler.write(args.profile)
 
-    filename, file_extension = os.path.splitext(args.input_file)
-    assert file_extension.lower() in ['.pdf', '.mmd', '.tex'], f'Input file type {file_extension} not supported.'
-    filename = os.path.basename(filename)
-    _, file_type = os.path.splitext(args.output_file)
-    assert file_type.lower() in ['.mp3', '.html'], f'Output file type {file_type} not supported.'
-    in_path = os.path.dirname(args.input_file)
-    out_path = os.path.dirname(args.output_file)
-    if not os.path.exists(out_path):
-        os.makedirs(out_path)
-
-    if file_extension.lower() == '.pdf':
-        command = f'nougat "{args.input_file}" -o "{in_path}" -m 0.1.0-base --no-skipping'
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = process.communicate()
-        if process.returncode != 0:
-            print(error.decode())
+
+def convert(args):
+    # all files share the request rate limit and the speech engine, e.g. a loaded Piper voice
+    rate_limiter = RateLimiter(args.requests_per_minute)
+    backend = get_backend(args.tts, args.voice)
+    jobs = []
+    for input_file in args.input_files:
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        output_files = [output_file.replace('{name}', name) for output_file in args.output_files]
+        jobs.append(Job(input_file, output_files, args, rate_limiter, backend))
+    for job in jobs:
+        for out_path in job.out_paths:
+            if out_path and not os.path.exists(out_path):
+                os.makedirs(out_path)
+
+    if len(jobs) == 1:
+        job = jobs[0]
+        try:
+            # the audio and html outputs are produced at the same time, after the shared stages
+            run_stages(job.shared_stages, job.manifest_file, args.force,
+                       branches=[cpu_stages + io_stages for cpu_stages, io_stages in job.branches])
+        except (RuntimeError, FileNotFoundError) as e:
+            print(e)
             exit(1)
+        for output_file, file_type in zip(job.output_files, job.file_types):
+            if file_type == '.html':
+                os.system(f'open "{output_file}"')
+        return
 
-    if file_type == '.mp3':
-        # TODO: implement conversion from tex to mp3
-        mp3_gen = MP3Generator(os.path.join(out_path, filename + '.mmd'))
-        mp3_files = mp3_gen.generate_mp3_files()
-        merge_mp3_files(out_path, mp3_files)
-    else:
-        if file_extension.lower() != '.tex':
-            refine_mmd(os.path.join(in_path, filename + '.mmd'))
-            mmd_to_tex(os.path.join(in_path, filename + '.mmd'))
-            tex_to_html(os.path.join(in_path, filename, filename + '.tex'), out_path)
-        else:
-            tex_to_html(args.input_file, out_path)
-        process_html(args.output_file)
-        os.system(f'open "{args.output_file}"')
+    status = convert_batch(jobs, args)
+    print()
+    for job in jobs:
+        print(f'{job.input_file} -> {", ".join(job.output_files)}: {status[job.input_file]}')
+    failed = [input_file for input_file, result in status.items() if result.startswith('failed')]
+    print(f'{len(jobs) - len(failed)} of {len(jobs)} files succeeded.')
+    if failed:
+        exit(1)
 
 
 if __name__ == "__main__":
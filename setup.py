@@ -10,7 +10,7 @@ setup(
     author='Kai Eberl',
     author_email='kai.eberl@tum.de',
     license='MIT',
-    packages=find_packages(),
+    packages=find_packages(exclude=['test', 'test.*']),
     py_modules=["paper2speech"],
     install_requires=[
         'nougat',
@@ -21,6 +21,9 @@ setup(
         'google-cloud-texttospeech',
         'google-auth'
     ],
+    extras_require={
+        'piper': ['piper-tts', 'lameenc'],
+    },
     entry_points={
         "console_scripts": [
             "paper2speech = paper2speech:main",
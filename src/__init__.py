@@ -1 +1,6 @@
-from .markdown_to_html import MarkdownModel
+def __getattr__(name):
+    # imported on first use, so that importing a submodule does not load markdown-it
+    if name == 'MarkdownModel':
+        from .markdown_to_html import MarkdownModel
+        return MarkdownModel
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
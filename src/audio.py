@@ -0,0 +1,193 @@
+"""Writes audio files incrementally and atomically."""
+import collections
+import contextlib
+import os
+import shutil
+import stat
+import tempfile
+from concurrent.futures import Executor, Future
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+COPY_BUFFER_SIZE = 1 << 20
+
+# kbit/s by (MPEG version 1, layer) and bit rate index, MPEG 2 and 2.5 share the version 2 tables
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Hz by version bits of the frame header
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# longest playlist segment in seconds, players wait about this long before reloading the playlist
+SEGMENT_SECONDS = 10
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# read once on import, as setting it to read it races with threads that create files
+_UMASK = _umask()
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """
+    Open a file for writing in binary mode that replaces path when the block exits normally.
+    Data is written to a temporary file next to path, so a crash or an exception never leaves
+    a truncated file at path, and the temporary file is removed. The file gets the permissions of
+    the file it replaces, or those of a file created with open.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            yield out
+            out.flush()
+            os.fsync(out.fileno())
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        # mkstemp creates the file readable by the owner only
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+
+
+def append_file(out, path):
+    """Append the content of the file at path to the open binary file out, without reading it into memory at once."""
+    with open(path, 'rb') as src:
+        shutil.copyfileobj(src, out, COPY_BUFFER_SIZE)
+
+
+def mp3_duration(data: bytes) -> float:
+    """Duration of MP3 audio in seconds, from the frame headers.
+
+    Skips an ID3v2 tag and stops at the first invalid frame.
+    """
+    return sum(seconds for _, _, seconds in _mp3_frames(data))
+
+
+def split_mp3(data: bytes, max_seconds: float) -> List[bytes]:
+    """
+    Split MP3 audio at frame boundaries into pieces of at most max_seconds. An ID3v2 tag stays with the first
+    piece, and data after the last valid frame with the last one.
+    """
+    pieces = []
+    start = 0
+    seconds = 0.0
+    for frame_start, _, frame_seconds in _mp3_frames(data):
+        if seconds and seconds + frame_seconds > max_seconds:
+            pieces.append(data[start:frame_start])
+            start = frame_start
+            seconds = 0.0
+        seconds += frame_seconds
+    if start < len(data) or not pieces:
+        pieces.append(data[start:])
+    return pieces
+
+
+def _mp3_frames(data: bytes) -> Iterator[Tuple[int, int, float]]:
+    """Yield the start, end and duration in seconds of each frame."""
+    pos = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        pos = 10 + ((data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f))
+    while pos + 4 <= len(data):
+        if data[pos] != 0xff or data[pos + 1] & 0xe0 != 0xe0:
+            break
+        version = data[pos + 1] >> 3 & 3
+        layer = 4 - (data[pos + 1] >> 1 & 3)
+        bitrate_index = data[pos + 2] >> 4
+        sample_rate_index = data[pos + 2] >> 2 & 3
+        padding = data[pos + 2] >> 1 & 1
+        if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            break
+        mpeg1 = version == 3
+        bitrate = _BITRATES[mpeg1, layer][bitrate_index] * 1000
+        sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+        if layer == 1:
+            samples = 384
+            length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if mpeg1 or layer == 2 else 576
+            length = samples // 8 * bitrate // sample_rate + padding
+        yield pos, pos + length, samples / sample_rate
+        pos += length
+
+
+class SegmentPlaylist:
+    """
+    HLS event playlist (.m3u8) that gains an entry for every audio segment that is added, so that
+    players can start playing the first segments while later ones are still being generated.
+    Segments are saved in a directory next to the playlist, named after it. The playlist and the segments are kept
+    when the playlist is complete, so that a player can finish playing it, and replaced by the next playlist at the
+    same path.
+    """
+    def __init__(self, path, target_duration: int = SEGMENT_SECONDS):
+        """
+        Args:
+            target_duration: seconds that no segment is longer than, fixed as players must not see it change.
+                Longer audio is split into several segments.
+        """
+        self.path = path
+        self.target_duration = target_duration
+        self.segment_dir = os.path.splitext(path)[0] + '-segments'
+        self.entries = []
+        self.ended = False
+        # segments of an earlier run
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
+        os.makedirs(self.segment_dir)
+        self._write()
+
+    def add(self, filename, data: bytes):
+        """
+        Save the audio in the segment directory and append it to the playlist, as <name>-<i>.mp3 for filename
+        <name>.mp3, split into segments of at most target_duration seconds.
+        """
+        name, extension = os.path.splitext(filename)
+        for i, piece in enumerate(split_mp3(data, self.target_duration)):
+            segment = f'{name}-{i}{extension}'
+            with atomic_write(os.path.join(self.segment_dir, segment)) as out:
+                out.write(piece)
+            self.entries.append((os.path.basename(self.segment_dir) + '/' + segment, round(mp3_duration(piece), 3)))
+        self._write()
+
+    def close(self):
+        """Mark the playlist as complete."""
+        self.ended = True
+        self._write()
+
+    def _write(self):
+        # players reload the playlist while it grows, so it is replaced as a whole rather than appended to
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-PLAYLIST-TYPE:EVENT',
+                 f'#EXT-X-TARGETDURATION:{self.target_duration}', '#EXT-X-MEDIA-SEQUENCE:0']
+        for uri, duration in self.entries:
+            lines += [f'#EXTINF:{duration:.3f},', uri]
+        if self.ended:
+            lines.append('#EXT-X-ENDLIST')
+        with atomic_write(self.path) as out:
+            out.write(('\n'.join(lines) + '\n').encode())
+
+
+def submit_in_order(executor: Executor, func: Callable, items: Iterable, max_pending: int) -> Iterator[Future]:
+    """
+    Submit func(*item) for each item and yield the futures in the order of items.
+    At most max_pending items are submitted ahead of the one being yielded, so results
+    that finish early do not pile up in memory.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, *item))
+        if len(pending) >= max_pending:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
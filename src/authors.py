@@ -0,0 +1,169 @@
+"""Detects the author lines at the start of a paper, so that they are not read out."""
+import atexit
+import os
+import queue
+import re
+import subprocess
+import threading
+from typing import List, Optional
+
+from src.cache import DiskCache, DEFAULT_CACHE_DIR
+from src.profiling import span
+
+GEMMA_CPP_DIR = '/Users/k/Documents/Code/gemma.cpp/build'
+GEMMA_CPP_COMMAND = [os.path.join(GEMMA_CPP_DIR, 'gemma'), '--',
+                     '--tokenizer', os.path.join(GEMMA_CPP_DIR, 'tokenizer.spm'),
+                     '--compressed_weights', os.path.join(GEMMA_CPP_DIR, '2b-it-sfp.sbs'), '--model', '2b-it',
+                     '--verbosity', '0']
+GEMMA_TIMEOUT = 120
+AUTHORS_PROMPT = (
+    '<start_of_turn>user You are provided with a line extracted from a scientific paper. Determine whether '
+    'the line is the list of authors. An author list typically consists of names (e.g. Sarah Wilson, '
+    'Michael Johnson). Any other part of the paper, such as the title, sentences from the abstract or body, '
+    'figure captions, etc. is not an author list. Answer with True or False. Line: "{line}"<end_of_turn>'
+    '<start_of_turn>model')
+AUTHORS_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'authors')
+
+# lowercase words that are part of names, e.g. Ludwig van Beethoven
+NAME_PARTICLES = {'van', 'von', 'der', 'den', 'de', 'del', 'della', 'di', 'da', 'dos', 'du', 'la', 'le', 'bin', 'ibn',
+                  'al', 'y'}
+# separators between names and affiliation marks after names
+_NAME_SEPARATOR = re.compile(r'\s*(?:[,;&·|()\[\]{}*∗⋆†‡§¶♠♣♦♥\d]|\band\b|\s{2,})\s*')
+# separators that do not occur in titles, unlike 'and' in e.g. Neural Networks and Deep Learning
+_LIST_SEPARATOR = re.compile(r'[,;&·|()\[\]{}*∗⋆†‡§¶♠♣♦♥\d]')
+_WORD = re.compile(r"[^\W\d_][\w'’.-]*")
+_INITIAL = re.compile(r'[A-Z]\.(?:-?[A-Z]\.)*$')
+
+
+def classify_line(text: str) -> Optional[bool]:
+    """
+    Decide cheaply whether a line is a list of author names: True or False if the line is clearly
+    one or the other, None if it is ambiguous, e.g. a title in title case.
+    A list of authors consists of at least two names of two to five capitalized words, initials or
+    particles, separated by commas, 'and', wide spaces or affiliation marks. Names separated only by
+    'and' or wide spaces are ambiguous, as title case titles look the same.
+    """
+    words = _WORD.findall(text)
+    if len(text) > 300 or len(words) < 2 or '@' in text:
+        return False
+    lowercase = [word for word in words if word[0].islower() and word not in NAME_PARTICLES and word != 'and']
+    if len(lowercase) > len(words) / 4:
+        return False
+    if lowercase:
+        return None
+    chunks = [_WORD.findall(chunk) for chunk in _NAME_SEPARATOR.split(text)]
+    chunks = [chunk for chunk in chunks if chunk]
+    names = [chunk for chunk in chunks if 2 <= len(chunk) <= 5 and all(map(_is_name_word, chunk))]
+    if len(names) >= 2 and len(names) == len(chunks) and _LIST_SEPARATOR.search(text):
+        return True
+    return None
+
+
+def _is_name_word(word):
+    return word in NAME_PARTICLES or bool(_INITIAL.match(word)) or (word[0].isupper() and not word.isupper())
+
+
+class GemmaProcess:
+    """A gemma.cpp process that keeps the weights loaded and answers one prompt after another."""
+    def __init__(self, command=GEMMA_CPP_COMMAND, timeout=GEMMA_TIMEOUT):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.timeout = timeout
+        self._output = queue.Queue()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self._output.put(line)
+        self._output.put(None)
+
+    def ask(self, prompt: str) -> str:
+        """Return the answer to a single-line prompt. gemma.cpp ends each answer with an empty line."""
+        with self._lock, span('gemma', 'request'):
+            self.process.stdin.write(' '.join(prompt.split()) + '\n')
+            self.process.stdin.flush()
+            lines = []
+            while True:
+                line = self._output.get(timeout=self.timeout)
+                if line is None:
+                    raise RuntimeError(f'gemma.cpp exited with code {self.process.wait()}')
+                if not line.strip() and any(map(str.strip, lines)):
+                    return ''.join(lines)
+                lines.append(line)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class AuthorDetector:
+    def __init__(self, cache_dir=AUTHORS_CACHE_DIR, gemma_command=GEMMA_CPP_COMMAND):
+        """
+        Lines that classify_line cannot decide are sent to gemma.cpp. The process is started on the first
+        ambiguous line and kept running, and its verdicts are cached by model, prompt and line.
+        Args:
+            cache_dir: directory of the verdict cache, None to keep verdicts in memory only
+            gemma_command: command line of gemma.cpp
+        """
+        self.cache_dir = cache_dir
+        self.gemma_command = gemma_command
+        self._cache = None
+        self._verdicts = {}
+        self._gemma = None
+        self._gemma_failed = False
+
+    def is_authors(self, lines: List[str]) -> List[bool]:
+        """Return for each line whether it is a list of authors. Lines that cannot be decided are kept."""
+        lines = [re.sub(r'\d+', '', line) for line in lines]
+        verdicts = [classify_line(line) for line in lines]
+        ambiguous = [line for line, verdict in zip(lines, verdicts) if verdict is None]
+        if ambiguous:
+            answers = self._ask_gemma(ambiguous)
+            verdicts = [answers.get(line) if verdict is None else verdict for line, verdict in zip(lines, verdicts)]
+        return [bool(verdict) for verdict in verdicts]
+
+    def _ask_gemma(self, lines):
+        answers = {}
+        for line in lines:
+            # verdicts of another model or prompt are not reused
+            key = DiskCache.key('authors', ' '.join(self.gemma_command), AUTHORS_PROMPT, line)
+            verdict = self._verdicts.get(key)
+            if verdict is None and self.cache:
+                cached = self.cache.get(key)
+                verdict = None if cached is None else cached == b'1'
+            if verdict is None:
+                if self._gemma_failed:
+                    continue
+                try:
+                    verdict = self._gemma_verdict(line)
+                except Exception as e:
+                    # do not try again for every line, e.g. if gemma.cpp is not installed
+                    print(f"Detecting authors using Gemma.cpp failed: {e}")
+                    self._gemma_failed = True
+                    continue
+                if self.cache:
+                    self.cache.put(key, b'1' if verdict else b'0')
+            self._verdicts[key] = verdict
+            answers[line] = verdict
+        return answers
+
+    @property
+    def cache(self):
+        if self._cache is None and self.cache_dir:
+            self._cache = DiskCache(self.cache_dir, max_bytes=16 << 20)
+        return self._cache
+
+    def _gemma_verdict(self, line):
+        if self._gemma is None:
+            self._gemma = GemmaProcess(self.gemma_command)
+            atexit.register(self._gemma.close)
+        answer = self._gemma.ask(AUTHORS_PROMPT.format(line=line))
+        words = [word.lower().strip('.,"') for word in answer.split()]
+        words = [word for word in words if word in ('true', 'false')]
+        if not words:
+            raise RuntimeError(f'unexpected answer {answer!r}')
+        return words[0] == 'true'
+
+
+author_detector = AuthorDetector()
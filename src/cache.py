@@ -0,0 +1,97 @@
+"""Content-addressed on-disk cache with a size bound and least-recently-used eviction."""
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'paper2speech')
+
+
+class DiskCache:
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        """
+        Args:
+            cache_dir: directory the entries are stored in, created if missing
+            max_bytes: total size of all entries, the least recently used entries are removed beyond this
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash all parts that determine the cached content into a key."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Return the cached bytes for key or None. A hit marks the entry as recently used."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data: bytes):
+        """Store data under key. The entry appears atomically, readers never see a partial file."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # replaced under the lock, so that the size of an entry that is overwritten is only subtracted once
+            with self._lock:
+                try:
+                    replaced_bytes = os.stat(path).st_size
+                except FileNotFoundError:
+                    replaced_bytes = 0
+                os.replace(temp_path, path)
+                if self._total_bytes is None:
+                    self._total_bytes = sum(size for _, _, size in self._entries())
+                else:
+                    self._total_bytes += len(data) - replaced_bytes
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+
+    def _entries(self):
+        """Yield (mtime, path, size) of all entries."""
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, entry.path, stat.st_size
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
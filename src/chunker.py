@@ -0,0 +1,147 @@
+"""Packs SSML segments into as few text-to-speech requests as possible, each within the API byte limit."""
+import functools
+import re
+from typing import Iterable, Iterator, List
+
+# the API rejects inputs over 5000 bytes, including the <speak> element
+MAX_REQUEST_BYTES = 5000
+SPEAK_OPEN = '<speak>\n'
+SPEAK_CLOSE = '</speak>\n'
+
+_TAG = re.compile(r'(<[^>]*>)')
+# split points, from the preferred to the last resort: after a sentence, after a word, between characters
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_WORD_END = re.compile(r'\s+')
+_CHARACTER = re.compile(r'&[#\w]+;|.', re.DOTALL)
+
+
+def wrap(ssml: str) -> str:
+    return SPEAK_OPEN + ssml + SPEAK_CLOSE
+
+
+def byte_length(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def pack_chunks(segments: Iterable[str], max_bytes: int = MAX_REQUEST_BYTES) -> Iterator[str]:
+    """
+    Concatenate consecutive segments as long as the wrapped chunk fits into max_bytes.
+    Segments that are too large on their own are split at sentence boundaries first.
+    """
+    budget = max_bytes - byte_length(wrap(''))
+    chunk = []
+    size = 0
+    for segment in segments:
+        segment_size = byte_length(segment)
+        pieces = [segment] if segment_size <= budget else split_segment(segment, budget)
+        for piece in pieces:
+            piece_size = segment_size if len(pieces) == 1 else byte_length(piece)
+            if chunk and size + piece_size > budget:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+            chunk.append(piece)
+            size += piece_size
+    if chunk:
+        yield ''.join(chunk)
+
+
+def split_segment(segment: str, max_bytes: int) -> List[str]:
+    """
+    Split an SSML segment into pieces of at most max_bytes. Pieces end at sentence boundaries where possible,
+    otherwise between words or characters, never inside a tag or an entity.
+    Tags that are open at a split point are closed at the end of the piece and opened again in the next one.
+    """
+    units = _split_units([_TAG.split(segment)], _SENTENCE_END)
+    units = _refine(units, max_bytes, [_WORD_END, _CHARACTER])
+    return _pack_units(units, max_bytes)
+
+
+def _split_units(units, pattern):
+    """Split each unit (a list of tags and texts) after every match of pattern in its texts."""
+    result = []
+    for unit in units:
+        current = []
+        for part in unit:
+            if not part:
+                continue
+            if part.startswith('<'):
+                current.append(part)
+                continue
+            start = 0
+            for match in pattern.finditer(part):
+                if match.end() == len(part):
+                    break
+                current.append(part[start:match.end()])
+                result.append(current)
+                current = []
+                start = match.end()
+            current.append(part[start:])
+        if current:
+            result.append(current)
+    return result
+
+
+def _refine(units, max_bytes, patterns, stack=()):
+    """Split units that do not fit into a piece of their own with the next pattern."""
+    result = []
+    for unit in units:
+        after = _update_stack(stack, unit)
+        size = byte_length(''.join(stack) + ''.join(unit) + _closing(after))
+        if size > max_bytes and patterns:
+            pattern = patterns[0]
+            if pattern is _CHARACTER:
+                smaller = [[piece] for part in unit for piece in
+                           ([part] if part.startswith('<') else pattern.findall(part))]
+            else:
+                smaller = _split_units([unit], pattern)
+            result.extend(_refine(smaller, max_bytes, patterns[1:], stack))
+        else:
+            result.append(unit)
+        stack = after
+    return result
+
+
+def _pack_units(units, max_bytes):
+    pieces = []
+    stack = ()
+    current = []
+    size = 0
+    has_content = False
+    for unit in units:
+        text = ''.join(unit)
+        after = _update_stack(stack, unit)
+        if has_content and size + byte_length(text + _closing(after)) > max_bytes:
+            pieces.append(''.join(current) + _closing(stack))
+            # reopen the tags that are still open
+            current = [''.join(stack)]
+            size = byte_length(current[0])
+        current.append(text)
+        size += byte_length(text)
+        has_content = True
+        stack = after
+    if has_content:
+        pieces.append(''.join(current) + _closing(stack))
+    return pieces
+
+
+def _update_stack(stack, unit):
+    """Return the open tags after unit, given the open tags before it as a tuple."""
+    tags = [part for part in unit if part.startswith('<')]
+    if not tags:
+        return stack
+    stack = list(stack)
+    for tag in tags:
+        if tag.endswith('/>') or tag.startswith('<!'):
+            continue
+        if tag.startswith('</'):
+            if stack:
+                stack.pop()
+        else:
+            stack.append(tag)
+    return tuple(stack)
+
+
+@functools.lru_cache(maxsize=256)
+def _closing(stack):
+    return ''.join('</' + re.match(r'<([^\s>/]+)', tag).group(1) + '>' for tag in reversed(stack))
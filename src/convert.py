@@ -3,7 +3,11 @@ import os.path
 import subprocess
 import zipfile
 
-from bs4 import BeautifulSoup
+from src.html_rewriter import STYLESHEETS, rewrite_html
+from src.profiling import span
+from src.section_index import SectionIndexer
+from src.tex_split import tex_to_html_parallel
+from src.vendor import vendor_stylesheets
 
 
 def mmd_to_tex(file_path):
@@ -22,92 +26,45 @@ def mmd_to_tex(file_path):
     os.remove(zip_file)
 
 
-def tex_to_html(file_path, out_path):
-    """Convert tex to html using LaTeXML."""
+def tex_to_html(file_path, out_path, processes=1):
+    """
+    Convert tex to html using LaTeXML.
+    Args:
+        processes: if more than 1, the chapters or sections are converted in parallel LaTeXML processes
+    """
     base_path, file_extension = os.path.splitext(file_path)
     if not file_extension.lower() == '.tex':
         raise ValueError(f'{file_path} is not a tex file')
+    if processes > 1 and tex_to_html_parallel(file_path, out_path, processes):
+        return
     command = f'latexmlc "{base_path + ".tex"}" --dest="{os.path.join(out_path, os.path.basename(base_path) + ".html")}"'
     process = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if process.returncode != 0:
         raise RuntimeError(f"LaTeXML conversion failed: {process.stderr.decode('utf-8')}")
 
 
-def append_stylesheet(doc, href):
-    """Adds a stylesheet link to the HTML document."""
-    style_tag = doc.new_tag('link', rel='stylesheet', href=href)
-    doc.head.append(style_tag)
-
-
-def append_script(doc, src, onload=None):
-    """Adds a script tag to the HTML document with optional onload handler."""
-    script_tag = doc.new_tag('script', src=src)
-    if onload:
-        script_tag.string = f'window.onload = function() {{ {onload} }}'
-    doc.head.append(script_tag)
-
-
-def is_theorem(element):
-    return element.get_text().lstrip().startswith(('Theorem', 'Lemma', 'Corollary', 'Proposition', 'Definition', 'Remark'))
-
-
-def wrap_theorems(doc):
-    headings = doc.select('h2, h3, h4, h6')
-
-    for heading in headings:
-        add_button(doc, heading)
-
-    # find .ltx_para elements whose text content starts with "Theorem", "Lemma", "Corollary", "Proposition", "Definition", "Example", "Remark"
-    paras = doc.select('.ltx_para')
-    for para in paras:
-        if is_theorem(para):
-            # put this and all subsequent elements into a section element, until there is another element with the same class
-            section = doc.new_tag('section')
-            section['class'] = 'ltx_theorem'
-            para.insert_before(section)
-            section.append(para)
-            next_element = section.find_next_sibling()
-            while next_element and not is_theorem(next_element):
-                section.append(next_element)
-                next_element = section.find_next_sibling()
-
-            add_button(doc, para)
-
-    return doc
-
-
-def add_button(doc, element):
-    new_button = doc.new_tag('button')
-    new_button['onclick'] = 'handleExplainButton(this)'
-    new_button['class'] = 'explain-section-button'
-    explain_span = doc.new_tag('span')
-    explain_span['class'] = 'material-icons-round'
-    explain_span.string = 'auto_awesome'
-
-    new_button.append(explain_span)
-    element.insert_before(new_button)
-
-
-def process_html(file_path):
-    """Remove Mathpix styling and add reference to custom css."""
+def process_html(file_path, static_math=False):
+    """
+    Remove Mathpix styling and add references to custom css and scripts, explain buttons and theorem sections.
+    The section index used by the explain buttons is written next to the html file, see section_index_path.
+    Args:
+        static_math: replace the math by static MathML instead of loading the math runtime with the page, and
+            link local copies of the stylesheets, downloaded to vendor/ next to the html file, so that the page
+            can be opened offline
+    """
     with open(file_path, 'r') as f:
         html_content = f.read()
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    soup.html['data-theme'] = 'dark'
-
-    # Add stylesheets
-    append_stylesheet(soup, 'https://ar5iv.labs.arxiv.org/assets/ar5iv-fonts.0.7.9.min.css')
-    append_stylesheet(soup, 'https://ar5iv.labs.arxiv.org/assets/ar5iv.0.7.9.min.css')
-    append_stylesheet(soup, 'https://ar5iv.labs.arxiv.org/assets/ar5iv-site.0.2.2.css')
-    append_stylesheet(soup, 'https://fonts.googleapis.com/icon?family=Material+Icons+Round')
-    append_stylesheet(soup, './styles_latexml.css')
+    indexer = SectionIndexer()
+    index_file = section_index_path(file_path)
+    stylesheets = vendor_stylesheets(STYLESHEETS, os.path.dirname(file_path)) if static_math else STYLESHEETS
+    with span('rewrite html', 'html', characters=len(html_content)):
+        html_content = rewrite_html(html_content, indexer=indexer, index_file=os.path.basename(index_file),
+                                    static_math=static_math, stylesheets=stylesheets)
+    with open(file_path, 'w') as f:
+        f.write(html_content)
+    with span('section index', 'html', passages=len(indexer.passages)):
+        indexer.save(index_file)
 
-    # Add script
-    append_script(soup, 'https://cdn.jsdelivr.net/npm/mathpix-markdown-it@1.0.40/es5/bundle.js',
-                  onload='window.loadMathJax()')
-    append_script(soup, './script_latexml.js')
 
-    soup = wrap_theorems(soup)
-    with open(file_path, 'w') as f:
-        f.write(soup.prettify())
+def section_index_path(file_path):
+    return os.path.splitext(file_path)[0] + '.index.json'
@@ -0,0 +1,237 @@
+"""Post-processes LaTeXML html in a single streaming pass, keeping the markup as it is apart from the additions."""
+import functools
+import html
+import re
+from html.parser import HTMLParser
+from typing import List
+
+STYLESHEETS = [
+    'https://ar5iv.labs.arxiv.org/assets/ar5iv-fonts.0.7.9.min.css',
+    'https://ar5iv.labs.arxiv.org/assets/ar5iv.0.7.9.min.css',
+    'https://ar5iv.labs.arxiv.org/assets/ar5iv-site.0.2.2.css',
+    'https://fonts.googleapis.com/icon?family=Material+Icons+Round',
+    './styles_latexml.css',
+]
+MARKDOWN_BUNDLE = 'https://cdn.jsdelivr.net/npm/mathpix-markdown-it@1.0.40/es5/bundle.js'
+# (src, onload)
+SCRIPTS = [
+    (MARKDOWN_BUNDLE, 'window.loadMathJax()'),
+    ('./script_latexml.js', None),
+]
+# pages with static math do not load the markdown bundle, script_latexml.js loads it for the first explanation
+STATIC_SCRIPTS = [('./script_latexml.js', None)]
+THEOREM_WORDS = ('Theorem', 'Lemma', 'Corollary', 'Proposition', 'Definition', 'Remark')
+BUTTON_HEADINGS = {'h2', 'h3', 'h4', 'h6'}
+EXPLAIN_BUTTON = ('<button class="explain-section-button" onclick="handleExplainButton(this)">'
+                  '<span class="material-icons-round">auto_awesome</span></button>')
+THEOREM_SECTION = '<section class="ltx_theorem">'
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track',
+             'wbr'}
+
+_ANNOTATION = re.compile(r'<annotation(?:-xml)?\b.*?</annotation(?:-xml)?>', re.DOTALL)
+_SEMANTICS = re.compile(r'</?semantics\b[^>]*>')
+
+# the text of an element is known to start with a theorem word or not once this many characters have been seen
+_DECISION_LENGTH = max(map(len, THEOREM_WORDS))
+
+
+def head_markup(stylesheets=STYLESHEETS, scripts=SCRIPTS) -> str:
+    parts = [f'<link href="{html.escape(href)}" rel="stylesheet"/>' for href in stylesheets]
+    for src, onload in scripts:
+        body = f'window.onload = function() {{ {onload} }}' if onload else ''
+        parts.append(f'<script src="{html.escape(src)}">{body}</script>')
+    return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def static_mathml(markup: str) -> str:
+    """
+    Presentation MathML of a LaTeXML <math> element, which browsers render without a script: the content MathML
+    and TeX annotations are removed, the TeX is kept in the alttext attribute. Formulas repeat within and across
+    documents, so the results are cached.
+    """
+    return _SEMANTICS.sub('', _ANNOTATION.sub('', markup))
+
+
+class _Element:
+    __slots__ = ('tag', 'parent', 'slot', 'is_para', 'text', 'decided', 'section_open')
+
+    def __init__(self, tag, parent, slot, is_para):
+        self.tag = tag
+        self.parent = parent
+        # index of the output piece right before the start tag, where a section or a button can be inserted
+        self.slot = slot
+        self.is_para = is_para
+        # start of the text content while it is not known whether it starts with a theorem word
+        self.text = ''
+        self.decided = False
+        # whether a theorem section is open among the children of this element
+        self.section_open = False
+
+
+class LaTeXMLRewriter(HTMLParser):
+    """
+    Rewrites LaTeXML html while it is parsed:
+    - sets data-theme="dark" on <html> and appends stylesheets and scripts to <head>
+    - inserts an explain button before each h2, h3, h4 and h6
+    - wraps each .ltx_para whose text starts with a theorem word, e.g. 'Lemma', together with its following
+      siblings up to the next sibling that starts with a theorem word, in <section class="ltx_theorem">, and
+      inserts an explain button before the paragraph
+    Whether an element starts with a theorem word is only known after its first characters have been parsed,
+    so an empty slot is kept in front of each element, which is filled in once this is known.
+    """
+    def __init__(self, theme='dark', head=None, indexer=None, math=None):
+        """
+        Args:
+            indexer: receives start(tag, attrs), end(tag) and text(data) for the elements of the original page,
+                e.g. a SectionIndexer
+            math: called with the markup of each <math> element to return its replacement, e.g. static_mathml
+        """
+        super().__init__(convert_charrefs=False)
+        self.theme = theme
+        self.head = head_markup() if head is None else head
+        self.indexer = indexer
+        self.math = math
+        self.out: List[str] = []
+        self.root = _Element(None, None, None, False)
+        self.root.decided = True
+        self.stack = [self.root]
+        # elements whose text is still needed to decide whether they start with a theorem word
+        self.pending: List[_Element] = []
+        self.head_written = False
+
+    def rewrite(self, content: str) -> str:
+        self.feed(content)
+        self.close()
+        for element in self.stack[::-1]:
+            self._end(element)
+        return ''.join(self.out)
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, self.get_starttag_text())
+        if tag in VOID_TAGS:
+            self._end(self.stack.pop())
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, self.get_starttag_text())
+        self._end(self.stack.pop())
+
+    def handle_endtag(self, tag):
+        if tag == 'head' and not self.head_written:
+            self.out.append(self.head)
+            self.head_written = True
+        # close elements that were left open, ignore end tags without a start tag
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                element = self.stack[i]
+                while len(self.stack) > i:
+                    self._end(self.stack.pop())
+                self.out.append(f'</{tag}>')
+                if tag == 'math' and self.math:
+                    # the pieces after the slot of the element are its markup, no slot after it is pending
+                    self.out[element.slot + 1:] = [self.math(''.join(self.out[element.slot + 1:]))]
+                return
+
+    def handle_data(self, data):
+        self.out.append(data)
+        self._add_text(data)
+        if self.indexer:
+            self.indexer.text(data)
+
+    def handle_entityref(self, name):
+        self.out.append(f'&{name};')
+        self._add_text(html.unescape(f'&{name};'))
+        if self.indexer:
+            self.indexer.text(html.unescape(f'&{name};'))
+
+    def handle_charref(self, name):
+        self.out.append(f'&#{name};')
+        self._add_text(html.unescape(f'&#{name};'))
+        if self.indexer:
+            self.indexer.text(html.unescape(f'&#{name};'))
+
+    def handle_comment(self, data):
+        self.out.append(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self.out.append(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self.out.append(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        # marked sections, CDATA sections end with ]]>
+        self.out.append(f'<![{data}]]>' if data.startswith('CDATA[') else f'<![{data}]>')
+
+    def _start(self, tag, attrs, text):
+        if tag == 'html' and self.theme:
+            attrs = [(name, value) for name, value in attrs if name != 'data-theme'] + [('data-theme', self.theme)]
+            text = '<html' + ''.join(f' {name}' if value is None else f' {name}="{html.escape(value)}"'
+                                     for name, value in attrs) + '>'
+        elif tag == 'body' and not self.head_written:
+            self.out.append(f'<head>{self.head}</head>')
+            self.head_written = True
+        parent = self.stack[-1]
+        is_para = 'ltx_para' in (dict(attrs).get('class') or '').split()
+        element = _Element(tag, parent, len(self.out), is_para)
+        self.out.append(EXPLAIN_BUTTON if tag in BUTTON_HEADINGS else '')
+        self.out.append(text)
+        self.stack.append(element)
+        if self.indexer:
+            self.indexer.start(tag, attrs)
+        if parent.section_open or is_para:
+            self.pending.append(element)
+        else:
+            element.decided = True
+
+    def _end(self, element):
+        if self.indexer and element.tag is not None:
+            self.indexer.end(element.tag)
+        if not element.decided:
+            self._decide(element)
+        if element.section_open:
+            self.out.append('</section>')
+
+    def _add_text(self, data):
+        if not self.pending:
+            return
+        for element in list(self.pending):
+            element.text = (element.text + data).lstrip()
+            if len(element.text) >= _DECISION_LENGTH:
+                self._decide(element)
+
+    def _decide(self, element):
+        element.decided = True
+        self.pending.remove(element)
+        is_theorem = element.text.startswith(THEOREM_WORDS)
+        element.text = ''
+        if not is_theorem:
+            return
+        parent = element.parent
+        prefix = ''
+        if parent.section_open:
+            prefix += '</section>'
+            parent.section_open = False
+        if element.is_para:
+            prefix += THEOREM_SECTION + EXPLAIN_BUTTON
+            parent.section_open = True
+        self.out[element.slot] = prefix + self.out[element.slot]
+
+
+def rewrite_html(content: str, theme='dark', indexer=None, index_file=None, static_math=False,
+                 stylesheets=STYLESHEETS) -> str:
+    """
+    Return the post-processed LaTeXML html, see LaTeXMLRewriter.
+    Args:
+        indexer: is fed the elements of the page while it is rewritten, see SectionIndexer
+        index_file: url of the section index, added to the head for out/script_latexml.js
+        static_math: replace the math by static MathML and do not load the markdown bundle with the page
+        stylesheets: hrefs of the stylesheets, e.g. of local copies
+    """
+    meta = ''
+    if index_file:
+        meta += f'<meta name="section-index" content="{html.escape(index_file)}"/>'
+    if static_math:
+        meta += f'<meta name="markdown-bundle" content="{html.escape(MARKDOWN_BUNDLE)}"/>'
+    head = meta + head_markup(stylesheets, STATIC_SCRIPTS if static_math else SCRIPTS)
+    return LaTeXMLRewriter(theme, head, indexer, static_mathml if static_math else None).rewrite(content)
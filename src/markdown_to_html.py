@@ -1,131 +1,182 @@
+import functools
+import json
 import re
-import subprocess
-from typing import List
+from typing import Iterable, Iterator, List
+
+from src.audio import atomic_write
+from src.authors import author_detector
+from src.chunker import MAX_REQUEST_BYTES, pack_chunks
+from src.profiling import span
+from src.replacements import text_rules
+from src.ssml import SSMLRenderer, segment_text
+
+
+# number of text segments at the start of a paper that may be author lines
+AUTHOR_CANDIDATES = 6
+_HEADING = re.compile(r'#{1,6}(?:[ \t]|$)')
+_FENCE = re.compile(r' {0,3}(`{3,}|~{3,})')
+
+
+@functools.lru_cache(maxsize=None)
+def markdown_parser():
+    """The markdown-it parser with the plugins for Nougat output, imported and built on first use."""
+    from markdown_it import MarkdownIt
+    from mdit_py_plugins.front_matter import front_matter_plugin
+    from mdit_py_plugins.footnote import footnote_plugin
+    from mdit_py_plugins.deflist import deflist_plugin
+    from mdit_py_plugins.tasklists import tasklists_plugin
+    from mdit_py_plugins.field_list import fieldlist_plugin
+    from mdit_py_plugins.anchors import anchors_plugin
+    # from mdit_py_plugins.container import container_plugin
+    from mdit_py_plugins.attrs import attrs_plugin
+    from mdit_py_plugins.texmath import texmath_plugin
+
+    return (MarkdownIt('commonmark', {})
+            .use(front_matter_plugin)
+            .use(footnote_plugin)
+            .use(deflist_plugin)
+            .use(tasklists_plugin)
+            .use(fieldlist_plugin)
+            .use(anchors_plugin, max_level=6)
+            # .use(container_plugin)
+            .use(attrs_plugin)
+            .use(texmath_plugin, delimiters='brackets'))
+
+
+def needs_author_check(lines: Iterable[str]) -> bool:
+    """Whether the markdown is a paper, with an abstract or introduction, whose first lines may list the authors."""
+    return any('# abstract' in line.lower() or '# introduction' in line.lower() for line in lines)
+
+
+def split_sections(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Group the lines of markdown into sections that can be parsed one at a time. A section starts at a heading at the
+    start of a line after a blank line, outside of fenced code and display math, where no block can continue.
+    """
+    section = []
+    fence = None
+    in_math = False
+    previous_blank = True
+    for line in lines:
+        if fence:
+            if line.lstrip(' ').startswith(fence) and not line.strip().strip(fence[0]):
+                fence = None
+        else:
+            if not in_math and previous_blank and section and _HEADING.match(line):
+                yield ''.join(section)
+                section = []
+            match = _FENCE.match(line)
+            if match:
+                fence = match.group(1)
+            elif line.count('\\[') != line.count('\\]'):
+                in_math = line.count('\\[') > line.count('\\]')
+        section.append(line)
+        previous_blank = not line.strip()
+    if section:
+        yield ''.join(section)
+
+
+def render_sections(sections: Iterable[str]) -> Iterator[str]:
+    """Yield the non-empty SSML segments of each section of markdown, with the text rules applied."""
+    for content in sections:
+        with span('parse markdown', 'markdown', characters=len(content)):
+            tokens = markdown_parser().parse(content)
+        with span('render ssml', 'markdown', tokens=len(tokens)):
+            segments = SSMLRenderer().render(tokens)
+        with span('text rules', 'markdown', segments=len(segments)):
+            yield from (segment for segment in map(text_rules.apply, segments) if segment)
+
+
+def remove_authors(segments: List[str]) -> List[str]:
+    """Remove the author lines among the first AUTHOR_CANDIDATES text segments."""
+    indices = [i for i, segment in enumerate(segments) if segment_text(segment)][:AUTHOR_CANDIDATES]
+    elements = [segment_text(segments[i]) for i in indices]
+    # if longest element is >300 characters, remove all subsequent elements
+    while elements and len(max(elements, key=len)) > 300:
+        elements = elements[:-1]
+    with span('author detection', 'markdown', lines=len(elements)):
+        verdicts = author_detector.is_authors(elements)
+    removed = {indices[i] for i, is_author in enumerate(verdicts) if is_author}
+    return [segment for i, segment in enumerate(segments) if i not in removed]
+
+
+def stream_segments(sections: Iterable[str], check_authors: bool) -> Iterator[str]:
+    """
+    Yield the SSML segments of the sections of a markdown document. Only the segments up to the last author candidate
+    are held back for author detection, so memory is proportional to the largest section, not to the document.
+    """
+    segments = render_sections(sections)
+    if check_authors:
+        head = []
+        candidates = 0
+        for segment in segments:
+            head.append(segment)
+            candidates += bool(segment_text(segment))
+            if candidates == AUTHOR_CANDIDATES:
+                break
+        yield from remove_authors(head)
+    yield from segments
+
+
+def markdown_file_segments(path) -> Iterator[str]:
+    """
+    Yield the SSML segments of a markdown file section by section, see split_sections, without reading the file into
+    memory. Footnotes and link reference definitions only apply within their section.
+    """
+    with open(path, encoding='utf-8') as f:
+        check_authors = needs_author_check(f)
+    with open(path, encoding='utf-8') as f:
+        yield from stream_segments(split_sections(f), check_authors)
+
+
+def save_segments(segments: Iterable[str], path):
+    """
+    Write SSML segments as a json list with one segment per line, as they are generated, so that load_segments can
+    read them back one at a time.
+    """
+    with atomic_write(path) as f:
+        f.write(b'[')
+        for i, segment in enumerate(segments):
+            f.write((',\n' if i else '\n').encode() + json.dumps(segment, ensure_ascii=False).encode('utf-8'))
+        f.write(b'\n]\n')
+
+
+def load_segments(path) -> Iterator[str]:
+    """Yield the segments saved with save_segments one at a time, or all at once from a json list on one line."""
+    with open(path, encoding='utf-8') as f:
+        if f.readline().strip() != '[':
+            f.seek(0)
+            yield from json.load(f)
+            return
+        for line in f:
+            line = line.strip().removesuffix(',')
+            if line != ']':
+                yield json.loads(line)
 
-from bs4 import BeautifulSoup
-from markdown_it import MarkdownIt
-from mdit_py_plugins.front_matter import front_matter_plugin
-from mdit_py_plugins.footnote import footnote_plugin
-from mdit_py_plugins.deflist import deflist_plugin
-from mdit_py_plugins.tasklists import tasklists_plugin
-from mdit_py_plugins.field_list import fieldlist_plugin
-from mdit_py_plugins.anchors import anchors_plugin
-# from mdit_py_plugins.container import container_plugin
-from mdit_py_plugins.attrs import attrs_plugin
-from mdit_py_plugins.texmath import texmath_plugin
 
-from src.replacements import text_replacements, math_replacements
+class MarkdownModel:
+    def __init__(self) -> None:
+        # SSML of the top-level elements, in document order
+        self.segments = []
 
-GEMMA_CPP_PATH = '/Users/k/Documents/Code/gemma.cpp/build/gemma'
+    @property
+    def ssml(self) -> str:
+        return ''.join(self.segments)
 
+    def save(self, path):
+        """Save the SSML segments as json, so that speech can be synthesized without parsing the markdown again."""
+        save_segments(self.segments, path)
 
-class MarkdownModel:
-    def __init__(self) -> None:
-        self.ssml = ''
+    @classmethod
+    def load(cls, path) -> 'MarkdownModel':
+        model = cls()
+        model.segments = list(load_segments(path))
+        return model
 
     def markdown_to_html(self, content: str):
-        def is_authors(text: str) -> List[bool]:
-            result = subprocess.run(
-                [GEMMA_CPP_PATH, '--', '--tokenizer', '/Users/k/Documents/Code/gemma.cpp/build/tokenizer.spm', '--compressed_weights', '/Users/k/Documents/Code/gemma.cpp/build/2b-it-sfp.sbs', '--model', '2b-it', '--verbosity', '0'],
-                input='You are provided with lines extracted from various scientific papers. Your task is to determine whether each line represents the list of authors. Here is how to decide. Author List (True): Typically includes names (e.g., Sarah Wilson), Michael Johnson). Not an Author List (False): Could be any other part of the paper, such as the title, sentences from the abstract or body, figure captions, etc. ' + text,
-                capture_output=True,
-                text=True
-            )
-            result = subprocess.run(
-                [GEMMA_CPP_PATH, '--', '--tokenizer', '/Users/k/Documents/Code/gemma.cpp/build/tokenizer.spm', '--compressed_weights', '/Users/k/Documents/Code/gemma.cpp/build/2b-it-sfp.sbs', '--model', '2b-pt', '--verbosity', '0'],
-                input='<start_of_turn>user Your task is to determine whether each line represents the list of authors (True / False).<end_of_turn>' + '<start_of_turn>model ' + ' '.join(result.stdout.split("\n")) + '<start_of_turn>user Convert your answer to booleans for each line.<end_of_turn><start_of_turn>model',
-                capture_output=True,
-                text=True
-            )
-            # convert result containing some "True" and "False" to list of booleans
-            boolean_list = [word.lower() == 'true' for word in result.stdout.split() if word.lower() in ['true', 'false']]
-            return boolean_list
-
-        needs_author_check = '# abstract' in content.lower() or '# introduction' in content.lower()
-
-        md = (MarkdownIt(
-            'commonmark',
-            {}
-        )
-              .use(front_matter_plugin)
-              .use(footnote_plugin)
-              .use(deflist_plugin)
-              .use(tasklists_plugin)
-              .use(fieldlist_plugin)
-              .use(anchors_plugin, max_level=6)
-              # .use(container_plugin)
-              .use(attrs_plugin)
-              .use(texmath_plugin, delimiters='brackets'))
-        rendered = md.render(content)
-
-        # prepare html for text-to-speech
-        soup = BeautifulSoup(rendered, 'html.parser')
-        # replace latex commands inside <eq> tag with their text representation
-        for eq in soup.find_all(['eq']):
-            for pattern, replacement in math_replacements:
-                eq.string = re.sub(pattern, ' ' + replacement + ' ', eq.get_text())
-            eq.string = re.sub(r' +', ' ', eq.get_text()).strip()
-
-        # remove attributes from tags
-        for tag in soup.find_all(True):
-            tag.attrs = {}
-
-        for elem in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-            elem.name = 'p'
-            elem.insert_after(soup.new_tag('break', time='0.5s'))
-            elem.insert_before(soup.new_tag('break', time='0.5s'))
-
-        for elem in soup.find_all('li'):
-            elem.name = 'p'
-
-        # remove ol, ul tags
-        for elem in soup.find_all(['ol', 'ul', 'eq', 'section']):
-            elem.unwrap()
-
-        for elem in soup.find_all(['em', 'strong']):
-            elem.name = 'emphasis'
-
-        for elem in soup.find_all(['a']):
-            elem.unwrap()
-
-        for elem in soup.find_all(['img', 'table', 'eqn']):
-            elem.decompose()
-
-        self.ssml = str(soup)
-
-        for pattern, replacement in text_replacements:
-            self.ssml = re.sub(pattern, replacement, self.ssml)
-
-        if needs_author_check:
-            soup = BeautifulSoup(self.ssml, 'html.parser')
-            tags = [tag for tag in soup.children if tag.get_text() and tag.get_text() != "\n"][:6]
-            elements = [tag.get_text() for tag in tags]
-            # if longest element is >300 characters, remove all subsequent elements
-            while elements and len(max(elements, key=len)) > 300:
-                elements = elements[:-1]
-            prompt = ""
-            for i, elem in enumerate(elements):
-                elem = re.sub(r'\d+', '', elem)
-                prompt += f'{i + 1}: "' + elem + '", '
-            try:
-                remove = is_authors(prompt[:-2])
-                assert len(remove) == len(elements)
-                for i, elem in enumerate(tags):
-                    if remove[i]:
-                        # replace only the first occurrence
-                        self.ssml = self.ssml.replace(str(elem), '', 1)
-            except Exception as e:
-                print(f"Removing authors using Gemma.cpp failed: {e}")
-
-    def get_chunk(self) -> str:
-        # break after </p> if current chunk length exceeds 4500 characters
-        chunk = ''
-        soup = BeautifulSoup(self.ssml, 'html.parser')
-        for tag in soup.children:
-            tag_str = str(tag)
-            if len(chunk) + len(tag_str) > 4500:
-                yield chunk
-                chunk = tag_str
-            else:
-                chunk += tag_str
-        yield chunk
+        """Convert markdown to SSML segments, rendered directly from the markdown-it token stream."""
+        self.segments = list(stream_segments([content], needs_author_check([content])))
+
+    def get_chunk(self, max_bytes: int = MAX_REQUEST_BYTES) -> str:
+        """Yield chunks of SSML that fit into one text-to-speech request of max_bytes, including the <speak> tags."""
+        yield from pack_chunks(self.segments, max_bytes)
@@ -0,0 +1,235 @@
+"""Reads out inline LaTeX math, e.g. \\frac{a}{\\sqrt{b}} -> a over square root of b."""
+import functools
+import re
+
+from src.replacements import math_symbols, math_operators, math_superscripts, math_accents, math_fonts, math_ignored
+
+_TOKEN = re.compile(r'\\[a-zA-Z]+|\\.|\s+|.', re.DOTALL)
+
+# number of mandatory arguments of commands that take arguments
+_ARITY = {'frac': 2, 'dfrac': 2, 'tfrac': 2, 'binom': 2, 'sqrt': 1, **{name: 1 for name in math_accents},
+          **{name: 1 for name in math_fonts}}
+
+
+def tokenize(latex: str):
+    """Split latex into control sequences ('\\alpha'), single characters and whitespace (' ')."""
+    return [' ' if token.isspace() else token for token in _TOKEN.findall(latex)]
+
+
+def parse(tokens):
+    """
+    Parse tokens into a list of nodes:
+        ('char', c), ('group', nodes), ('sup', nodes), ('sub', nodes), ('cmd', name, args, optional_arg)
+    """
+    nodes, _ = _parse_sequence(tokens, 0, None)
+    return nodes
+
+
+def _parse_sequence(tokens, pos, closing):
+    nodes = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == closing:
+            return nodes, pos + 1
+        if token == '{':
+            group, pos = _parse_sequence(tokens, pos + 1, '}')
+            nodes.append(('group', group))
+            continue
+        if token in '^_':
+            argument, pos = _parse_argument(tokens, pos + 1)
+            nodes.append(('sup' if token == '^' else 'sub', argument))
+            continue
+        pos += 1
+        if token == '}':
+            # unbalanced closing brace
+            continue
+        if token.startswith('\\'):
+            node, pos = _parse_command(tokens, pos, token[1:])
+            nodes.append(node)
+        else:
+            nodes.append(('char', token))
+    return nodes, pos
+
+
+def _parse_argument(tokens, pos):
+    """Parse a command argument or script: a braced group or a single token."""
+    while pos < len(tokens) and tokens[pos] == ' ':
+        pos += 1
+    if pos >= len(tokens):
+        return [], pos
+    if tokens[pos] == '{':
+        return _parse_sequence(tokens, pos + 1, '}')
+    if tokens[pos].startswith('\\'):
+        node, pos = _parse_command(tokens, pos + 1, tokens[pos][1:])
+        return [node], pos
+    return [('char', tokens[pos])], pos + 1
+
+
+def _parse_command(tokens, pos, name):
+    if name.isalpha() and pos < len(tokens) and tokens[pos] == ' ':
+        # spaces after control words are not part of the formula
+        pos += 1
+    optional = None
+    if name == 'sqrt' and pos < len(tokens) and tokens[pos] == '[':
+        optional, pos = _parse_sequence(tokens, pos + 1, ']')
+    args = []
+    for _ in range(_ARITY.get(name, 0)):
+        argument, pos = _parse_argument(tokens, pos)
+        args.append(argument)
+    return ('cmd', name, args, optional), pos
+
+
+def source(nodes) -> str:
+    """Normalized LaTeX source of nodes, used to look up special arguments."""
+    parts = []
+    for node in nodes:
+        if node[0] == 'char':
+            parts.append(node[1])
+        elif node[0] == 'cmd':
+            parts.append('\\' + node[1] + ''.join('{' + source(arg) + '}' for arg in node[2]))
+        elif node[0] == 'group':
+            parts.append('{' + source(node[1]) + '}')
+        else:
+            parts.append(('^' if node[0] == 'sup' else '_') + '{' + source(node[1]) + '}')
+    return ''.join(parts).strip()
+
+
+class _Speech:
+    """Collects words. Consecutive plain characters are read as one word, e.g. f(x)."""
+    def __init__(self):
+        self.words = []
+        # characters of the current word, joined once the word ends
+        self.run = []
+
+    def char(self, char):
+        self.run.append(char)
+
+    def word(self, word):
+        self.pause()
+        if word:
+            self.words.append(word)
+
+    def pause(self):
+        if self.run:
+            self.words.append(''.join(self.run))
+            self.run = []
+
+    def text(self) -> str:
+        self.pause()
+        return ' '.join(self.words)
+
+
+def _speak(nodes, speech):
+    i = 0
+    while i < len(nodes):
+        node = nodes[i]
+        kind = node[0]
+        if kind == 'char':
+            char = node[1]
+            if char in math_operators:
+                speech.word(math_operators[char])
+            elif char in ' {}':
+                speech.pause()
+            else:
+                speech.char(char)
+        elif kind == 'group':
+            speech.pause()
+            _speak(node[1], speech)
+            speech.pause()
+        elif kind == 'sup' and source(node[1]) in math_superscripts:
+            speech.word(math_superscripts[source(node[1])])
+        elif kind in ('sup', 'sub'):
+            speech.pause()
+            _speak(node[1], speech)
+            speech.pause()
+        elif node[1] == 'lVert' and _command_at(nodes, i + 1, 'cdot') and _command_at(nodes, i + 2, 'rVert'):
+            # \lVert\cdot\rVert is the norm itself
+            speech.word('norm')
+            i += 2
+        else:
+            _speak_command(node, speech)
+        i += 1
+
+
+def _command_at(nodes, i, name):
+    return i < len(nodes) and nodes[i][0] == 'cmd' and nodes[i][1] == name
+
+
+def _speak_command(node, speech):
+    _, name, args, optional = node
+    if name in ('frac', 'dfrac', 'tfrac'):
+        _speak(args[0], speech)
+        speech.word('over')
+        _speak(args[1], speech)
+    elif name == 'binom':
+        _speak(args[0], speech)
+        speech.word('choose')
+        _speak(args[1], speech)
+    elif name == 'sqrt':
+        index = source(optional) if optional is not None else ''
+        if not index:
+            speech.word('square root of')
+        elif index == '3':
+            speech.word('cube root of')
+        else:
+            speech.word(verbalize_math(index) + '-th root of')
+        _speak(args[0], speech)
+    elif name in math_accents:
+        speech.pause()
+        _speak(args[0], speech)
+        speech.word(math_accents[name])
+    elif name in math_fonts:
+        special = math_fonts[name].get(source(args[0]))
+        if special:
+            speech.word(special)
+        else:
+            speech.pause()
+            _speak(args[0], speech)
+            speech.pause()
+    elif name in math_symbols:
+        speech.word(math_symbols[name])
+    elif name in math_ignored:
+        pass
+    elif name in (',', ';', ':'):
+        # thin spaces are read as a short pause
+        speech.char(',')
+    elif not name.isalpha():
+        # line breaks, escaped braces, \| ...
+        speech.pause()
+    else:
+        speech.word(name)
+
+
+def _speak_tokens(tokens, speech):
+    """Read tokens one by one, without structure, for formulas nested too deeply to be parsed."""
+    for token in tokens:
+        if token in math_operators:
+            speech.word(math_operators[token])
+        elif token in ' {}^_':
+            speech.pause()
+        elif not token.startswith('\\'):
+            speech.char(token)
+        elif token[1:] in math_symbols:
+            speech.word(math_symbols[token[1:]])
+        elif token[1:].isalpha() and token[1:] not in math_ignored and token[1:] not in _ARITY:
+            speech.word(token[1:])
+        else:
+            speech.pause()
+
+
+def verbalize_math(latex: str) -> str:
+    """Return the spoken form of an inline LaTeX formula."""
+    return _verbalize_normalized(' '.join(latex.split()))
+
+
+@functools.lru_cache(maxsize=8192)
+def _verbalize_normalized(latex: str) -> str:
+    tokens = tokenize(latex)
+    speech = _Speech()
+    try:
+        _speak(parse(tokens), speech)
+    except RecursionError:
+        # e.g. more than about a thousand nested braces
+        speech = _Speech()
+        _speak_tokens(tokens, speech)
+    return speech.text()
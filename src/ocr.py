@@ -0,0 +1,192 @@
+"""Converts PDFs to markdown with Nougat, keeping the model loaded across PDFs."""
+import functools
+import os
+import re
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List
+
+from src.profiling import span
+
+MODEL_TAG = '0.1.0-base'
+
+
+class NougatWorker:
+    def __init__(self, model_tag=MODEL_TAG, batch_size=None, full_precision=False, skipping=False):
+        """
+        Load the Nougat model once, so that any number of PDFs can be converted without paying for
+        interpreter startup and model loading each time, unlike calling the nougat command per PDF.
+        Args:
+            model_tag: Nougat checkpoint, downloaded on first use
+            batch_size: number of pages per batch, None for nougat's default for the available device
+            full_precision: use float32 instead of bfloat16
+            skipping: mark pages on which the model repeats itself as missing (nougat's failure detection)
+        """
+        import torch
+        from nougat import NougatModel
+        from nougat.utils.checkpoint import get_checkpoint
+        from nougat.utils.device import default_batch_size, move_to_device
+
+        self.batch_size = default_batch_size() if batch_size is None else batch_size
+        self.skipping = skipping
+        self.model = NougatModel.from_pretrained(get_checkpoint(None, model_tag=model_tag))
+        self.model = move_to_device(self.model, bf16=not full_precision, cuda=self.batch_size > 0)
+        self.batch_size = max(self.batch_size, 1)
+        self.model.eval()
+        self._torch = torch
+
+    def convert(self, pdf_files: Iterable[str], out_path, recompute=False) -> Iterator[str]:
+        """
+        Convert PDFs to out_path/<name>.mmd and yield the path of each markdown file as soon as it is written.
+        Pages of consecutive PDFs share batches, so small PDFs keep the model busy.
+        Args:
+            recompute: convert PDFs whose markdown file already exists again, otherwise the existing file is yielded
+        """
+        import pypdf
+
+        datasets = []
+        for pdf_file in pdf_files:
+            mmd_file = mmd_path(pdf_file, out_path)
+            if os.path.exists(mmd_file) and not recompute:
+                print(f'Skipping {pdf_file}, {mmd_file} already exists.')
+                yield mmd_file
+                continue
+            try:
+                datasets.append(self._dataset(pdf_file))
+            except pypdf.errors.PdfStreamError:
+                print(f'Could not load {pdf_file}.')
+
+        for pdf_file, pages in self._recognize(datasets, [1] * len(datasets)):
+            yield write_mmd(mmd_path(pdf_file, out_path), pages)
+
+    def convert_pages(self, pdf_file, pages: List[int]) -> List[str]:
+        """Markdown of each of the given pages of pdf_file, numbered from 0."""
+        for _, markdown in self._recognize([self._dataset(pdf_file, pages)], [pages[0] + 1]):
+            return markdown
+        return []
+
+    def _dataset(self, pdf_file, pages=None):
+        from nougat.utils.dataset import LazyDataset
+
+        return LazyDataset(pdf_file, partial(self.model.encoder.prepare_input, random_padding=False), pages)
+
+    def _recognize(self, datasets, first_page_numbers):
+        """Yield the PDF file name and the markdown of each page, for each dataset in order."""
+        from nougat.utils.dataset import LazyDataset
+        from torch.utils.data import ConcatDataset, DataLoader
+
+        if not datasets:
+            return
+        dataloader = DataLoader(ConcatDataset(datasets), batch_size=self.batch_size, shuffle=False,
+                                collate_fn=LazyDataset.ignore_none_collate)
+        pages = []
+        dataset_index = 0
+        with self._torch.inference_mode():
+            for sample, is_last_page in dataloader:
+                with span('nougat batch', 'model', pages=len(sample)):
+                    model_output = self.model.inference(image_tensors=sample, early_stopping=self.skipping)
+                for j, output in enumerate(model_output['predictions']):
+                    page_number = first_page_numbers[dataset_index] + len(pages)
+                    pages.append(self._page_markdown(output, model_output['repeats'][j], page_number))
+                    if is_last_page[j]:
+                        yield is_last_page[j], pages
+                        pages = []
+                        dataset_index += 1
+
+    def _page_markdown(self, output, repeats, page_number):
+        from nougat.postprocessing import markdown_compatible
+
+        if output.strip() == '[MISSING_PAGE_POST]':
+            return f'\n\n[MISSING_PAGE_EMPTY:{page_number}]\n\n'
+        if self.skipping and repeats is not None:
+            if repeats > 0:
+                print(f'Skipping page {page_number} due to repetitions.')
+                return f'\n\n[MISSING_PAGE_FAIL:{page_number}]\n\n'
+            return f'\n\n[MISSING_PAGE_EMPTY:{page_number}]\n\n'
+        return markdown_compatible(output)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_worker(**worker_args) -> NougatWorker:
+    """The NougatWorker of this process, created on first use and kept for all later PDFs."""
+    return NougatWorker(**worker_args)
+
+
+def mmd_path(pdf_file, out_path):
+    """Path of the markdown file that Nougat writes for pdf_file."""
+    return os.path.join(out_path, os.path.splitext(os.path.basename(pdf_file))[0] + '.mmd')
+
+
+def join_pages(pages) -> str:
+    """Join the markdown of the pages of a PDF like the nougat command does."""
+    return re.sub(r'\n{3,}', '\n\n', ''.join(pages).strip()).strip()
+
+
+def write_mmd(mmd_file, pages) -> str:
+    os.makedirs(os.path.dirname(mmd_file) or '.', exist_ok=True)
+    with open(mmd_file, 'w', encoding='utf-8') as f:
+        f.write(join_pages(pages))
+    return mmd_file
+
+
+def shard_pages(page_count, shard_count) -> List[List[int]]:
+    """Split the pages 0, ..., page_count - 1 into at most shard_count contiguous ranges of almost equal size."""
+    shard_count = max(1, min(shard_count, page_count))
+    size, larger = divmod(page_count, shard_count)
+    shards = []
+    start = 0
+    for i in range(shard_count):
+        end = start + size + (i < larger)
+        shards.append(list(range(start, end)))
+        start = end
+    return [shard for shard in shards if shard]
+
+
+# the worker of each OCR process, see convert_sharded
+_process_worker = None
+
+
+def _init_process(threads, worker_args):
+    global _process_worker
+    import torch
+
+    torch.set_num_threads(threads)
+    _process_worker = NougatWorker(**worker_args)
+
+
+def _convert_shard(pdf_file, pages):
+    return _process_worker.convert_pages(pdf_file, pages)
+
+
+def convert_sharded(pdf_file, out_path, processes, shards_per_process=4, recompute=False, **worker_args) -> str:
+    """
+    Convert a PDF to out_path/<name>.mmd on several processes, each with its own model, and return the path.
+    The pages are split into contiguous shards, several per process so that fast processes take over
+    the remaining work, and the markdown of the shards is joined in page order. Nougat recognizes each
+    page on its own, so the result is the same as converting the whole PDF at once.
+    Args:
+        processes: number of worker processes, the CPU cores are divided evenly between them
+        recompute: convert the PDF even if its markdown file already exists
+        worker_args: arguments of NougatWorker
+    """
+    import pypdf
+
+    mmd_file = mmd_path(pdf_file, out_path)
+    if os.path.exists(mmd_file) and not recompute:
+        print(f'Skipping {pdf_file}, {mmd_file} already exists.')
+        return mmd_file
+
+    shards = shard_pages(len(pypdf.PdfReader(pdf_file).pages), processes * shards_per_process)
+    if not shards:
+        raise RuntimeError(f'{pdf_file} has no pages.')
+    processes = min(processes, len(shards))
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    print(f'Converting {pdf_file} in {len(shards)} shards on {processes} processes')
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_process,
+                             initargs=(threads, worker_args)) as executor:
+        pages = []
+        for shard, markdown in zip(shards, executor.map(_convert_shard, [pdf_file] * len(shards), shards)):
+            if len(markdown) != len(shard):
+                raise RuntimeError(f'Pages {shard[0] + 1}-{shard[-1] + 1} of {pdf_file} could not be converted.')
+            pages.extend(markdown)
+    return write_mmd(mmd_file, pages)
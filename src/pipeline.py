@@ -0,0 +1,129 @@
+"""Runs conversion stages incrementally, skipping stages whose inputs have not changed since their last run."""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+from src.audio import atomic_write
+from src.profiling import span
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable, args: Sequence = (), inputs: Sequence[str] = (),
+                 outputs: Sequence[str] = (), params: Optional[Dict] = None):
+        """
+        Args:
+            name: unique name of the stage in the manifest
+            func: called as func(*args) to produce the outputs from the inputs
+            inputs: files the stage reads
+            outputs: files the stage writes, may include inputs that are changed in place
+            params: settings other than the inputs that change the outputs, e.g. the voice
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+
+
+class Pipeline:
+    def __init__(self, manifest_file, force=False):
+        """
+        The manifest records, for each stage that completed, the content hashes of its inputs and its parameters.
+        A stage is skipped if they are unchanged and all its outputs exist, so a re-run after a failure resumes
+        after the last stage that completed.
+        Args:
+            manifest_file: json file the manifest is kept in
+            force: run all stages, even if they are up to date
+        """
+        self.manifest_file = manifest_file
+        self.force = force
+        self.manifest = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                self.manifest = json.load(f)
+        self.ran = []
+        self.skipped = []
+        # guards the manifest while branches run
+        self._lock = threading.Lock()
+
+    def run(self, stages: List[Stage]):
+        for stage in stages:
+            with span(stage.name, 'stage', manifest=self.manifest_file) as stage_span:
+                self._run_stage(stage, stage_span)
+
+    def run_branches(self, branches: List[List[Stage]]):
+        """
+        Run independent lists of stages at the same time, each on its own thread and in order within the list.
+        The stages of different branches must not write the same files. All branches run to the end even if one
+        fails, then the first error is raised.
+        """
+        branches = [stages for stages in branches if stages]
+        if len(branches) < 2:
+            for stages in branches:
+                self.run(stages)
+            return
+        with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+            futures = [executor.submit(self.run, stages) for stages in branches]
+        for future in futures:
+            future.result()
+
+    def _run_stage(self, stage, stage_span):
+        with self._lock:
+            up_to_date = not self.force and self.is_up_to_date(stage)
+        if up_to_date:
+            print(f'Skipping {stage.name}, its outputs are up to date.')
+            stage_span.set(skipped=True)
+            self.skipped.append(stage.name)
+            return
+        missing = [path for path in stage.inputs if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f'Input files of {stage.name} do not exist: {", ".join(missing)}')
+        with self._lock:
+            self.manifest.pop(stage.name, None)
+        stage.func(*stage.args)
+        with self._lock:
+            # inputs are hashed after the run, so that stages that change a file in place are up to date afterwards
+            self.manifest[stage.name] = {'inputs': {path: self._digest(path) for path in stage.inputs},
+                                         'params': _params_digest(stage.params)}
+            self._save()
+        self.ran.append(stage.name)
+
+    def is_up_to_date(self, stage: Stage) -> bool:
+        entry = self.manifest.get(stage.name)
+        if entry is None or entry['params'] != _params_digest(stage.params):
+            return False
+        if not all(os.path.exists(path) for path in stage.outputs):
+            return False
+        return entry['inputs'] == {path: self._digest(path) if os.path.exists(path) else None for path in stage.inputs}
+
+    def _digest(self, path):
+        """sha256 of the file, reused from the manifest while its size and modification time are unchanged."""
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        known = self.manifest.setdefault('.files', {}).get(path)
+        if known and known['signature'] == signature:
+            return known['sha256']
+        digest = file_digest(path)
+        self.manifest['.files'][path] = {'signature': signature, 'sha256': digest}
+        return digest
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_file)), exist_ok=True)
+        with atomic_write(self.manifest_file) as f:
+            f.write(json.dumps(self.manifest, indent=1, sort_keys=True).encode())
+
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _params_digest(params) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
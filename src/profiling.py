@@ -0,0 +1,221 @@
+"""
+Records spans of the conversion, e.g. stages, chunks and API requests, with their wall time, CPU time and the bytes
+read and written by the process, for a json report and a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+The peak memory is recorded once per process. Recording is off unless enabled, spans then cost a single attribute
+check.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from src.audio import atomic_write
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PROC_IO = '/proc/self/io'
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process in bytes, 0 where it is not available."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def io_counters():
+    """(bytes read, bytes written) by the process so far, including sockets and pipes, None where not available."""
+    try:
+        with open(_PROC_IO, 'rb') as f:
+            fields = dict(line.split(b':') for line in f.read().splitlines())
+        return int(fields[b'rchar']), int(fields[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'category', 'args', 'start', 'wall', 'cpu', 'process_cpu', 'io', 'overlaps')
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def set(self, **args):
+        """Add arguments that are only known inside the span, e.g. whether a chunk was cached."""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.overlaps = self.profiler._open_span()
+        self.io = io_counters()
+        self.start = time.time_ns()
+        self.wall = time.perf_counter_ns()
+        self.cpu = time.thread_time_ns()
+        self.process_cpu = time.process_time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter_ns() - self.wall
+        cpu = time.thread_time_ns() - self.cpu
+        process_cpu = time.process_time_ns() - self.process_cpu
+        event = {'name': self.name, 'cat': self.category, 'ts': self.start // 1000, 'dur': wall / 1000,
+                 'pid': os.getpid(), 'tid': threading.get_native_id(),
+                 'args': dict(self.args, cpu_s=cpu / 1e9, process_cpu_s=process_cpu / 1e9)}
+        io = io_counters()
+        # the counters are those of the process, so they are only attributed to a span that no span of another
+        # thread overlapped, e.g. not to chunks synthesized at the same time
+        if self.profiler._close_span(self.overlaps) and io and self.io:
+            event['args'].update(process_read_bytes=io[0] - self.io[0], process_written_bytes=io[1] - self.io[1])
+        if exc_type is not None:
+            event['args']['error'] = repr(exc)
+        self.profiler.add(event)
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events: List[dict] = []
+        # the process that enabled the profiler, events of worker processes are collected with drain
+        self.main_pid = None
+        self.pid = None
+        self._lock = threading.Lock()
+        # open spans by thread, and the number of times a span was opened while another thread had one open
+        self._open = {}
+        self._overlaps = 0
+
+    def enable(self, main=False):
+        if self.pid != os.getpid():
+            # e.g. a forked worker process, which starts with a copy of the events and open spans of its parent
+            self.events = []
+            self._open = {}
+            self.pid = os.getpid()
+        if main:
+            self.main_pid = self.pid
+        self.enabled = True
+
+    @property
+    def in_worker(self) -> bool:
+        """Whether this is a process other than the one that enabled the profiler, see drain."""
+        return os.getpid() != self.main_pid
+
+    def span(self, name, category='', **args):
+        """
+        Context manager that records the time spent in it as an event, with args as its arguments.
+        Call set(**args) on it to add arguments.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def _open_span(self):
+        """Register a span of this thread. Returns the overlap count, or None if another thread has a span open."""
+        thread = threading.get_ident()
+        with self._lock:
+            overlapped = any(count for other, count in self._open.items() if other != thread)
+            if overlapped:
+                self._overlaps += 1
+            self._open[thread] = self._open.get(thread, 0) + 1
+            return None if overlapped else self._overlaps
+
+    def _close_span(self, overlaps) -> bool:
+        """Unregister a span of this thread and return whether no span of another thread overlapped it."""
+        thread = threading.get_ident()
+        with self._lock:
+            self._open[thread] -= 1
+            if not self._open[thread]:
+                del self._open[thread]
+            return overlaps is not None and overlaps == self._overlaps
+
+    def record_peak_rss(self):
+        """Add the peak memory of this process so far as a counter event."""
+        if self.enabled:
+            self.add({'name': 'peak_rss', 'cat': 'process', 'ph': 'C', 'ts': time.time_ns() // 1000,
+                      'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': {'peak_rss': peak_rss()}})
+
+    def add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def drain(self) -> List[dict]:
+        """
+        Remove and return the events recorded so far, with the peak memory of the process, to send them from a
+        worker process to the main process.
+        """
+        self.record_peak_rss()
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def extend(self, events):
+        with self._lock:
+            self.events.extend(events)
+
+    def report(self) -> dict:
+        """
+        Totals of the spans by name, slowest first. The bytes read and written are those of the spans that did not
+        overlap spans of other threads. peak_rss is the largest peak of the processes.
+        """
+        by_name: Dict[str, dict] = {}
+        spans = [event for event in self.events if 'ph' not in event]
+        for event in spans:
+            args = event['args']
+            totals = by_name.setdefault(event['name'], {
+                'category': event['cat'], 'count': 0, 'errors': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'process_cpu_s': 0.0,
+                'process_read_bytes': 0, 'process_written_bytes': 0})
+            totals['count'] += 1
+            totals['errors'] += 'error' in args
+            totals['wall_s'] += event['dur'] / 1e6
+            totals['cpu_s'] += args['cpu_s']
+            totals['process_cpu_s'] += args['process_cpu_s']
+            totals['process_read_bytes'] += args.get('process_read_bytes', 0)
+            totals['process_written_bytes'] += args.get('process_written_bytes', 0)
+        start = min((event['ts'] for event in spans), default=0)
+        end = max((event['ts'] + event['dur'] for event in spans), default=0)
+        peak = max((event['args']['peak_rss'] for event in self.events if event['name'] == 'peak_rss'), default=0)
+        return {'wall_s': (end - start) / 1e6, 'peak_rss': peak,
+                'spans': dict(sorted(by_name.items(), key=lambda item: -item[1]['wall_s']))}
+
+    def trace(self) -> dict:
+        """The events in the Chrome trace event format."""
+        return {'traceEvents': [dict({'ph': 'X'}, **event) for event in sorted(self.events, key=lambda e: e['ts'])],
+                'displayTimeUnit': 'ms'}
+
+    def write(self, prefix):
+        """Write the report to <prefix>.json and the trace to <prefix>.trace.json."""
+        self.record_peak_rss()
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        for path, content in ((prefix + '.json', self.report()), (prefix + '.trace.json', self.trace())):
+            with atomic_write(path) as f:
+                f.write(json.dumps(content, indent=1).encode())
+        print(f'Profile written to {prefix}.json, trace to {prefix}.trace.json')
+
+
+profiler = Profiler()
+
+
+def span(name, category='', **args):
+    """profiler.span of the profiler of this process."""
+    return profiler.span(name, category, **args)
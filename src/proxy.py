@@ -0,0 +1,282 @@
+"""
+Local server for the html pages: serves the output directory and forwards the explanation and speech requests of
+out/script_latexml.js to the remote API. Responses are cached on disk, identical requests that are in flight at
+the same time are sent upstream once, and audio is streamed to the page as it arrives.
+Run with: python -m src.proxy out
+"""
+import argparse
+import functools
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from src.cache import DiskCache, DEFAULT_CACHE_DIR
+
+UPSTREAM_URL = 'https://api.openai.com'
+PROXY_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'proxy')
+DEFAULT_PORT = 8765
+DEFAULT_TTL = 30 * 24 * 3600
+UPSTREAM_TIMEOUT = 120
+CHUNK_SIZE = 16 * 1024
+# the requests of out/script_latexml.js, other paths are not forwarded
+PROXIED_PATHS = {'/v1/chat/completions', '/v1/audio/speech'}
+# where pages served by the proxy get the token of this run, which they send in TOKEN_HEADER
+TOKEN_PATH = '/proxy-token'
+TOKEN_HEADER = 'X-Proxy-Token'
+
+
+class _Flight:
+    """An upstream response that is shared by all requests for the same key while it arrives."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.status = None
+        self.content_type = None
+        self.chunks = []
+        self.done = False
+
+    def start(self, status, content_type):
+        with self.condition:
+            self.status, self.content_type = status, content_type
+            self.condition.notify_all()
+
+    def add(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+
+    def wait_started(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.status is not None or self.done)
+
+    def stream(self):
+        """Yield the chunks from the first, waiting for those that have not arrived yet."""
+        i = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: i < len(self.chunks) or self.done)
+                chunks = self.chunks[i:]
+                done = self.done
+            i += len(chunks)
+            yield from chunks
+            if done and i >= len(self.chunks):
+                return
+
+
+class Proxy:
+    def __init__(self, upstream=UPSTREAM_URL, cache=None, ttl=DEFAULT_TTL, api_key=None, timeout=UPSTREAM_TIMEOUT):
+        """
+        Args:
+            upstream: base url the request paths are appended to
+            cache: DiskCache for successful responses, None to cache nothing
+            ttl: seconds after which a cached response is requested again
+            api_key: sent as bearer token if a request has no Authorization header, e.g. OPENAI_API_KEY
+        """
+        self.upstream = upstream.rstrip('/')
+        self.cache = cache
+        self.ttl = ttl
+        self.api_key = api_key
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.upstream_requests = 0
+
+    @staticmethod
+    def key(path, body: bytes):
+        """Requests with the same path and json content share a key, whatever the key order or the API key."""
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+        except ValueError:
+            pass
+        return DiskCache.key('proxy', path, body.decode('utf-8', 'replace'))
+
+    def cached(self, key):
+        """Return (content type, body) of a cached response that has not expired, or None."""
+        if self.cache is None:
+            return None
+        data = self.cache.get(key)
+        if data is None:
+            return None
+        header, _, body = data.partition(b'\n')
+        header = json.loads(header)
+        if time.time() - header['stored'] > self.ttl:
+            return None
+        return header['content_type'], body
+
+    def request(self, path, body: bytes, authorization=None):
+        """
+        Return (status, content type, chunk iterator) for a POST request. The response comes from the cache,
+        from a request for the same key that is in flight, or from a new upstream request.
+        """
+        key = self.key(path, body)
+        hit = self.cached(key)
+        if hit is not None:
+            return 200, hit[0], iter([hit[1]])
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.upstream_requests += 1
+        if leader:
+            threading.Thread(target=self._fetch, args=(key, flight, path, body, authorization), daemon=True).start()
+        flight.wait_started()
+        return flight.status or 502, flight.content_type, flight.stream()
+
+    def _fetch(self, key, flight, path, body, authorization):
+        headers = {'Content-Type': 'application/json'}
+        if authorization or self.api_key:
+            headers['Authorization'] = authorization or f'Bearer {self.api_key}'
+        request = urllib.request.Request(self.upstream + path, data=body, headers=headers, method='POST')
+        try:
+            try:
+                response = urllib.request.urlopen(request, timeout=self.timeout)
+            except urllib.error.HTTPError as e:
+                # errors are passed on, but not cached
+                response = e
+            flight.start(response.status, response.headers.get('Content-Type', 'application/octet-stream'))
+            with response:
+                while True:
+                    chunk = response.read1(CHUNK_SIZE) if hasattr(response, 'read1') else response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    flight.add(chunk)
+            if response.status == 200 and self.cache is not None:
+                header = json.dumps({'stored': time.time(), 'content_type': flight.content_type}).encode()
+                self.cache.put(key, header + b'\n' + b''.join(flight.chunks))
+        except Exception as e:
+            print(f'Request to {self.upstream + path} failed: {e}')
+            if flight.status is None:
+                flight.start(502, 'text/plain')
+                flight.add(str(e).encode())
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.finish()
+
+
+class ProxyHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files of a directory on GET and forwards POST requests through the proxy. POST requests have to
+    come from a page served by this server and carry the token of the run, see TOKEN_PATH.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, *args, proxy: Proxy, token: str, **kwargs):
+        self.proxy = proxy
+        self.token = token
+        super().__init__(*args, **kwargs)
+
+    def end_headers(self):
+        origin = self.headers.get('Origin')
+        if origin and self.allowed_origin(origin):
+            self.send_header('Access-Control-Allow-Origin', origin)
+            self.send_header('Vary', 'Origin')
+        super().end_headers()
+
+    def allowed_origin(self, origin):
+        """
+        Only pages served by this server may use the proxy. Other web sites, including sandboxed frames and pages
+        opened as files with origin null, may not, as the proxy may add the API key to their requests.
+        """
+        port = self.server.server_address[1]
+        return origin in (f'http://localhost:{port}', f'http://127.0.0.1:{port}')
+
+    def do_GET(self):
+        if self.path != TOKEN_PATH:
+            super().do_GET()
+            return
+        # browsers send the origin with cross-origin requests, and only allowed origins can read the answer
+        origin = self.headers.get('Origin')
+        if origin is not None and not self.allowed_origin(origin):
+            self.send_error(403)
+            return
+        body = json.dumps({'token': self.token}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        if not self.allowed_origin(self.headers.get('Origin')):
+            self.send_error(403)
+            return
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', f'Authorization, Content-Type, {TOKEN_HEADER}')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path not in PROXIED_PATHS:
+            self.send_error(404)
+            return
+        if not self.allowed_origin(self.headers.get('Origin')) or \
+                not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''), self.token):
+            self.send_error(403)
+            return
+        status, content_type, chunks = self.proxy.request(self.path, body, self.headers.get('Authorization'))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(directory, proxy: Proxy, port=DEFAULT_PORT, host='127.0.0.1', token=None) -> ThreadingHTTPServer:
+    """
+    Args:
+        token: secret that POST requests have to send, a new random one by default
+    """
+    handler = functools.partial(ProxyHandler, proxy=proxy, directory=directory, token=token or secrets.token_urlsafe())
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('directory', nargs='?', default='out', help='directory of the html files.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--upstream', default=UPSTREAM_URL, help='url of the API the requests are forwarded to.')
+    parser.add_argument('--cache-dir', default=PROXY_CACHE_DIR, help='directory of the response cache.')
+    parser.add_argument('--cache-size', type=int, default=512, help='maximum size of the response cache in MB.')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL / 86400,
+                        help='days after which cached responses are requested again.')
+    parser.add_argument('--no-cache', action='store_true', help='only combine identical requests in flight.')
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else DiskCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    proxy = Proxy(args.upstream, cache, ttl=args.ttl * 86400, api_key=os.environ.get('OPENAI_API_KEY'))
+    server = make_server(args.directory, proxy, args.port)
+    print(f'Serving {args.directory} on http://localhost:{args.port}/, forwarding requests to {args.upstream}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
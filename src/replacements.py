@@ -1,160 +1,202 @@
+from src.rules import RuleEngine
+
+# rules with regex syntax end with a literal that every match contains, the rule is skipped for texts without it
 text_replacements = [
-    ("i\.e\.", 'that is'),
-    ("e\.g\.", 'for example'),
-    ("e\. g\.", 'for example'),
-    ("i\.i\.d\.", 'i i d'),
-    ("Eq\.", 'Equation'),
-    ("eq\.", 'equation'),
-    ("Fig\.", 'Figure'),
-    ("fig\.", 'figure'),
-    ("Sec\.", 'Section'),
-    ("sec\.", 'section'),
-    ("Tab\.", 'Table'),
-    ("tab\.", 'table'),
-    ("Thm\.", 'Theorem'),
-    ("thm\.", 'theorem'),
-    ("vs\.", 'versus'),
-    ("w\.r\.t\.", 'with respect to'),
-    ("w\.r\.t", 'with respect to'),
-    ("w\.l\.o\.g\.", 'without loss of generality'),
-    (r"\((.*?)\)-th", r"\1-th"),
+    (r"i\.e\.", 'that is'),
+    (r"e\.g\.", 'for example'),
+    (r"e\. g\.", 'for example'),
+    (r"i\.i\.d\.", 'i i d'),
+    (r"Eq\.", 'Equation'),
+    (r"eq\.", 'equation'),
+    (r"Fig\.", 'Figure'),
+    (r"fig\.", 'figure'),
+    (r"Sec\.", 'Section'),
+    (r"sec\.", 'section'),
+    (r"Tab\.", 'Table'),
+    (r"tab\.", 'table'),
+    (r"Thm\.", 'Theorem'),
+    (r"thm\.", 'theorem'),
+    (r"vs\.", 'versus'),
+    (r"w\.r\.t\.", 'with respect to'),
+    (r"w\.r\.t", 'with respect to'),
+    (r"w\.l\.o\.g\.", 'without loss of generality'),
+    (r"\((.*?)\)-th", r"\1-th", ')-th'),
     # remove numbers after sentences, e.g. ... of training.4
-    (r'(\w+)\.(\d+)$', r'\1'),
+    (r'(?<=\w)\.\d+$', '', '.'),
     # add break after title number
-    (r'#+\s+(\d+(\.\d+)*)\s+', r'<s>\1</s>'),
-    (r' et al.', ' et al'),
+    (r'#+\s+(\d+(\.\d+)*)\s+', r'<s>\1</s>', '#'),
+    (r' et al.', ' et al', ' et al'),
     # remove ssml closing tags
     (r'<break time="0.5s"></break>', r'<break time="0.5s"/>'),
     # remove references
     (r'\s*(\[[0-9,-, ]+(, pp\. [0-9,-]+|, p\.\d+[f]?[f]?\.?)?\]|\([0-9,-, ]+(, pp\. [0-9,-]+|, p\.\d+[f]?[f]?\.?)?\))', ''),
-    (r'\s*\[[^\]]*, \d{4}(?:, [^\]]*, \d{4})*\]', ''),
-    (r'\s*\([^\)]*, \d{4}(?:[;,] [^\)]*, \d{4}[a-zA-Z]*?)*\)', ''),
-    (r'\s*(\b\w+\s+et al\.) (\[\d{4}\]|\(\d{4}\))', r'\1'),
+    (r'\s*\[[^\]]*, \d{4}(?:, [^\]]*, \d{4})*\]', '', ', '),
+    (r'\s*\([^\)]*, \d{4}(?:[;,] [^\)]*, \d{4}[a-zA-Z]*?)*\)', '', ', '),
+    (r'\s*(\b\w+\s+et al\.) (\[\d{4}\]|\(\d{4}\))', r'\1', 'et al. '),
     # remove urls
-    (r'\s*https?://[\w/:%#\$&\?\(\)~\.=\+\-]*[\w\d_\-]', ''),
+    (r'\s*https?://[\w/:%#\$&\?\(\)~\.=\+\-]*[\w\d_\-]', '', '://'),
     # remove new lines
-    (r'\n', ''),
+    (r'\n', '', '\n'),
 ]
 
-math_replacements = [
-    # combined symbols
-    (r'\\lVert\\cdot\\rVert', 'norm'),
-
-    # Basic arithmetic operations
-    (r'\+', 'plus'),
-    (r'-', 'minus'),
-    (r'\*', 'times'),
-    (r'/', 'divided by'),
-    (r'\^\{\\circ\}', 'degrees'),
+# compiled once, applies text_replacements with as few passes over the text as possible
+text_rules = RuleEngine(text_replacements)
 
-    # Fractions and powers
-    (r'\^2', 'squared'),
-    (r'\^3', 'cubed'),
-    (r'\^\{T\}', 'transpose'),
-    (r'\\frac{([^}]+)}{([^}]+)}', r'\1 over \2'),
-
-    # Roots
-    (r'\\sqrt{([^}]+)}', 'square root of \1'),
-    (r'\\sqrt\[3]{([^}]+)}', 'cube root of \1'),
-    (r'\\sqrt\[(\d+)]{([^}]+)}', r'\1-th root of \2'),
 
+# how LaTeX commands inside inline math are read out, used by math_to_speech.py
+math_symbols = {
     # Calculus symbols
-    (r'\\int', 'integral'),
-    (r'\\sum', 'summation over'),
-    (r'\\lim', 'limit'),
-    (r'\\infty', 'infinity'),
+    'int': 'integral',
+    'sum': 'summation over',
+    'prod': 'product over',
+    'lim': 'limit',
+    'infty': 'infinity',
+    'partial': 'partial',
+    'nabla': 'nabla',
 
     # Basic mathematical symbols
-    (r'\\pm', 'plus or minus'),
-    (r'\\times', 'times'),
-    (r'\\div', 'divided by'),
-    (r'\\cdot', 'times'),
-    (r'\\leq', 'less than or equal to'),
-    (r'\\geq', 'greater than or equal to'),
-    (r'>', 'greater'),
-    (r'<', 'less than'),
-    (r'\\neq', 'not equal to'),
-    (r'\\approx', 'approximately'),
-    (r'\\equiv', 'equivalent to'),
+    'pm': 'plus or minus',
+    'times': 'times',
+    'div': 'divided by',
+    'cdot': 'times',
+    'leq': 'less than or equal to',
+    'le': 'less than or equal to',
+    'geq': 'greater than or equal to',
+    'ge': 'greater than or equal to',
+    'neq': 'not equal to',
+    'ne': 'not equal to',
+    'approx': 'approximately',
+    'equiv': 'equivalent to',
+    'sim': 'distributed as',
+    'propto': 'proportional to',
 
     # Quantifiers and logic symbols
-    (r'\\forall', 'for all'),
-    (r'\\exists', 'there exists'),
-    (r'\\rightarrow', 'goes to'),
-    (r'\\Rightarrow', 'implies'),
-    (r'\\mapsto', 'maps to'),
-    (r'\\in', 'in'),
+    'forall': 'for all',
+    'exists': 'there exists',
+    'rightarrow': 'goes to',
+    'to': 'goes to',
+    'Rightarrow': 'implies',
+    'mapsto': 'maps to',
+    'in': 'in',
 
     # Greek letters
-    (r'\\alpha', 'alpha'),
-    (r'\\beta', 'beta'),
-    (r'\\gamma', 'gamma'),
-    (r'\\delta', 'delta'),
-    (r'\\epsilon', 'epsilon'),
-    (r'\\zeta', 'zeta'),
-    (r'\\eta', 'eta'),
-    (r'\\theta', 'theta'),
-    (r'\\iota', 'iota'),
-    (r'\\kappa', 'kappa'),
-    (r'\\lambda', 'lambda'),
-    (r'\\mu', 'mu'),
-    (r'\\nu', 'nu'),
-    (r'\\xi', 'ksi'),
-    (r'\\pi', 'pi'),
-    (r'\\rho', 'rho'),
-    (r'\\sigma', 'sigma'),
-    (r'\\tau', 'tau'),
-    (r'\\upsilon', 'upsilon'),
-    (r'\\phi', 'phi'),
+    'alpha': 'alpha',
+    'beta': 'beta',
+    'gamma': 'gamma',
+    'delta': 'delta',
+    'epsilon': 'epsilon',
+    'varepsilon': 'epsilon',
+    'zeta': 'zeta',
+    'eta': 'eta',
+    'theta': 'theta',
+    'iota': 'iota',
+    'kappa': 'kappa',
+    'lambda': 'lambda',
+    'mu': 'mu',
+    'nu': 'nu',
+    'xi': 'ksi',
+    'pi': 'pi',
+    'rho': 'rho',
+    'sigma': 'sigma',
+    'tau': 'tau',
+    'upsilon': 'upsilon',
+    'phi': 'phi',
+    'varphi': 'phi',
+    'chi': 'chi',
+    'psi': 'psi',
+    'omega': 'omega',
 
     # Trigonometric functions
-    (r'\\sin', 'sine'),
-    (r'\\cos', 'cosine'),
-    (r'\\tan', 'tangent'),
-    (r'\\cot', 'cotangent'),
-    (r'\\arcsin', 'arcsine'),
-    (r'\\arccos', 'arccosine'),
-    (r'\\arctan', 'arctangent'),
+    'sin': 'sine',
+    'cos': 'cosine',
+    'tan': 'tangent',
+    'cot': 'cotangent',
+    'arcsin': 'arcsine',
+    'arccos': 'arccosine',
+    'arctan': 'arctangent',
 
     # Set notation
-    (r'\\emptyset', 'empty set'),
-    (r'\\subseteq', 'is a subset of or equal to'),
-    (r'\\superset', 'superset'),
-    (r'\\cup', 'union'),
-    (r'\\cap', 'intersection'),
-    (r'\\notin', 'is not an element of'),
-    (r'\\subset', 'subset'),
-    (r'\\setminus', 'set minus'),
-    (r'\\operatorname\{supp}', 'support of'),
+    'emptyset': 'empty set',
+    'subseteq': 'is a subset of or equal to',
+    'superset': 'superset',
+    'supset': 'superset',
+    'cup': 'union',
+    'cap': 'intersection',
+    'notin': 'is not an element of',
+    'subset': 'subset',
+    'setminus': 'set minus',
 
     # Other symbols
-    (r'\\mathbb\{E}', 'expectation'),
-    (r'\\hat\{([^}]+)}', r'\1 hat'),
-    (r'\\bar\{([^}]+)}', r'\1 bar'),
-    (r'\\tilde\{([^}]+)}', r'\1 tilde'),
-    (r'\\dot\{([^}]+)}', r'\1 dot'),
-    (r'\\ddot\{([^}]+)}', r'\1 double dot'),
-    (r'\\mathcal\{([^}]+)}', r'\1'),
-    (r'\\mathbb\{([^}]+)}', r'\1'),
-    (r'\\mathbf\{([^}]+)}', r'\1'),
-    (r'\\mathcal\{([^}]+)}', r'\1'),
-    (r'\\lVert', 'norm of'),
-    (r'\\rVert', ''),
-    (r'\\langle', ''),
-    (r'\\rangle', ''),
-    (r'\\dots', ''),
-    (r'\\ldots', ''),
-    (r'\\mid', ''),
+    'lVert': 'norm of',
+    'rVert': '',
+    'langle': '',
+    'rangle': '',
+    'dots': '',
+    'ldots': '',
+    'cdots': '',
+    'mid': '',
+    'quad': '',
+    'qquad': '',
+    '%': 'percent',
+}
 
-    # Removing unnecessary LaTeX commands
-    (r'\\big{(.*?)}', r'\1'),
-    (r'\\boldsymbol', ''),
-    (r'\\left', ''),
-    (r'\\right', ''),
-    (r'\^', ''),
-    (r'\|', ''),
-    (r'\\', ''),
-    (r'_', ''),
-    (r'{', ''),
-    (r'}', ''),
-]
+# characters read out as words, all other characters are read as they are
+math_operators = {
+    '+': 'plus',
+    '-': 'minus',
+    '*': 'times',
+    '/': 'divided by',
+    '<': 'less than',
+    '>': 'greater than',
+    '|': '',
+    '&': '',
+    '~': '',
+}
+
+# superscripts with a name of their own, all others are read after their base
+math_superscripts = {
+    '2': 'squared',
+    '3': 'cubed',
+    'T': 'transpose',
+    '\\top': 'transpose',
+    '\\circ': 'degrees',
+    '-1': 'inverse',
+    '\\prime': 'prime',
+}
+
+# accents are read after their argument, e.g. \hat{x} -> x hat
+math_accents = {
+    'hat': 'hat',
+    'widehat': 'hat',
+    'bar': 'bar',
+    'overline': 'bar',
+    'tilde': 'tilde',
+    'widetilde': 'tilde',
+    'dot': 'dot',
+    'ddot': 'double dot',
+    'vec': 'vector',
+}
+
+# commands whose argument is read without the command, with exceptions for some arguments
+math_fonts = {
+    'mathcal': {},
+    'mathbb': {'E': 'expectation'},
+    'mathbf': {},
+    'mathrm': {},
+    'mathit': {},
+    'mathsf': {},
+    'mathfrak': {},
+    'mathscr': {},
+    'boldsymbol': {},
+    'bm': {},
+    'text': {},
+    'textrm': {},
+    'textbf': {},
+    'operatorname': {'supp': 'support of'},
+}
+
+# commands that only change the layout and are not read out
+math_ignored = {
+    'left', 'right', 'big', 'Big', 'bigg', 'Bigg', 'bigl', 'bigr', 'Bigl', 'Bigr', 'biggl', 'biggr',
+    'displaystyle', 'textstyle', 'scriptstyle', 'limits', 'nolimits', '!',
+}
@@ -0,0 +1,213 @@
+"""
+Builds a search index of the sections of LaTeXML html, shipped as a json sidecar of the page, so that the explain
+buttons can look up the text of a section and background passages from other sections without walking the DOM.
+"""
+import json
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from src.audio import atomic_write
+
+INDEX_VERSION = 1
+# BM25 parameters, also used by the search in out/script_latexml.js
+BM25_K1 = 1.2
+BM25_B = 0.75
+# number of the most distinctive terms of a section kept as its query for background passages
+SECTION_TERMS = 20
+# a token is a lowercase word of at least two letters or digits; the pattern and the stopwords are part of the index,
+# so that out/script_latexml.js tokenizes queries in the same way
+TOKEN = re.compile(r'[a-z0-9][a-z0-9]+')
+STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how
+if in into is it its itself let may me might more most must my no nor not now of off on once only or other our out
+over own same shall she should so some such than that the their theirs them then there these they this those
+through to too under until up very was we were what when where which while who whom why will with would you your
+""".split())
+
+SECTION_CLASSES = {'ltx_chapter', 'ltx_section', 'ltx_subsection', 'ltx_subsubsection', 'ltx_paragraph',
+                   'ltx_appendix', 'ltx_abstract', 'ltx_bibliography', 'ltx_part'}
+HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+EMPHASIS_TAGS = {'em', 'i', 'b', 'strong', 'dfn'}
+EMPHASIS_CLASSES = {'ltx_emph', 'ltx_font_italic', 'ltx_font_bold'}
+# elements whose text is separated from the text around them
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'td', 'th', 'tr', 'table', 'figure', 'figcaption', 'blockquote'}
+SKIPPED_TAGS = {'script', 'style', 'button', 'head'}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class _Passage:
+    __slots__ = ('id', 'section', 'parts', 'emphasized')
+
+    def __init__(self, passage_id, section):
+        self.id = passage_id
+        self.section = section
+        self.parts = []
+        # emphasized phrases, the terms defined if the passage is a definition
+        self.emphasized = []
+
+
+class SectionIndexer:
+    """
+    Collects the passages (outermost .ltx_para elements) and sections of a LaTeXML page from parse events,
+    so that it can be fed by the parser of LaTeXMLRewriter without parsing the page again.
+    Math is indexed by its alttext.
+    """
+    def __init__(self):
+        self.passages = []
+        self.sections: Dict[str, dict] = {}
+        # kind of each open element: 'section', 'passage', 'heading', 'emphasis', 'math', 'skip' or None
+        self.stack = []
+        self.section_ids = []
+        self.passage: Optional[_Passage] = None
+        self.heading: Optional[list] = None
+        self.emphasis: Optional[list] = None
+        self.skipping = 0
+
+    def start(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get('class') or '').split())
+        kind = None
+        if self.heading is not None:
+            # e.g. between the number and the title
+            self.heading.append(' ')
+        elif tag in BLOCK_TAGS:
+            self._add_text(' ')
+        if self.skipping or tag in SKIPPED_TAGS:
+            kind = 'skip'
+            self.skipping += 1
+        elif tag == 'math':
+            kind = 'math'
+            self.skipping += 1
+            self._add_text(f" {attrs.get('alttext') or ''} ")
+        elif attrs.get('id') and (tag == 'section' or classes & SECTION_CLASSES):
+            kind = 'section'
+            self.section_ids.append(attrs['id'])
+            self.sections[attrs['id']] = {'title': '', 'passages': [len(self.passages), len(self.passages)]}
+        elif self.passage is None and 'ltx_para' in classes:
+            kind = 'passage'
+            self.passage = _Passage(attrs.get('id'), self.section_ids[-1] if self.section_ids else None)
+        elif tag in HEADINGS and self.heading is None and self.passage is None:
+            kind = 'heading'
+            self.heading = []
+        elif (self.passage is not None and self.emphasis is None
+              and (tag in EMPHASIS_TAGS or classes & EMPHASIS_CLASSES)):
+            kind = 'emphasis'
+            self.emphasis = []
+        self.stack.append(kind)
+
+    def end(self, tag=None):
+        if not self.stack:
+            return
+        kind = self.stack.pop()
+        if self.heading is not None and kind != 'heading':
+            self.heading.append(' ')
+        elif tag in BLOCK_TAGS and not self.skipping:
+            self._add_text(' ')
+        if kind in ('skip', 'math'):
+            self.skipping -= 1
+        elif kind == 'section':
+            self.sections[self.section_ids.pop()]['passages'][1] = len(self.passages)
+        elif kind == 'passage':
+            self.passages.append(self.passage)
+            self.passage = None
+        elif kind == 'heading':
+            title = ' '.join(''.join(self.heading).split())
+            if self.section_ids and not self.sections[self.section_ids[-1]]['title']:
+                self.sections[self.section_ids[-1]]['title'] = title
+            self.heading = None
+        elif kind == 'emphasis':
+            self.passage.emphasized.append(' '.join(''.join(self.emphasis).split()))
+            self.emphasis = None
+
+    def text(self, data):
+        if not self.skipping:
+            self._add_text(data)
+
+    def _add_text(self, data):
+        if self.passage is not None:
+            self.passage.parts.append(data)
+            if self.emphasis is not None:
+                self.emphasis.append(data)
+        elif self.heading is not None:
+            self.heading.append(data)
+
+    def build(self) -> dict:
+        """
+        Return the index:
+            passages: [id, section id, text] of each passage in document order
+            token, stopwords: how text is split into tokens
+            sections: section id to title, [first, end) range of its passages and its most distinctive terms
+            definitions: term to the passage that defines it, from emphasized phrases in definitions
+            lengths: number of tokens of each passage
+            postings: token to the flat list [passage, term frequency, passage, term frequency, ...]
+        """
+        passages = []
+        postings: Dict[str, list] = {}
+        lengths = []
+        definitions = {}
+        counts = []
+        for i, passage in enumerate(self.passages):
+            text = ' '.join(''.join(passage.parts).split())
+            passages.append([passage.id, passage.section, text])
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            count = Counter(tokens)
+            counts.append(count)
+            for token, frequency in count.items():
+                postings.setdefault(token, []).extend((i, frequency))
+            if text.startswith('Definition'):
+                for term in passage.emphasized:
+                    term = term.strip(' .,:;').lower()
+                    if term and len(term) < 80 and not term.startswith('definition'):
+                        definitions.setdefault(term, i)
+
+        idf = {token: _idf(len(passages), len(posting) // 2) for token, posting in postings.items()}
+        sections = {}
+        for section_id, section in self.sections.items():
+            first, end = section['passages']
+            count = Counter()
+            for passage_count in counts[first:end]:
+                count.update(passage_count)
+            terms = sorted(count, key=lambda token: (-count[token] * idf[token], token))[:SECTION_TERMS]
+            sections[section_id] = {'title': section['title'], 'passages': [first, end], 'terms': terms}
+        return {'version': INDEX_VERSION, 'token': TOKEN.pattern, 'stopwords': sorted(STOPWORDS), 'k1': BM25_K1,
+                'b': BM25_B, 'passages': passages, 'sections': sections,
+                'definitions': definitions, 'lengths': lengths, 'postings': postings}
+
+    def save(self, path):
+        with atomic_write(path) as f:
+            f.write(json.dumps(self.build(), ensure_ascii=False, separators=(',', ':')).encode())
+
+
+def _idf(passage_count, document_frequency):
+    return math.log(1 + (passage_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def search(index: dict, query, limit=5, exclude=range(0)) -> List[int]:
+    """
+    Return the indices of the passages that match the query best by BM25.
+    Args:
+        query: text or list of tokens
+        exclude: passages that are not returned, e.g. those of the section the query is from
+    """
+    tokens = tokenize(query) if isinstance(query, str) else query
+    lengths = index['lengths']
+    average_length = sum(lengths) / len(lengths) if lengths else 0
+    k1, b = index['k1'], index['b']
+    scores = Counter()
+    for token in set(tokens):
+        posting = index['postings'].get(token)
+        if not posting:
+            continue
+        idf = _idf(len(lengths), len(posting) // 2)
+        for passage, frequency in zip(posting[::2], posting[1::2]):
+            norm = k1 * (1 - b + b * lengths[passage] / average_length)
+            scores[passage] += idf * frequency * (k1 + 1) / (frequency + norm)
+    ranked = sorted((passage for passage in scores if passage not in exclude), key=lambda p: (-scores[p], p))
+    return ranked[:limit]
@@ -0,0 +1,441 @@
+"""
+Conversion service: a local HTTP API that keeps conversion jobs in a queue in a sqlite database and runs them on warm
+worker processes, so that Nougat, gemma.cpp and the text-to-speech client are started once instead of for every file.
+Run with: python -m src.service serve
+Submit a job with the arguments of paper2speech: python -m src.service submit paper.pdf -o out/paper.mp3 --wait
+"""
+import argparse
+import functools
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from src.cache import DEFAULT_CACHE_DIR
+
+SERVICE_DB = os.path.join(DEFAULT_CACHE_DIR, 'service.db')
+DEFAULT_PORT = 8766
+# seconds between checks of the status of a job with --wait
+POLL_INTERVAL = 1.0
+FINISHED = ('done', 'failed', 'cancelled')
+
+
+class _RequestParser(argparse.ArgumentParser):
+    """Reports invalid arguments of a job as a ValueError instead of exiting the service."""
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        raise ValueError(message or f'exit status {status}')
+
+
+def parse_job_args(argv: List[str], cwd=None) -> argparse.Namespace:
+    """Parse and check the paper2speech arguments of a job, raising ValueError if they are invalid."""
+    from paper2speech import get_args, make_parser
+
+    try:
+        args = get_args(argv, make_parser(_RequestParser), cwd)
+    except AssertionError as e:
+        raise ValueError(str(e))
+    if not args.output_files:
+        raise ValueError('The output file has to be given with -o.')
+    return args
+
+
+class JobQueue:
+    def __init__(self, path=SERVICE_DB):
+        """
+        Jobs in a sqlite database, so that queued jobs survive a restart of the service. Jobs that were running when
+        the service stopped are queued again; their completed stages are skipped when they run.
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                             'argv TEXT NOT NULL, cwd TEXT, status TEXT NOT NULL, created REAL NOT NULL, started REAL, '
+                             'finished REAL, error TEXT, files TEXT)')
+            self._db.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'")
+
+    def submit(self, argv: List[str], cwd=None) -> int:
+        with self._lock:
+            cursor = self._db.execute("INSERT INTO jobs (argv, cwd, status, created, files) VALUES (?, ?, 'queued', ?, "
+                                      "'[]')", (json.dumps(argv), cwd, time.time()))
+        return cursor.lastrowid
+
+    def claim(self) -> Optional[dict]:
+        """Mark the oldest queued job as running and return it, None if no job is queued."""
+        with self._lock:
+            row = self._db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE jobs SET status = 'running', started = ?, error = NULL WHERE id = ?",
+                             (time.time(), row['id']))
+        return self.get(row['id'])
+
+    def update(self, id, **fields):
+        if 'files' in fields:
+            fields['files'] = json.dumps(fields['files'])
+        with self._lock:
+            self._db.execute(f'UPDATE jobs SET {", ".join(f"{name} = ?" for name in fields)} WHERE id = ?',
+                             (*fields.values(), id))
+
+    def cancel(self, id) -> bool:
+        """Cancel the job if it is still queued."""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND "
+                                      "status = 'queued'", (time.time(), id))
+        return cursor.rowcount == 1
+
+    def get(self, id) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute('SELECT * FROM jobs WHERE id = ?', (id,)).fetchone()
+        return row and self._job(row)
+
+    def list(self, limit=100) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    @staticmethod
+    def _job(row) -> dict:
+        job = dict(row)
+        job['argv'] = json.loads(job['argv'])
+        job['files'] = json.loads(job['files'] or '[]')
+        stages = [stage for file in job['files'] for stage in file['stages']]
+        finished = [stage for stage in stages if stage['status'] in ('ran', 'skipped', 'failed')]
+        job['progress'] = len(finished) / len(stages) if stages else 0.0
+        return job
+
+    def close(self):
+        self._db.close()
+
+
+def _warm_up():
+    """Load the markdown parser when a worker process starts. Nougat and gemma.cpp stay loaded after their first use."""
+    from src.markdown_to_html import markdown_parser
+
+    markdown_parser()
+
+
+class Service:
+    def __init__(self, queue: JobQueue, processes=2, concurrency=2):
+        """
+        Runs the queued jobs, up to `concurrency` at a time. The CPU stages of all jobs share one pool of `processes`
+        worker processes, which live as long as the service. Speech is synthesized on threads of the service, with one
+        backend per engine and voice and one rate limiter, shared by all jobs.
+        """
+        self.queue = queue
+        self.concurrency = concurrency
+        # spawned rather than forked, as the service has threads that may hold locks
+        self.pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_warm_up)
+        self._backends = {}
+        self._rate_limiters = {}
+        self._shared_lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._runners = []
+
+    def start(self):
+        for _ in range(self.concurrency):
+            runner = threading.Thread(target=self._run_jobs, daemon=True)
+            runner.start()
+            self._runners.append(runner)
+
+    def notify(self):
+        """Wake a runner for a newly submitted job."""
+        with self._wake:
+            self._wake.notify()
+
+    def stop(self):
+        """Stop after the jobs that are running, the queued jobs stay in the queue."""
+        with self._wake:
+            self._stopping = True
+            self._wake.notify_all()
+        for runner in self._runners:
+            runner.join()
+        self.pool.shutdown(cancel_futures=True)
+
+    def _run_jobs(self):
+        while True:
+            with self._wake:
+                if self._stopping:
+                    return
+                job = self.queue.claim()
+                if job is None:
+                    self._wake.wait()
+                    continue
+            self.run(job)
+
+    def _shared(self, args):
+        """The backend and rate limiter of the job, shared with the other jobs, so that clients stay warm."""
+        from src.speech_backends import get_backend
+        from src.text_to_speech import RateLimiter
+
+        with self._shared_lock:
+            key = (args.tts, args.voice)
+            if key not in self._backends:
+                self._backends[key] = get_backend(args.tts, args.voice)
+            if args.requests_per_minute not in self._rate_limiters:
+                self._rate_limiters[args.requests_per_minute] = RateLimiter(args.requests_per_minute)
+            return self._rate_limiters[args.requests_per_minute], self._backends[key]
+
+    def run(self, job):
+        """Run the stages of each file of the job, recording their status and seconds in the queue."""
+        from paper2speech import Job
+
+        print(f'Job {job["id"]} started: {" ".join(job["argv"])}')
+        try:
+            args = parse_job_args(job['argv'], job['cwd'])
+            rate_limiter, backend = self._shared(args)
+            files = []
+            for input_file in args.input_files:
+                name = os.path.splitext(os.path.basename(input_file))[0]
+                files.append(Job(input_file, [path.replace('{name}', name) for path in args.output_files], args,
+                                 rate_limiter, backend))
+        except Exception as e:
+            self.queue.update(job['id'], status='failed', error=str(e), finished=time.time())
+            print(f'Job {job["id"]} failed: {e}')
+            return
+
+        records = [{'input_file': file.input_file, 'output_files': file.output_files, 'status': 'queued',
+                    'stages': [{'name': stage.name, 'status': 'queued'} for stage in file.cpu_stages + file.io_stages]}
+                   for file in files]
+        self.queue.update(job['id'], files=records)
+        errors = []
+        for file, record in zip(files, records):
+            for out_path in file.out_paths:
+                if out_path:
+                    os.makedirs(out_path, exist_ok=True)
+            record['status'] = 'running'
+            stages = [(stage, True) for stage in file.cpu_stages] + [(stage, False) for stage in file.io_stages]
+            try:
+                for (stage, in_pool), stage_record in zip(stages, record['stages']):
+                    self._run_stage(job['id'], records, stage_record, stage, in_pool, file.manifest_file, args.force)
+                record['status'] = 'done'
+            except Exception as e:
+                record['status'] = 'failed'
+                errors.append(f'{file.input_file}: {e}')
+        self.queue.update(job['id'], files=records, status='failed' if errors else 'done',
+                          error='\n'.join(errors) or None, finished=time.time())
+        print(f'Job {job["id"]} {"failed" if errors else "done"}')
+
+    def _run_stage(self, job_id, records, stage_record, stage, in_pool, manifest_file, force):
+        from paper2speech import run_stages
+
+        stage_record['status'] = 'running'
+        self.queue.update(job_id, files=records)
+        start = time.perf_counter()
+        try:
+            if in_pool:
+                ran, _ = self.pool.submit(run_stages, [stage], manifest_file, force).result()
+            else:
+                ran, _ = run_stages([stage], manifest_file, force)
+            stage_record.update(status='ran' if ran else 'skipped')
+        except Exception as e:
+            stage_record.update(status='failed', error=str(e))
+            raise
+        finally:
+            stage_record['seconds'] = round(time.perf_counter() - start, 3)
+            self.queue.update(job_id, files=records)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs with {"args": [paper2speech arguments], "cwd": directory of relative paths} queues a job,
+    GET /jobs lists the jobs, GET /jobs/<id> returns a job with the status and seconds of its stages,
+    DELETE /jobs/<id> cancels a queued job.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, *args, service: Service, **kwargs):
+        self.service = service
+        super().__init__(*args, **kwargs)
+
+    def send_json(self, status, content):
+        body = json.dumps(content, indent=1).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job_id(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            return int(parts[1])
+        return None
+
+    def allowed(self):
+        # web pages could otherwise make the browser queue jobs that read and write any file
+        if 'Origin' in self.headers:
+            self.send_json(403, {'error': 'requests from web pages are not allowed'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.allowed():
+            return
+        if self.path.rstrip('/') == '/jobs':
+            self.send_json(200, self.service.queue.list())
+            return
+        job = self.job_id() and self.service.queue.get(self.job_id())
+        if job:
+            self.send_json(200, job)
+        else:
+            self.send_json(404, {'error': 'no such job'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.allowed():
+            return
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(body)
+            argv, cwd = request['args'], request.get('cwd')
+            if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+                raise ValueError('args has to be a list of strings')
+            parse_job_args(argv, cwd)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        id = self.service.queue.submit(argv, cwd)
+        self.service.notify()
+        self.send_json(201, self.service.queue.get(id))
+
+    def do_DELETE(self):
+        if not self.allowed():
+            return
+        id = self.job_id()
+        if id is None or not self.service.queue.get(id):
+            self.send_json(404, {'error': 'no such job'})
+        elif self.service.queue.cancel(id):
+            self.send_json(200, self.service.queue.get(id))
+        else:
+            self.send_json(409, {'error': 'only queued jobs can be cancelled'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service: Service, port=DEFAULT_PORT, host='127.0.0.1', socket_path=None):
+    """HTTP server of the service on host:port, or on the Unix socket socket_path if given."""
+    handler = functools.partial(ServiceHandler, service=service)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(method, path, content=None, port=DEFAULT_PORT, socket_path=None):
+    """Send a request to the service and return the status and json of the response."""
+    if socket_path:
+        connection = UnixHTTPConnection(socket_path)
+    else:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        body = None if content is None else json.dumps(content)
+        connection.request(method, path, body, {'Content-Type': 'application/json'} if body else {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def _print_job(job):
+    print(f'Job {job["id"]}: {job["status"]}, {job["progress"]:.0%}')
+    for file in job['files']:
+        stages = ', '.join(f'{stage["name"]} {stage["status"]}' + (f' {stage["seconds"]:.1f}s' if 'seconds' in stage
+                                                                   else '') for stage in file['stages'])
+        print(f'  {file["input_file"]} -> {", ".join(file["output_files"])}: {stages}')
+    if job['error']:
+        print(job['error'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', help='path of a Unix socket to listen on or connect to, instead of the port.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the service.')
+    serve.add_argument('--db', default=SERVICE_DB, help='sqlite database of the job queue.')
+    serve.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                       help='number of warm worker processes for OCR, markdown and html processing.')
+    serve.add_argument('--jobs', type=int, default=2, help='number of jobs that run at the same time.')
+    submit = commands.add_parser('submit', help='queue a conversion, with the arguments of paper2speech, and with '
+                                                '--wait, print the stages once the job has finished.')
+    submit.add_argument('args', nargs=argparse.REMAINDER)
+    status = commands.add_parser('status', help='print the status of a job, or of the latest jobs.')
+    status.add_argument('id', type=int, nargs='?')
+    args = parser.parse_args()
+    connection = {'port': args.port, 'socket_path': args.socket}
+
+    if args.command == 'serve':
+        service = Service(JobQueue(args.db), processes=args.processes, concurrency=args.jobs)
+        server = make_server(service, args.port, socket_path=args.socket)
+        service.start()
+        print(f'Serving jobs on {args.socket or f"http://localhost:{args.port}/jobs"}, queue in {args.db}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.stop()
+    elif args.command == 'submit':
+        # anywhere among the arguments of paper2speech, which has no --wait
+        wait = '--wait' in args.args
+        argv = [arg for arg in args.args if arg != '--wait']
+        status, job = request('POST', '/jobs', {'args': argv, 'cwd': os.getcwd()}, **connection)
+        if status != 201:
+            sys.exit(f'The job was not queued: {job["error"]}')
+        print(f'Job {job["id"]} queued')
+        while wait and job['status'] not in FINISHED:
+            time.sleep(POLL_INTERVAL)
+            _, job = request('GET', f'/jobs/{job["id"]}', **connection)
+        if wait:
+            _print_job(job)
+            sys.exit(0 if job['status'] == 'done' else 1)
+    else:
+        jobs = [request('GET', f'/jobs/{args.id}', **connection)[1]] if args.id else \
+            request('GET', '/jobs', **connection)[1][:10]
+        for job in jobs:
+            if 'error' in job and 'id' not in job:
+                sys.exit(job['error'])
+            _print_job(job)
+
+
+if __name__ == '__main__':
+    main()
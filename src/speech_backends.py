@@ -0,0 +1,249 @@
+"""
+Text-to-speech engines that synthesize chunks of SSML to MP3 audio: the Google Cloud API and Piper, which runs
+in-process on the CPU and needs neither network nor credentials.
+"""
+import abc
+import html
+import json
+import os
+import re
+import threading
+from typing import List, Optional, Tuple
+
+from src.cache import DiskCache
+from src.chunker import MAX_REQUEST_BYTES
+from src.profiling import span
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(PROJECT_DIR, "texttospeech.json")
+
+LANGUAGE_CODE = 'en-GB'
+VOICE_NAME = 'en-GB-Neural2-B'
+FALLBACK_VOICE_NAME = 'en-GB-Wavenet-B'
+SPEAKING_RATE = 1.0
+# name of a texttospeech.AudioEncoding
+AUDIO_ENCODING = 'MP3'
+
+# Piper voice model (.onnx, with its .onnx.json config next to it), from https://huggingface.co/rhasspy/piper-voices
+PIPER_VOICE = os.environ.get('PIPER_VOICE')
+# kbit/s of the MP3 audio, the same as the Google voices
+PIPER_BIT_RATE = 32
+# seconds of silence after a paragraph, breaks have their own time
+PARAGRAPH_PAUSE = 0.3
+
+_TAG = re.compile(r'<(/?)([\w:-]+)[^>]*>')
+_PAUSE = re.compile(r'<break\s+time="([\d.]+)(m?s)"\s*/?>|</p>')
+
+
+class FallbackAudio(bytes):
+    """Audio of a fallback voice, which is not cached, as the cache key is that of the requested voice."""
+
+
+class SpeechBackend(abc.ABC):
+    """
+    Interface of a text-to-speech engine. Chunks that are sent to it are at most max_request_bytes long, including
+    the <speak> element, and only contain ssml_tags; other tags are removed and their text is kept.
+    """
+    name = None
+    max_request_bytes = MAX_REQUEST_BYTES
+    # SSML tags that the engine understands, None for all tags that SSMLRenderer produces
+    ssml_tags: Optional[frozenset] = None
+    # number of chunks that are synthesized at the same time, unless set with --workers
+    max_workers = 4
+    # whether requests count against a quota, so that --requests-per-minute applies
+    rate_limited = True
+
+    @property
+    def params(self) -> dict:
+        """Settings that change the audio, for the speech cache and the pipeline manifest."""
+        return {'backend': self.name}
+
+    def cache_key(self, ssml: str) -> str:
+        """Key of the synthesized ssml in the speech cache."""
+        return DiskCache.key(ssml, *self.params.values())
+
+    def prepare(self, ssml: str) -> str:
+        """Remove the tags that the engine does not understand, keeping their content."""
+        if self.ssml_tags is None:
+            return ssml
+        return _TAG.sub(lambda match: match.group(0) if match.group(2) in self.ssml_tags else '', ssml)
+
+    @abc.abstractmethod
+    def synthesize(self, ssml: str, name: str, before_request=None) -> bytes:
+        """
+        Return the MP3 audio of a chunk of ssml, wrapped in <speak>.
+        Args:
+            name: name of the chunk in log messages
+            before_request: called right before each request to a rate limited API
+        """
+
+
+class GoogleSpeech(SpeechBackend):
+    name = 'google'
+
+    def __init__(self, voice=VOICE_NAME, language=None, fallback_voice=None):
+        """
+        Google Cloud text-to-speech, falling back to fallback_voice if a request fails, e.g. because a sentence is
+        too long for the Neural2 voices.
+        Args:
+            language: language code, by default the start of the voice name, e.g. en-GB
+            fallback_voice: FALLBACK_VOICE_NAME for the default voice, otherwise None for no fallback
+        """
+        self.voice = voice
+        self.language = language or ('-'.join(voice.split('-')[:2]) if voice != VOICE_NAME else LANGUAGE_CODE)
+        self.fallback_voice = fallback_voice or (FALLBACK_VOICE_NAME if voice == VOICE_NAME else None)
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def params(self) -> dict:
+        return {'voice': self.voice, 'language': self.language, 'rate': SPEAKING_RATE}
+
+    def cache_key(self, ssml):
+        return DiskCache.key(ssml, self.voice, self.language, SPEAKING_RATE, AUDIO_ENCODING)
+
+    def client(self):
+        """
+        Return the text-to-speech client, created on first use. google-cloud-texttospeech is only imported here,
+        so that commands that do not synthesize speech neither load it nor need credentials.
+        """
+        with self._client_lock:
+            if self._client is None:
+                from google.cloud import texttospeech
+
+                self._client = texttospeech.TextToSpeechClient()
+        return self._client
+
+    def synthesize(self, ssml, name, before_request=None):
+        from google.cloud import texttospeech
+
+        print("Started generating speech for {}".format(name))
+        speech_client = self.client()
+        synthesis_input = texttospeech.SynthesisInput(ssml=ssml)
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=texttospeech.AudioEncoding[AUDIO_ENCODING],
+            speaking_rate=SPEAKING_RATE,
+        )
+        voices = [self.voice] + ([self.fallback_voice] if self.fallback_voice else [])
+        for i, voice_name in enumerate(voices):
+            voice = texttospeech.VoiceSelectionParams(language_code=self.language, name=voice_name)
+            try:
+                if before_request:
+                    before_request()
+                with span('text-to-speech request', 'request', chunk=name, voice=voice_name):
+                    response = speech_client.synthesize_speech(
+                        request={"input": synthesis_input, "voice": voice, "audio_config": audio_config}
+                    )
+                return FallbackAudio(response.audio_content) if i else response.audio_content
+            except Exception:
+                if i == len(voices) - 1:
+                    raise
+                print(f"Retrying speech generation with {voices[i + 1]}...")
+
+
+def ssml_pieces(ssml: str) -> List[Tuple[str, float]]:
+    """Split ssml into its text and the seconds of silence that follow it, at breaks and paragraph ends."""
+    pieces = []
+    position = 0
+    for match in _PAUSE.finditer(ssml):
+        if match.group(1):
+            seconds = float(match.group(1)) / (1000 if match.group(2) == 'ms' else 1)
+        else:
+            seconds = PARAGRAPH_PAUSE
+        pieces.append((ssml[position:match.start()], seconds))
+        position = match.end()
+    pieces.append((ssml[position:], 0.0))
+    pieces = [(html.unescape(_TAG.sub(' ', text)).strip(), seconds) for text, seconds in pieces]
+    return [(' '.join(text.split()), seconds) for text, seconds in pieces if text or seconds]
+
+
+class PiperSpeech(SpeechBackend):
+    """
+    Piper voices run in-process with onnxruntime, one chunk per CPU core, each on a single thread.
+    Piper reads plain text, so of the SSML only breaks and paragraph pauses are kept, as silence.
+    Needs `pip install piper-tts lameenc`.
+    """
+    name = 'piper'
+    # smaller chunks spread a document over more cores and let playback start sooner
+    max_request_bytes = 2000
+    ssml_tags = frozenset({'speak', 'p', 'break'})
+    max_workers = os.cpu_count() or 1
+    rate_limited = False
+
+    def __init__(self, voice=PIPER_VOICE):
+        if not voice:
+            raise ValueError('Piper needs a voice model, set it with --voice or the PIPER_VOICE environment variable.')
+        self.voice = voice
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._version = None
+
+    @property
+    def params(self) -> dict:
+        return {'backend': self.name, 'voice': os.path.basename(self.voice), 'version': self.version(),
+                'rate': SPEAKING_RATE}
+
+    def version(self):
+        """
+        Size and modification time of the model and its config, so that voices with the same file name, e.g. an
+        updated download, do not share cached audio. Read once, as the params are part of each cache key.
+        """
+        if self._version is None:
+            version = []
+            for path in (self.voice, self.voice + '.json'):
+                try:
+                    stat = os.stat(path)
+                    version.append(f'{stat.st_size}-{stat.st_mtime_ns}')
+                except FileNotFoundError:
+                    version.append(None)
+            self._version = version
+        return self._version
+
+    def model(self):
+        """The Piper voice, loaded on first use with one onnxruntime thread per request."""
+        with self._model_lock:
+            if self._model is None:
+                try:
+                    import onnxruntime
+                    from piper.config import PiperConfig
+                    from piper.voice import PiperVoice
+                except ImportError as e:
+                    raise RuntimeError(f'The piper backend needs piper-tts: pip install piper-tts lameenc ({e})')
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = 1
+                options.inter_op_num_threads = 1
+                with open(self.voice + '.json', encoding='utf-8') as f:
+                    config = PiperConfig.from_dict(json.load(f))
+                session = onnxruntime.InferenceSession(self.voice, sess_options=options,
+                                                       providers=['CPUExecutionProvider'])
+                self._model = PiperVoice(session=session, config=config)
+        return self._model
+
+    def synthesize(self, ssml, name, before_request=None):
+        try:
+            import lameenc
+        except ImportError as e:
+            raise RuntimeError(f'The piper backend needs lameenc to encode MP3: pip install lameenc ({e})')
+        model = self.model()
+        sample_rate = model.config.sample_rate
+        pcm = []
+        with span('text-to-speech request', 'request', chunk=name, voice=self.params['voice']):
+            for text, pause in ssml_pieces(ssml):
+                if text:
+                    pcm += model.synthesize_stream_raw(text, length_scale=1 / SPEAKING_RATE)
+                # 16 bit mono
+                pcm.append(bytes(2 * int(pause * sample_rate)))
+            encoder = lameenc.Encoder()
+            encoder.set_bit_rate(PIPER_BIT_RATE)
+            encoder.set_in_sample_rate(sample_rate)
+            encoder.set_channels(1)
+            encoder.set_quality(2)
+            return bytes(encoder.encode(b''.join(pcm)) + encoder.flush())
+
+
+BACKENDS = {'google': GoogleSpeech, 'piper': PiperSpeech}
+
+
+def get_backend(name='google', voice=None) -> SpeechBackend:
+    """The backend called name, with its default voice if voice is None."""
+    return BACKENDS[name](voice) if voice else BACKENDS[name]()
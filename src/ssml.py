@@ -0,0 +1,147 @@
+"""Renders a markdown-it token stream as SSML, one segment per top-level element."""
+import html
+import re
+from typing import List
+
+from src.math_to_speech import verbalize_math
+
+HEADING_BREAK = '<break time="0.5s"/>'
+
+# markdown tags and the SSML tags they are read as, None drops the tag but keeps its content
+RENAMED_TAGS = {
+    'li': 'p',
+    'em': 'emphasis',
+    'strong': 'emphasis',
+    'ul': None,
+    'ol': None,
+    'a': None,
+    'section': None,
+    '': None,
+}
+
+# block tokens whose content is not read out
+SKIPPED_BLOCKS = {'table_open': 'table_close'}
+
+# raw html tags and comments, and the elements whose content is not text
+HTML_TAG = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?(?:-->|$)|</?[a-zA-Z][^>]*>|<[?!][^>]*>',
+                      re.DOTALL | re.IGNORECASE)
+
+
+def escape(text: str) -> str:
+    return html.escape(text, quote=False)
+
+
+def html_text(markup: str) -> str:
+    """Escaped text content of raw html, without its tags."""
+    return escape(html.unescape(HTML_TAG.sub('', markup)))
+
+
+def segment_text(segment: str) -> str:
+    """Text content of an SSML segment, without tags."""
+    return html.unescape(re.sub(r'<[^>]*>', '', segment))
+
+
+class SSMLRenderer:
+    """
+    Walks the token stream once. Headings are read as paragraphs with a pause before and after,
+    list items as paragraphs, emphasis as <emphasis>, inline math is read out, raw html is reduced
+    to its text, while block math, tables and images are skipped.
+    """
+    def __init__(self):
+        self.segments = []
+        self._parts = []
+        self._depth = 0
+
+    def render(self, tokens) -> List[str]:
+        skip_until = None
+        for token in tokens:
+            if skip_until:
+                if token.type == skip_until:
+                    skip_until = None
+                continue
+            if token.type in SKIPPED_BLOCKS:
+                skip_until = SKIPPED_BLOCKS[token.type]
+            elif token.type == 'heading_open':
+                self._void(HEADING_BREAK)
+                self._open('p')
+            elif token.type == 'heading_close':
+                self._close('p')
+                self._void(HEADING_BREAK)
+            elif token.type in ('paragraph_open', 'paragraph_close') and token.hidden:
+                continue
+            elif token.type == 'inline':
+                self._inline(token.children or [])
+            elif token.type.startswith('math_block') or token.type == 'front_matter':
+                continue
+            elif token.type in ('fence', 'code_block'):
+                self._void(f'<pre><code>{escape(token.content)}</code></pre>')
+            elif token.type == 'html_block':
+                text = html_text(token.content).strip()
+                if text:
+                    self._void(f'<p>{text}</p>')
+            elif token.type == 'footnote_block_open':
+                self._void('<hr/>')
+            elif token.type in ('footnote_open', 'footnote_close'):
+                self._tag('li', token.nesting)
+            else:
+                self._tag(token.tag, token.nesting)
+        self._flush()
+        return self.segments
+
+    def _inline(self, children):
+        for token in children:
+            if token.type == 'text':
+                self._text(escape(token.content))
+            elif token.type.startswith('math_inline'):
+                self._text(escape(verbalize_math(token.content)))
+            elif token.type == 'softbreak':
+                self._text('\n')
+            elif token.type == 'hardbreak':
+                self._text('<br/>')
+            elif token.type == 'code_inline':
+                self._text(f'<code>{escape(token.content)}</code>')
+            elif token.type == 'html_inline':
+                self._text(html_text(token.content))
+            elif token.type == 'footnote_ref':
+                label = f"[{token.meta['id'] + 1}]"
+                if token.meta.get('subId', 0) > 0:
+                    label += f":{token.meta['subId']}"
+                self._text(f'<sup>{label}</sup>')
+            elif token.type in ('image', 'footnote_anchor'):
+                continue
+            else:
+                self._tag(token.tag, token.nesting)
+
+    def _tag(self, tag, nesting):
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag is None:
+            return
+        if nesting == 1:
+            self._open(tag)
+        elif nesting == -1:
+            self._close(tag)
+        else:
+            self._void(f'<{tag}/>')
+
+    def _open(self, tag):
+        self._parts.append(f'<{tag}>')
+        self._depth += 1
+
+    def _close(self, tag):
+        self._parts.append(f'</{tag}>')
+        self._depth -= 1
+        if self._depth == 0:
+            self._flush()
+
+    def _void(self, markup):
+        self._parts.append(markup)
+        if self._depth == 0:
+            self._flush()
+
+    def _text(self, text):
+        self._parts.append(text)
+
+    def _flush(self):
+        if self._parts:
+            self.segments.append(''.join(self._parts))
+            self._parts = []
@@ -0,0 +1,239 @@
+"""
+Converts long tex documents to html with parallel LaTeXML processes, one per chapter or group of sections.
+Each part is converted to LaTeXML xml on its own, the parts are merged into one xml document, and a single
+latexmlpost pass turns it into html, so that references between parts are resolved.
+"""
+import hashlib
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from src.profiling import span
+
+LATEXML_COMMAND = ['latexml']
+LATEXMLPOST_COMMAND = ['latexmlpost', '--format=html5']
+# counters that keep counting across sections in article classes, by the environments that step them
+CARRIED_COUNTERS = {'equation': ('equation',), 'figure': ('figure',), 'table': ('table',), 'footnote': ()}
+# commands that step carried counters, \footnote[3]{...} sets the number instead
+_COUNTER_COMMANDS = {'footnote': re.compile(r'\\footnote(?:mark)?(?![a-zA-Z])(?!\s*\[)')}
+
+_BEGIN_DOCUMENT = re.compile(r'\\begin\s*\{document\}')
+_END_DOCUMENT = re.compile(r'\\end\s*\{document\}')
+_COMMENT = re.compile(r'(?<!\\)%.*')
+_INCLUDE = re.compile(r'^[ \t]*\\(?:include|input)\s*\{([^}]+)\}[ \t]*$', re.MULTILINE)
+_ENVIRONMENT = re.compile(r'\\(begin|end)\s*\{([^}]+)\}')
+_DEFINITION = re.compile(r'\s*\\(?:(?:re)?newcommand|providecommand|def|gdef|let|DeclareMathOperator|newtheorem|'
+                         r'(?:re)?newenvironment)(?![a-zA-Z])')
+_BRACE = re.compile(r'(?<!\\)[{}]')
+
+
+class Part:
+    def __init__(self, body: str, counters: dict, appendix: bool, definitions: str = ''):
+        """
+        Args:
+            body: tex between \\begin{document} and \\end{document} that belongs to the part
+            counters: values of the counters at the start of the part, e.g. {'chapter': 3}
+            appendix: whether the part comes after \\appendix
+            definitions: macros defined in the document body before the part, e.g. with \\newcommand
+        """
+        self.body = body
+        self.counters = counters
+        self.appendix = appendix
+        self.definitions = definitions
+
+    def document(self, preamble: str) -> str:
+        start = ''.join(f'\\setcounter{{{name}}}{{{value}}}\n' for name, value in self.counters.items())
+        if self.appendix:
+            start = '\\appendix\n' + start
+        start = self.definitions + start
+        return f'{preamble}\\begin{{document}}\n{start}{self.body}\n\\end{{document}}\n'
+
+
+def split_tex(content: str, base_dir: Optional[str] = None) -> Tuple[str, str, List[Part]]:
+    """
+    Split a document at its top-level \\chapter commands, or at its \\section commands if it has no chapters.
+    Files included by \\include or \\input in the document body are inlined first, so that their chapters are
+    found. The counters of the sectioning unit and CARRIED_COUNTERS are set at the start of each part, so that
+    numbering continues; numbers stepped by other environments, e.g. align, restart in each part. Macros that
+    are defined in the document body, at the top level, are repeated at the start of the later parts.
+    Args:
+        content: tex document
+        base_dir: directory that included files are relative to
+    Returns:
+        (preamble, unit, parts), where unit is 'chapter' or 'section' and the first part holds the front matter
+    """
+    begin, end = _BEGIN_DOCUMENT.search(content), _END_DOCUMENT.search(content)
+    if not begin or not end:
+        raise ValueError('the tex file has no document environment')
+    preamble = content[:begin.start()]
+    body = inline_includes(content[begin.end():end.start()], base_dir) if base_dir else content[begin.end():end.start()]
+
+    lines = body.splitlines(keepends=True)
+    code = [_COMMENT.sub('', line) for line in lines]
+    unit = 'chapter' if any(re.match(r'\s*\\chapter\b', line) for line in code) else 'section'
+    boundary = re.compile(rf'\s*\\{unit}\b')
+
+    parts = []
+    counters = dict.fromkeys([unit] + ([] if unit == 'chapter' else list(CARRIED_COUNTERS)), 0)
+    appendix = False
+    depth = 0
+    start = 0
+    current = {'counters': dict(counters), 'appendix': False, 'definitions': ''}
+    # definitions in the body so far, and the open braces of the one that continues on the next line
+    definitions = []
+    open_braces = 0
+    for i, line in enumerate(code):
+        if depth == 0 and boundary.match(line) and i > start and not open_braces:
+            parts.append(Part(''.join(lines[start:i]), **current))
+            start = i
+            current = {'counters': dict(counters), 'appendix': appendix, 'definitions': ''.join(definitions)}
+        if open_braces or (depth == 0 and _DEFINITION.match(line)):
+            definitions.append(line if line.endswith('\n') else line + '\n')
+            open_braces += sum(1 if brace == '{' else -1 for brace in _BRACE.findall(line))
+            open_braces = max(open_braces, 0)
+        if re.search(r'\\appendix\b', line):
+            appendix = True
+            # only the sectioning unit is numbered anew, equations, figures and tables keep counting
+            counters[unit] = 0
+        if depth == 0 and re.match(rf'\s*\\{unit}\s*[\[{{]', line):
+            counters[unit] += 1
+        for command, environment in _ENVIRONMENT.findall(line):
+            depth += 1 if command == 'begin' else -1
+            for counter, environments in CARRIED_COUNTERS.items():
+                if command == 'begin' and environment in environments and counter in counters:
+                    counters[counter] += 1
+        for counter, pattern in _COUNTER_COMMANDS.items():
+            if counter in counters:
+                counters[counter] += len(pattern.findall(line))
+        depth = max(depth, 0)
+    parts.append(Part(''.join(lines[start:]), **current))
+    return preamble, unit, parts
+
+
+def inline_includes(body: str, base_dir: str, depth=0) -> str:
+    """Replace \\include and \\input commands on their own line by the content of the files that exist."""
+    if depth > 10:
+        return body
+
+    def include(match):
+        path = os.path.join(base_dir, match.group(1).strip())
+        if not os.path.splitext(path)[1]:
+            path += '.tex'
+        if not os.path.isfile(path):
+            return match.group(0)
+        with open(path, 'r') as f:
+            return inline_includes(f.read(), base_dir, depth + 1).rstrip('\n')
+
+    return _INCLUDE.sub(include, body)
+
+
+def included_files(file_path) -> List[str]:
+    """Files included by \\include or \\input on their own line in the tex file, and in the files they include."""
+    base_dir = os.path.dirname(file_path)
+    files = []
+    pending = [file_path]
+    while pending:
+        with open(pending.pop(), 'r') as f:
+            content = f.read()
+        for match in _INCLUDE.finditer(content):
+            path = os.path.join(base_dir, match.group(1).strip())
+            if not os.path.splitext(path)[1]:
+                path += '.tex'
+            if os.path.isfile(path) and path not in files and len(files) < 1000:
+                files.append(path)
+                pending.append(path)
+    return files
+
+
+def merge_parts(xml_documents: List[str], unit: str) -> str:
+    """
+    Merge LaTeXML xml documents of consecutive parts into the first one. Of the other parts only the content
+    from their first sectioning unit on is kept, as the title, authors and resources are repeated in each part.
+    """
+    merged = xml_documents[0]
+    end = merged.rindex('</document>')
+    pieces = [merged[:end]]
+    first_unit = re.compile(rf'<{unit}[\s>/]')
+    for i, document in enumerate(xml_documents[1:], 1):
+        root = document.index('>', document.index('<document')) + 1
+        match = first_unit.search(document, root)
+        if not match:
+            raise RuntimeError(f'part {i} of the LaTeXML output does not contain a {unit}')
+        pieces.append(document[match.start():document.rindex('</document>')])
+    pieces.append(merged[end:])
+    return ''.join(pieces)
+
+
+def convert_parts(documents: List[str], parts_dir: str, source_dir: str, workers: int,
+                  command=LATEXML_COMMAND) -> List[str]:
+    """
+    Convert the tex documents to LaTeXML xml in parallel processes. Results are kept in parts_dir by the hash
+    of the tex, so that only changed parts are converted again.
+    Returns:
+        the xml documents
+    """
+    os.makedirs(parts_dir, exist_ok=True)
+    names = ['part-' + hashlib.sha256(document.encode()).hexdigest()[:16] for document in documents]
+    for name, document in zip(names, documents):
+        if not os.path.exists(os.path.join(parts_dir, name + '.xml')):
+            with open(os.path.join(parts_dir, name + '.tex'), 'w') as f:
+                f.write(document)
+
+    def convert(name):
+        xml_file = os.path.join(parts_dir, name + '.xml')
+        if os.path.exists(xml_file):
+            return False
+        with span('latexml part', 'process', part=name):
+            process = subprocess.run(command + [f'--path={source_dir}', f'--dest={xml_file}.tmp', name + '.tex'],
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=parts_dir)
+        if process.returncode != 0:
+            raise RuntimeError(f"LaTeXML conversion of {name}.tex failed: {process.stderr.decode('utf-8')}")
+        os.replace(xml_file + '.tmp', xml_file)
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        converted = list(executor.map(convert, dict.fromkeys(names)))
+    print(f'Converted {sum(converted)} of {len(converted)} parts with LaTeXML, reused the others.')
+
+    # remove parts of earlier versions of the document
+    for entry in os.listdir(parts_dir):
+        if entry.startswith('part-') and entry.split('.')[0] not in names:
+            os.remove(os.path.join(parts_dir, entry))
+
+    xml_documents = []
+    for name in names:
+        with open(os.path.join(parts_dir, name + '.xml'), 'r') as f:
+            xml_documents.append(f.read())
+    return xml_documents
+
+
+def tex_to_html_parallel(file_path, out_path, workers, post_command=LATEXMLPOST_COMMAND,
+                         command=LATEXML_COMMAND) -> bool:
+    """
+    Convert tex to html, converting its parts in parallel. The parts are kept in <name>.parts next to the tex
+    file, to be reused while they are unchanged.
+    Returns:
+        False if the document has a single part, in which case nothing is converted
+    """
+    source_dir = os.path.dirname(os.path.abspath(file_path))
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    with open(file_path, 'r') as f:
+        preamble, unit, parts = split_tex(f.read(), source_dir)
+    if len(parts) < 2:
+        return False
+    print(f'Converting {len(parts)} {unit}s of {file_path} with {workers} LaTeXML processes.')
+    parts_dir = os.path.join(source_dir, name + '.parts')
+    xml_documents = convert_parts([part.document(preamble) for part in parts], parts_dir, source_dir, workers,
+                                  command)
+    merged_file = os.path.join(parts_dir, name + '.xml')
+    with open(merged_file, 'w') as f:
+        f.write(merge_parts(xml_documents, unit))
+    html_file = os.path.abspath(os.path.join(out_path, name + '.html'))
+    with span('latexmlpost', 'process', parts=len(parts)):
+        process = subprocess.run(post_command + [f'--sourcedirectory={source_dir}', f'--dest={html_file}', merged_file],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"LaTeXML post-processing failed: {process.stderr.decode('utf-8')}")
+    return True
@@ -1,95 +1,158 @@
 import os
 import re
-import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from google.cloud import texttospeech
+from src.audio import append_file, atomic_write, submit_in_order
+from src.cache import DEFAULT_CACHE_DIR
+from src.chunker import pack_chunks, wrap
+from src.markdown_to_html import load_segments, markdown_file_segments
+from src.profiling import span
+from src.replacements import text_rules
+from src.speech_backends import FallbackAudio, GoogleSpeech, SpeechBackend
 
-from src import MarkdownModel
-from src.replacements import text_replacements
-
-PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.join(PROJECT_DIR, "texttospeech.json")
-
-speech_client = texttospeech.TextToSpeechClient()
+SPEECH_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'tts')
+# chunk size for playlists, about a minute of speech, so that the first segments are ready soon
+PROGRESSIVE_CHUNK_BYTES = 1000
 
 
 def apply_text_rules(text: str) -> str:
     """make replacements defined in replacements.py"""
-    for pattern, replacement in text_replacements:
-        text = re.sub(pattern, replacement, text)
-    return text
+    return text_rules.apply(text)
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `requests_per_minute` requests are started per minute."""
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        time.sleep(slot - now)
 
 
 class MP3Generator:
-    def __init__(self, md_filename):
+    def __init__(self, md_filename, max_workers=None, requests_per_minute=None, cache=None, rate_limiter=None,
+                 backend=None, chunk_bytes=None):
+        """
+        Args:
+            md_filename: path to the markdown file, or to SSML segments saved with save_segments (.json)
+            max_workers: number of chunks that are synthesized concurrently, 1 disables concurrency, None for the
+                max_workers of the backend
+            requests_per_minute: upper bound on synthesis requests per minute, None for no limit
+            cache: DiskCache for synthesized chunks, None to always call the backend
+            rate_limiter: RateLimiter shared with other generators, instead of requests_per_minute
+            backend: SpeechBackend, GoogleSpeech by default
+            chunk_bytes: maximum size of a chunk, at most and by default the max_request_bytes of the backend
+        """
         self.md_filename = md_filename
-        self.mp3_file_list = []
-        self.temp_path = tempfile.gettempdir()
+        self.failed_chunks = {}
         self.title_flag = True
         self.table_flag = False
-
-    def generate_mp3_files(self):
-        with open(self.md_filename, "r") as md_file:
-            mm = MarkdownModel()
-            mm.markdown_to_html(md_file.read())
-
-            for id, chunk in enumerate(mm.get_chunk()):
-                filename = f'{os.path.basename(self.md_filename)[:-4]}-{id}.mp3'
-                mp3_file = generate_mp3_for_ssml(self.temp_path, filename, chunk)
-                self.mp3_file_list.append(mp3_file)
-
-        return self.mp3_file_list
-
-
-def generate_mp3_for_ssml(out_path, filename, ssml):
-    print("Started generating speech for {}".format(filename))
-    # set text and configs
-    ssml = "<speak>\n" + ssml + "</speak>\n"
-    synthesis_input = texttospeech.SynthesisInput(ssml=ssml)
-    voice = texttospeech.VoiceSelectionParams(
-        language_code='en-GB',
-        name='en-GB-Neural2-B',
-    )
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3,
-        speaking_rate=1.0,
-    )
-
-    # generate speech
-    try:
-        response = speech_client.synthesize_speech(
-            request={"input": synthesis_input, "voice": voice, "audio_config": audio_config}
-        )
-    except Exception as e:
-        print("Retrying speech generation with WaveNet...")
-        voice = texttospeech.VoiceSelectionParams(
-            language_code='en-GB',
-            name='en-GB-Wavenet-B',
-        )
-        response = speech_client.synthesize_speech(
-            request={"input": synthesis_input, "voice": voice, "audio_config": audio_config}
-        )
-
-    # save a MP3 file and delete the text file
-    with open(os.path.join(out_path, filename), "wb") as out:
-        out.write(response.audio_content)
-    print("MP3 file saved: {}".format(filename))
-    return os.path.join(out_path, filename)
+        self.backend = backend or GoogleSpeech()
+        self.max_workers = max_workers or self.backend.max_workers
+        self.chunk_bytes = min(chunk_bytes or self.backend.max_request_bytes, self.backend.max_request_bytes)
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_minute)
+        self.cache = cache
+
+    def _synthesize_chunk(self, id, chunk):
+        stem = os.path.splitext(os.path.basename(self.md_filename))[0].removesuffix('.ssml')
+        name = f'{stem}-{id}'
+        before_request = self.rate_limiter.wait if self.backend.rate_limited else None
+        return synthesize_chunk(chunk, name, self.backend, cache=self.cache, before_request=before_request)
+
+    def write_mp3(self, out_file, playlist=None):
+        """
+        Synthesize all chunks of the markdown file, up to `max_workers` at a time, and append the audio
+        of each chunk to out_file in chunk order as soon as it is available.
+        out_file only appears once it is complete. Chunks that fail are left out and recorded in
+        `failed_chunks`, so that the audio of all other chunks is kept.
+        Args:
+            out_file: path of the mp3 file
+            playlist: SegmentPlaylist that each chunk is added to as it is written, None for no playlist
+        Returns:
+            number of chunks written
+        """
+        # segments are read and rendered as the chunks are submitted, not all up front
+        if self.md_filename.endswith('.json'):
+            segments = load_segments(self.md_filename)
+        else:
+            segments = markdown_file_segments(self.md_filename)
+
+        written = 0
+        try:
+            with atomic_write(out_file) as out, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    chunks = pack_chunks(segments, self.chunk_bytes)
+                    futures = submit_in_order(executor, self._synthesize_chunk, enumerate(chunks),
+                                              max_pending=2 * self.max_workers)
+                    for id, future in enumerate(futures):
+                        try:
+                            audio = future.result()
+                            out.write(audio)
+                            if playlist:
+                                playlist.add(f'{os.path.splitext(os.path.basename(out_file))[0]}-{id}.mp3', audio)
+                            written += 1
+                        except Exception as e:
+                            print(f"Generating speech for chunk {id} failed: {e}")
+                            self.failed_chunks[id] = e
+                    if not written:
+                        raise RuntimeError(f'No speech could be generated for {self.md_filename}.')
+                finally:
+                    executor.shutdown(cancel_futures=True)
+        finally:
+            # players stop polling the playlist once it is closed, also if synthesis failed
+            if playlist:
+                playlist.close()
+        print("MP3 file saved: {}".format(out_file))
+        return written
+
+
+def synthesize_chunk(ssml, name, backend: SpeechBackend, cache=None, before_request=None) -> bytes:
+    """
+    Return the MP3 audio of a chunk of ssml.
+    Args:
+        name: name of the chunk in log messages
+        backend: SpeechBackend that synthesizes the chunk
+        cache: DiskCache that is checked before and filled after calling the backend
+        before_request: called right before each API request, e.g. for rate limiting
+    """
+    with span('speech chunk', 'chunk', chunk=name, ssml_bytes=len(ssml)) as chunk_span:
+        ssml = wrap(backend.prepare(ssml))
+        key = backend.cache_key(ssml)
+        audio_content = cache.get(key) if cache else None
+        chunk_span.set(cached=audio_content is not None)
+        if audio_content is not None:
+            print("Using cached speech for {}".format(name))
+        else:
+            audio_content = backend.synthesize(ssml, name, before_request)
+            if cache and not isinstance(audio_content, FallbackAudio):
+                cache.put(key, audio_content)
+        chunk_span.set(audio_bytes=len(audio_content))
+    return audio_content
 
 
 def merge_mp3_files(out_path, mp3_file_list):
-
-    # merge saved mp3 files
+    """
+    Concatenate mp3 files 'foo-0.mp3', 'foo-1.mp3', ... into out_path/foo.mp3 and delete them.
+    The files are streamed into the merged file, which only appears once it is complete.
+    """
     print("Started merging mp3 files...")
 
-    # save the merged mp3 file
     merged_mp3_file_name = (
         re.sub("-[0-9]+.mp3", ".mp3", os.path.basename(mp3_file_list[0]))
     )  # 'foo-101' -> 'foo.mp3'
-    with open(os.path.join(out_path, merged_mp3_file_name), "wb") as out:
+    with atomic_write(os.path.join(out_path, merged_mp3_file_name)) as out:
         for mp3_file in mp3_file_list:
-            with open(mp3_file, "rb") as mp3:
-                out.write(mp3.read())
+            append_file(out, mp3_file)
 
     # delete mp3 files
     for mp3_file in mp3_file_list:
@@ -0,0 +1,83 @@
+"""Downloads the stylesheets of the html pages and the fonts they use, so that pages can be opened offline."""
+import hashlib
+import os
+import re
+import urllib.parse
+from typing import List
+
+from src.audio import atomic_write
+
+VENDOR_DIR = 'vendor'
+DOWNLOAD_TIMEOUT = 30
+# fonts.googleapis.com only serves woff2 fonts to browsers it knows
+USER_AGENT = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/120.0 Safari/537.36')
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def local_name(url: str, extension='') -> str:
+    """File name for a downloaded url, from the last part of its path, or from its hash if that has no extension."""
+    name = os.path.basename(urllib.parse.urlparse(url).path)
+    if not re.fullmatch(r'[\w.-]+\.\w+', name) or (extension and not name.endswith(extension)):
+        name = hashlib.sha256(url.encode()).hexdigest()[:16] + extension
+    return name
+
+
+def download(url: str) -> bytes:
+    # urllib.request loads http.client, ssl and email, which commands that convert nothing do not need
+    import urllib.request
+
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+        return response.read()
+
+
+def vendor_stylesheet(url: str, vendor_dir: str) -> str:
+    """
+    Download the stylesheet and the files it references into vendor_dir, unless it has been downloaded before,
+    and point its url() references to the local files.
+    Returns:
+        file name of the stylesheet in vendor_dir
+    """
+    name = local_name(url, '.css')
+    path = os.path.join(vendor_dir, name)
+    if os.path.exists(path):
+        return name
+    os.makedirs(vendor_dir, exist_ok=True)
+    css = download(url).decode('utf-8')
+
+    def localize(match):
+        reference = match.group(2)
+        if reference.startswith('data:'):
+            return match.group(0)
+        asset_url = urllib.parse.urljoin(url, reference)
+        asset_name = local_name(asset_url)
+        asset_path = os.path.join(vendor_dir, asset_name)
+        if not os.path.exists(asset_path):
+            data = download(asset_url)
+            with atomic_write(asset_path) as f:
+                f.write(data)
+        return f'url("{asset_name}")'
+
+    css = _CSS_URL.sub(localize, css)
+    with atomic_write(path) as f:
+        f.write(css.encode('utf-8'))
+    return name
+
+
+def vendor_stylesheets(urls: List[str], out_path: str) -> List[str]:
+    """
+    Return the hrefs of the stylesheets for pages in out_path, relative to the pages. Remote stylesheets are
+    downloaded to out_path/vendor; one that cannot be downloaded, e.g. offline, keeps its remote url.
+    """
+    hrefs = []
+    for url in urls:
+        if not urllib.parse.urlparse(url).scheme:
+            hrefs.append(url)
+            continue
+        try:
+            hrefs.append(f'./{VENDOR_DIR}/' + vendor_stylesheet(url, os.path.join(out_path, VENDOR_DIR)))
+        except (OSError, ValueError) as e:
+            print(f'Could not download {url}, the page links to it instead: {e}')
+            hrefs.append(url)
+    return hrefs
@@ -0,0 +1,98 @@
+"""Synthetic papers and books for the tests and benchmarks, heavy on math, citations and lists."""
+import random
+
+WORDS = ('model function operator space bound estimate sequence network training loss gradient sample '
+         'distribution kernel matrix vector graph node edge layer error convergence proof method result').split()
+INLINE_MATH = [
+    r'\(z(x)=\sum_{l}r(x)_{l}z_{l}^{T}\)',
+    r'\(\mathbb{E}_{x\sim p}[f(x)]\leq\epsilon\)',
+    r'\(\|A\|_{2}\)',
+    r'\(\alpha_{i}+\beta^{2}\)',
+    r'\(\frac{\partial\mathcal{L}}{\partial\theta}\)',
+    r'\(x\in\mathbb{R}^{n}\)',
+]
+DISPLAY_MATH = [
+    r'\[\mathcal{L}(\theta)=\frac{1}{N}\sum_{i=1}^{N}\log p_{\theta}(y_{i}\mid x_{i})\]',
+    r'\[\int_{\Omega}\nabla u\cdot\nabla v\,dx=\int_{\Omega}fv\,dx\]',
+]
+CITATIONS = ['(Smith et al., 2019)', '(Vaswani et al., 2017; Devlin et al., 2019)', '[3, 4]', '[12]',
+             'Garnelo et al. (2018)']
+ABBREVIATIONS = ['i.e.', 'e.g.', 'w.r.t.', 'cf. Fig. 3', 'see Sec. 4.1', 'in Tab. 2', 'Eq. 7']
+
+SENTENCES = [
+    'We consider the Cauchy problem for the heat equation on a bounded domain.',
+    'The operator <math alttext="A"><mi>A</mi></math> is self-adjoint &amp; positive.',
+    'By the previous estimate, the sequence is bounded in '
+    '<math alttext="L^2"><msup><mi>L</mi><mn>2</mn></msup></math>.',
+    'This follows from the dominated convergence theorem.',
+]
+THEOREM_STARTS = ['Theorem', 'Lemma', 'Corollary', 'Proposition', 'Definition', 'Remark', 'Example', 'Proof']
+
+
+def _sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 16))]
+    for _ in range(rng.randint(0, 2)):
+        words.insert(rng.randrange(len(words)), rng.choice(INLINE_MATH))
+    if rng.random() < 0.4:
+        words.insert(rng.randrange(len(words)), rng.choice(ABBREVIATIONS))
+    if rng.random() < 0.5:
+        words.append(rng.choice(CITATIONS))
+    return ' '.join(words).capitalize() + '.'
+
+
+def _paragraph(rng):
+    return ' '.join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def generate_markdown(sections: int, seed: int = 0) -> str:
+    """Build Nougat-like markdown of a paper with `sections` sections."""
+    rng = random.Random(seed)
+    parts = ['# Graph Element Networks: adaptive, structured computation and memory\n\n',
+             'Ferran Alet\\({}^{\\,1}\\)  Maria Bauza\\({}^{\\,2}\\)  Leslie Pack Kaelbling\\({}^{\\,1}\\)\n\n',
+             '###### Abstract\n\n', _paragraph(rng), '\n\n']
+    for section in range(1, sections + 1):
+        parts.append(f'## {section} {rng.choice(WORDS).capitalize()} {rng.choice(WORDS)}\n\n')
+        for _ in range(rng.randint(3, 8)):
+            block = rng.random()
+            if block < 0.15:
+                parts.append(rng.choice(DISPLAY_MATH) + '\n\n')
+            elif block < 0.3:
+                marker = rng.choice(['*', '-', '1.'])
+                parts.append(''.join(f'{marker} {_sentence(rng)}\n' for _ in range(rng.randint(2, 6))) + '\n')
+            elif block < 0.35:
+                parts.append(f'**{rng.choice(THEOREM_STARTS[:5])} {section}.** {_paragraph(rng)}\n\n')
+            else:
+                parts.append(_paragraph(rng) + '\n\n')
+    parts.append('## References\n\n')
+    for i in range(sections * 4):
+        parts.append(f'* Smith, J. and Doe, A. ({2000 + i % 24}). {_sentence(rng)} _Journal_, {i}:1-{i + 9}.\n')
+    return ''.join(parts)
+
+
+def generate_latexml_html(sections: int, seed: int = 0) -> str:
+    """Build html that resembles LaTeXML output of a book with `sections` sections."""
+    rng = random.Random(seed)
+    parts = ['<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8"/>\n<title>Book</title>\n'
+             '<link rel="stylesheet" href="LaTeXML.css" type="text/css"/>\n</head>\n<body>\n'
+             '<div class="ltx_page_main">\n<div class="ltx_page_content">\n<article class="ltx_document">\n']
+    for section in range(sections):
+        parts.append(f'<section id="S{section}" class="ltx_section">\n'
+                     f'<h2 class="ltx_title ltx_title_section"><span class="ltx_tag">{section}</span>Section</h2>\n')
+        for subsection in range(rng.randint(1, 3)):
+            parts.append(f'<h3 class="ltx_title">{section}.{subsection} Subsection</h3>\n')
+            for paragraph in range(rng.randint(3, 10)):
+                start = rng.choice(THEOREM_STARTS) + f' {paragraph}. ' if rng.random() < 0.3 else ''
+                text = ' '.join(rng.choice(SENTENCES) for _ in range(rng.randint(1, 5)))
+                parts.append(f'<div id="S{section}.p{paragraph}" class="ltx_para">\n'
+                             f'<p class="ltx_p">{start}{text}</p>\n</div>\n')
+                if rng.random() < 0.1:
+                    parts.append('<figure class="ltx_figure"><img src="x.png" alt=""/>'
+                                 '<figcaption>Figure</figcaption></figure>\n')
+        parts.append('</section>\n')
+    parts.append('</article>\n</div>\n</div>\n</body>\n</html>\n')
+    return ''.join(parts)
+
+
+def mp3_frames(count, header=b'\xff\xf3\x44\xc4', length=72 * 32000 // 24000):
+    """count empty frames, by default MPEG 2 layer III at 24 kHz and 32 kbit/s like the text-to-speech API"""
+    return (header + bytes(length - 4)) * count
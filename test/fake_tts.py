@@ -0,0 +1,33 @@
+"""Offline stand-in for the text-to-speech API, to test and benchmark synthesis without credentials or network."""
+import re
+import threading
+import time
+
+from test.corpus import mp3_frames
+from src.speech_backends import SpeechBackend
+
+# seconds of one MPEG 2 layer III frame at 24 kHz
+FRAME_SECONDS = 576 / 24000
+CHARACTERS_PER_SECOND = 15
+
+
+class FakeSpeech(SpeechBackend):
+    name = 'fake'
+
+    def __init__(self, latency=0.05):
+        """
+        Speech backend whose requests take `latency` seconds and return silent MP3 frames of about the duration
+        the API would return for the text.
+        """
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def synthesize(self, ssml, name, before_request=None):
+        if before_request:
+            before_request()
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        text = re.sub(r'<[^>]*>', '', ssml)
+        return mp3_frames(max(1, int(len(text) / CHARACTERS_PER_SECOND / FRAME_SECONDS)))
@@ -0,0 +1,26 @@
+"""Helpers shared by the tests and the benchmarks."""
+import os
+import subprocess
+import sys
+from unittest import mock
+
+from src.authors import classify_line
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that take long to import and are only needed by some stages
+HEAVY_MODULES = ['google', 'grpc', 'bs4', 'markdown_it', 'mdit_py_plugins', 'torch', 'nougat']
+
+
+def heuristic_author_detection():
+    """Decide authors with classify_line only, without starting gemma.cpp."""
+    return mock.patch('src.markdown_to_html.author_detector.is_authors',
+                      lambda lines: [bool(classify_line(line)) for line in lines])
+
+
+def heavy_imports():
+    """Heavy modules that are loaded by importing paper2speech."""
+    code = ('import sys, paper2speech; '
+            f'print(" ".join(sorted({{m.split(".")[0] for m in sys.modules}} & {set(HEAVY_MODULES)!r})))')
+    output = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, check=True, capture_output=True, text=True)
+    return output.stdout.split()
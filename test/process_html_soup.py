@@ -0,0 +1,89 @@
+"""The implementation of process_html with BeautifulSoup, before the streaming rewriter, as a reference."""
+from bs4 import BeautifulSoup
+
+
+def append_stylesheet(doc, href):
+    """Adds a stylesheet link to the HTML document."""
+    style_tag = doc.new_tag('link', rel='stylesheet', href=href)
+    doc.head.append(style_tag)
+
+
+def append_script(doc, src, onload=None):
+    """Adds a script tag to the HTML document with optional onload handler."""
+    script_tag = doc.new_tag('script', src=src)
+    if onload:
+        script_tag.string = f'window.onload = function() {{ {onload} }}'
+    doc.head.append(script_tag)
+
+
+def is_theorem(element):
+    return element.get_text().lstrip().startswith(('Theorem', 'Lemma', 'Corollary', 'Proposition', 'Definition',
+                                                   'Remark'))
+
+
+def wrap_theorems(doc):
+    headings = doc.select('h2, h3, h4, h6')
+
+    for heading in headings:
+        add_button(doc, heading)
+
+    paras = doc.select('.ltx_para')
+    for para in paras:
+        if is_theorem(para):
+            section = doc.new_tag('section')
+            section['class'] = 'ltx_theorem'
+            para.insert_before(section)
+            section.append(para)
+            next_element = section.find_next_sibling()
+            while next_element and not is_theorem(next_element):
+                section.append(next_element)
+                next_element = section.find_next_sibling()
+
+            add_button(doc, para)
+
+    return doc
+
+
+def add_button(doc, element):
+    new_button = doc.new_tag('button')
+    new_button['onclick'] = 'handleExplainButton(this)'
+    new_button['class'] = 'explain-section-button'
+    explain_span = doc.new_tag('span')
+    explain_span['class'] = 'material-icons-round'
+    explain_span.string = 'auto_awesome'
+
+    new_button.append(explain_span)
+    element.insert_before(new_button)
+
+
+def process_html_soup(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    soup.html['data-theme'] = 'dark'
+
+    append_stylesheet(soup, 'https://ar5iv.labs.arxiv.org/assets/ar5iv-fonts.0.7.9.min.css')
+    append_stylesheet(soup, 'https://ar5iv.labs.arxiv.org/assets/ar5iv.0.7.9.min.css')
+    append_stylesheet(soup, 'https://ar5iv.labs.arxiv.org/assets/ar5iv-site.0.2.2.css')
+    append_stylesheet(soup, 'https://fonts.googleapis.com/icon?family=Material+Icons+Round')
+    append_stylesheet(soup, './styles_latexml.css')
+
+    append_script(soup, 'https://cdn.jsdelivr.net/npm/mathpix-markdown-it@1.0.40/es5/bundle.js',
+                  onload='window.loadMathJax()')
+    append_script(soup, './script_latexml.js')
+
+    soup = wrap_theorems(soup)
+    return soup.prettify()
+
+
+def canonical(html_content):
+    """Tags with their attributes and the non-whitespace text in document order, ignoring formatting."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    events = []
+    for element in soup.descendants:
+        if element.name:
+            events.append((element.name, sorted((k, ' '.join(v) if isinstance(v, list) else v)
+                                                for k, v in element.attrs.items()),
+                           len(list(element.parents))))
+        elif element.strip():
+            events.append(' '.join(element.split()))
+    return events
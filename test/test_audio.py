@@ -0,0 +1,136 @@
+import os
+import random
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from src.audio import SegmentPlaylist, append_file, atomic_write, mp3_duration, split_mp3, submit_in_order
+
+
+def mp3_frames(count, header=b'\xff\xf3\x44\xc4', length=72 * 32000 // 24000):
+    """count empty frames, by default MPEG 2 layer III at 24 kHz and 32 kbit/s like the text-to-speech API"""
+    return (header + bytes(length - 4)) * count
+
+
+class TestAudio(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'paper.mp3')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_atomic_write(self):
+        with atomic_write(self.path) as out:
+            out.write(b'ID3')
+            self.assertFalse(os.path.exists(self.path))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'ID3')
+        self.assertEqual(os.listdir(self.temp_dir.name), ['paper.mp3'])
+
+    def test_atomic_write_permissions(self):
+        with mock.patch('src.audio._UMASK', 0o022):
+            with atomic_write(self.path) as out:
+                out.write(b'ID3')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+        # the permissions of the replaced file are kept
+        os.chmod(self.path, 0o640)
+        with atomic_write(self.path) as out:
+            out.write(b'ID3')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o640)
+
+    def test_atomic_write_keeps_old_file_on_error(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'old')
+        with self.assertRaises(KeyboardInterrupt):
+            with atomic_write(self.path) as out:
+                out.write(b'new')
+                raise KeyboardInterrupt
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(os.listdir(self.temp_dir.name), ['paper.mp3'])
+
+    def test_append_file(self):
+        parts = [os.urandom(n) for n in (0, 10, 3 << 20)]
+        paths = []
+        for i, part in enumerate(parts):
+            paths.append(os.path.join(self.temp_dir.name, f'paper-{i}.mp3'))
+            with open(paths[-1], 'wb') as f:
+                f.write(part)
+        with atomic_write(self.path) as out:
+            for path in paths:
+                append_file(out, path)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(parts))
+
+    def test_mp3_duration(self):
+        self.assertAlmostEqual(mp3_duration(mp3_frames(1000)), 1000 * 576 / 24000)
+        # MPEG 1 layer III at 44.1 kHz and 128 kbit/s, with padding
+        self.assertAlmostEqual(mp3_duration(mp3_frames(10, b'\xff\xfb\x92\x64', 144 * 128000 // 44100 + 1)),
+                               10 * 1152 / 44100)
+        id3 = b'ID3\x04\x00\x00\x00\x00\x00\x0a' + bytes(10)
+        self.assertAlmostEqual(mp3_duration(id3 + mp3_frames(100) + b'TAG' + bytes(125)), 100 * 576 / 24000)
+        self.assertEqual(mp3_duration(b''), 0)
+
+    def test_split_mp3(self):
+        id3 = b'ID3\x04\x00\x00\x00\x00\x00\x0a' + bytes(10)
+        data = id3 + mp3_frames(1000) + b'TAG'
+        # 24 ms frames
+        pieces = split_mp3(data, 10)
+        self.assertEqual(b''.join(pieces), data)
+        self.assertEqual([round(mp3_duration(piece), 3) for piece in pieces], [9.984, 9.984, 4.032])
+        self.assertTrue(pieces[0].startswith(id3))
+        self.assertEqual(split_mp3(b'', 10), [b''])
+
+    def test_segment_playlist(self):
+        playlist = SegmentPlaylist(os.path.join(self.temp_dir.name, 'paper.m3u8'))
+        playlist.add('paper-0.mp3', mp3_frames(250))
+        with open(playlist.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[-2:], ['#EXTINF:6.000,', 'paper-segments/paper-0-0.mp3'])
+        self.assertNotIn('#EXT-X-ENDLIST', lines)
+        self.assertIn('#EXT-X-TARGETDURATION:10', lines)
+
+        # audio longer than the target duration is split
+        playlist.add('paper-2.mp3', mp3_frames(500))
+        playlist.close()
+        with open(playlist.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[-5:], ['#EXTINF:9.984,', 'paper-segments/paper-2-0.mp3', '#EXTINF:2.016,',
+                                      'paper-segments/paper-2-1.mp3', '#EXT-X-ENDLIST'])
+        # the target duration does not change while the playlist grows
+        self.assertIn('#EXT-X-TARGETDURATION:10', lines)
+        self.assertEqual(sorted(os.listdir(playlist.segment_dir)), ['paper-0-0.mp3', 'paper-2-0.mp3', 'paper-2-1.mp3'])
+
+        # a new playlist at the same path replaces the segments of the old one
+        playlist = SegmentPlaylist(playlist.path)
+        self.assertEqual(os.listdir(playlist.segment_dir), [])
+
+    def test_submit_in_order(self):
+        rng = random.Random(0)
+        running = []
+        lock = threading.Lock()
+        max_submitted_ahead = 0
+
+        def work(i):
+            with lock:
+                running.append(i)
+            time.sleep(rng.random() / 1000)
+            return i
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = []
+            for future in submit_in_order(executor, work, ((i,) for i in range(100)), max_pending=8):
+                results.append(future.result())
+                with lock:
+                    max_submitted_ahead = max(max_submitted_ahead, len(running) - len(results))
+        self.assertEqual(results, list(range(100)))
+        self.assertLessEqual(max_submitted_ahead, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
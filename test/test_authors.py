@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from src import MarkdownModel
+from src.authors import AuthorDetector, classify_line
+
+# answers like gemma.cpp: True if the line contains 'Smith', each answer followed by an empty line
+FAKE_GEMMA = r'''
+import sys
+for prompt in sys.stdin:
+    with open(sys.argv[1], 'a') as log:
+        log.write('prompt\n')
+    print('True' if 'Smith' in prompt else 'False', end='\n\n', flush=True)
+'''
+
+
+class TestAuthors(unittest.TestCase):
+    def test_classify_line(self):
+        self.assertTrue(classify_line('Ferran Alet,  Adarsh K. Jeewajee,  Maria Bauza,'))
+        self.assertTrue(classify_line('Alberto Rodriguez†, Tomas Lozano-Perez* and Ludwig van Beethoven'))
+        self.assertFalse(classify_line('Graph Element Networks: adaptive, structured computation and memory'))
+        self.assertFalse(classify_line('Abstract'))
+        self.assertFalse(classify_line('We propose a new method for learning graph networks.'))
+        self.assertFalse(classify_line('alet@mit.edu'))
+        # title case titles and single names need the language model
+        self.assertIsNone(classify_line('Attention Is All You Need'))
+        self.assertIsNone(classify_line('John Smith'))
+        self.assertIsNone(classify_line('Pattern Recognition and Machine Learning'))
+        self.assertIsNone(classify_line('Neural Networks and Deep Learning'))
+        self.assertIsNone(classify_line('Jane Doe and John Roe'))
+
+    def test_detector(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log = os.path.join(temp_dir, 'prompts')
+            detector = AuthorDetector(cache_dir=os.path.join(temp_dir, 'cache'),
+                                      gemma_command=[sys.executable, '-c', FAKE_GEMMA, log])
+            lines = ['Attention Is All You Need', 'John Smith', 'Ferran Alet1, Maria Bauza2', 'Abstract']
+            self.assertEqual(detector.is_authors(lines), [False, True, True, False])
+            self.assertEqual(detector.is_authors(lines), [False, True, True, False])
+            # only ambiguous lines are sent to the model, each once
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 2)
+
+            # verdicts are cached across detectors
+            detector = AuthorDetector(cache_dir=os.path.join(temp_dir, 'cache'),
+                                      gemma_command=[sys.executable, '-c', FAKE_GEMMA, log])
+            self.assertEqual(detector.is_authors(lines), [False, True, True, False])
+            with open(log) as f:
+                self.assertEqual(len(f.read().splitlines()), 2)
+
+            # but not across models
+            detector = AuthorDetector(cache_dir=os.path.join(temp_dir, 'cache'), gemma_command=['/nonexistent/gemma'])
+            self.assertEqual(detector.is_authors(lines), [False, False, True, False])
+
+    def test_detector_without_gemma(self):
+        detector = AuthorDetector(cache_dir=None, gemma_command=['/nonexistent/gemma'])
+        self.assertEqual(detector.is_authors(['John Smith', 'Ferran Alet, Maria Bauza']), [False, True])
+
+    def test_title_case_title_is_kept(self):
+        detector = AuthorDetector(cache_dir=None, gemma_command=['/nonexistent/gemma'])
+        model = MarkdownModel()
+        with mock.patch('src.markdown_to_html.author_detector', detector):
+            model.markdown_to_html('# Neural Networks and Deep Learning\n\nJane Doe, John Roe\n\n###### Abstract\n\n'
+                                   'We study networks.')
+        self.assertIn('<p>Neural Networks and Deep Learning</p>', model.ssml)
+        self.assertNotIn('Jane Doe', model.ssml)
+
+
+if __name__ == '__main__':
+    unittest.main()
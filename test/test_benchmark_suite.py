@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.suite import compare, run
+from src.audio import mp3_duration
+from src.text_to_speech import MP3Generator
+from test.corpus import generate_markdown
+from test.fake_tts import FakeSpeech
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_compare(self):
+        baselines = {'calibration_s': 0.1, 'benchmarks': {
+            'text_rules[book]': 0.2, 'text_rules[paper]': 0.004, 'synthesis[paper]': 0.1}}
+        # a machine that is twice as slow, synthesis waits for the API and is not scaled
+        results = {'text_rules[book]': 0.5, 'text_rules[paper]': 0.016, 'synthesis[paper]': 0.12, 'new[paper]': 1.0}
+        expected, regressions = compare(results, 0.2, baselines, threshold=0.2)
+        self.assertEqual(expected, {'text_rules[book]': 0.4, 'text_rules[paper]': 0.008, 'synthesis[paper]': 0.1,
+                                    'new[paper]': None})
+        # text_rules[paper] is twice its baseline, but by less than the timer noise
+        self.assertEqual(regressions, ['text_rules[book]'])
+
+    def test_fake_speech(self):
+        speech = FakeSpeech(latency=0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            markdown_file = os.path.join(temp_dir, 'paper.mmd')
+            with open(markdown_file, 'w') as f:
+                f.write(generate_markdown(2))
+            chunks = MP3Generator(markdown_file, backend=speech).write_mp3(os.path.join(temp_dir, 'paper.mp3'))
+            with open(os.path.join(temp_dir, 'paper.mp3'), 'rb') as f:
+                duration = mp3_duration(f.read())
+        self.assertEqual(speech.requests, chunks)
+        # about 15 characters per second
+        self.assertGreater(duration, 200)
+
+    def test_run(self):
+        results = run('[paper]', repeat=1, latency=0)
+        self.assertEqual(set(results), {'markdown_to_html[paper]', 'get_chunk[paper]', 'text_rules[paper]',
+                                        'process_html[paper]', 'merge_mp3_files[paper]', 'synthesis[paper]'})
+        self.assertTrue(all(seconds > 0 for seconds in results.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
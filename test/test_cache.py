@@ -0,0 +1,66 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src.cache import DiskCache
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.temp_dir.name, max_bytes=250)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key(self):
+        self.assertEqual(DiskCache.key('<speak>a</speak>', 'en-GB-Neural2-B', 1.0),
+                         DiskCache.key('<speak>a</speak>', 'en-GB-Neural2-B', 1.0))
+        self.assertNotEqual(DiskCache.key('<speak>a</speak>', 'en-GB-Neural2-B', 1.0),
+                            DiskCache.key('<speak>a</speak>', 'en-GB-Neural2-B', 1.25))
+        # parts are separated, so moving characters between them changes the key
+        self.assertNotEqual(DiskCache.key('ab', 'c'), DiskCache.key('a', 'bc'))
+
+    def test_get_put(self):
+        key = DiskCache.key('chunk')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, b'audio')
+        self.assertEqual(self.cache.get(key), b'audio')
+        # no temporary files are left behind
+        files = [name for _, _, names in os.walk(self.temp_dir.name) for name in names]
+        self.assertEqual(files, [key])
+
+    def test_lru_eviction(self):
+        keys = [DiskCache.key(i) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, bytes(100))
+            # make modification times distinguishable on coarse file systems
+            os.utime(self.cache._path(key), (time.time() + i, time.time() + i))
+        self.assertIsNone(self.cache.get(keys[0]))
+        self.assertIsNotNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+    def test_recently_used_entries_are_kept(self):
+        keys = [DiskCache.key(i) for i in range(3)]
+        self.cache.put(keys[0], bytes(100))
+        self.cache.put(keys[1], bytes(100))
+        os.utime(self.cache._path(keys[0]), (1, 1))
+        os.utime(self.cache._path(keys[1]), (2, 2))
+        self.cache.get(keys[0])  # marks keys[0] as recently used
+        self.cache.put(keys[2], bytes(100))
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+
+    def test_overwrites_are_counted_once(self):
+        keys = [DiskCache.key(i) for i in range(2)]
+        for _ in range(3):
+            self.cache.put(keys[0], bytes(100))
+        self.cache.put(keys[1], bytes(100))
+        self.assertEqual(self.cache._total_bytes, 200)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNotNone(self.cache.get(keys[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
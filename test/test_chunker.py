@@ -0,0 +1,86 @@
+import random
+import re
+import unittest
+
+from src.chunker import MAX_REQUEST_BYTES, byte_length, pack_chunks, split_segment, wrap
+from src.ssml import segment_text
+
+WORDS = ['the', 'model', 'Straße', 'naïve', 'café', '日本語', 'テキスト', '😀', 'x', 'equation', 'a',
+         '&amp;', '&lt;', 'Verbesserungsvorschläge', 'über']
+
+
+def random_sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 40))]
+    if rng.random() < 0.3:
+        start = rng.randrange(len(words))
+        words[start] = '<emphasis>' + words[start]
+        words[-1] += '</emphasis>'
+    return ' '.join(words) + rng.choice(['.', '!', '?', ''])
+
+
+def random_segment(rng, sentences):
+    return '<p>' + ' '.join(random_sentence(rng) for _ in range(sentences)) + '</p>'
+
+
+def is_balanced(ssml):
+    stack = []
+    for tag in re.findall(r'<[^>]*>', ssml):
+        if tag.endswith('/>'):
+            continue
+        if tag.startswith('</'):
+            if not stack or stack.pop() != tag[2:-1]:
+                return False
+        else:
+            stack.append(tag[1:-1].split()[0])
+    return not stack
+
+
+class TestChunker(unittest.TestCase):
+    def assertValidChunks(self, segments, chunks, max_bytes):
+        for chunk in chunks:
+            self.assertLessEqual(byte_length(wrap(chunk)), max_bytes)
+            self.assertTrue(is_balanced(chunk), chunk)
+            # entities are not cut in half
+            self.assertEqual(re.findall(r'&[#\w]*$', segment_text(chunk.replace('&', '&amp;'))), [])
+        self.assertEqual(''.join(segment_text(chunk) for chunk in chunks),
+                         ''.join(segment_text(segment) for segment in segments))
+
+    def test_counts_bytes(self):
+        # 3000 characters, but 5500 bytes
+        segment = '<p>' + '日本語. ' * 500 + '</p>'
+        chunks = list(pack_chunks([segment]))
+        self.assertEqual(len(chunks), 2)
+        self.assertValidChunks([segment], chunks, MAX_REQUEST_BYTES)
+
+    def test_splits_at_sentences(self):
+        segment = '<p>' + 'First sentence here. ' * 300 + '</p>'
+        for chunk in pack_chunks([segment]):
+            self.assertTrue(segment_text(chunk).endswith('here. '))
+
+    def test_packs_tightly(self):
+        rng = random.Random(0)
+        segments = [random_segment(rng, rng.randint(1, 3)) for _ in range(200)]
+        chunks = list(pack_chunks(segments))
+        for chunk, following in zip(chunks, chunks[1:]):
+            next_segment = next(segment for segment in segments if following.startswith(segment))
+            self.assertGreater(byte_length(wrap(chunk + next_segment)), MAX_REQUEST_BYTES)
+        self.assertValidChunks(segments, chunks, MAX_REQUEST_BYTES)
+
+    def test_fuzz(self):
+        rng = random.Random(1)
+        for _ in range(100):
+            max_bytes = rng.choice([120, 300, 1000, MAX_REQUEST_BYTES])
+            segments = [random_segment(rng, rng.randint(1, 60)) for _ in range(rng.randint(1, 5))]
+            if rng.random() < 0.3:
+                # a single word longer than the limit
+                segments.append('<p>' + 'ü' * max_bytes + '</p>')
+            chunks = list(pack_chunks(segments, max_bytes))
+            self.assertValidChunks(segments, chunks, max_bytes)
+
+    def test_split_segment_reopens_tags(self):
+        pieces = split_segment('<p><emphasis>One two. Three four.</emphasis></p>', 40)
+        self.assertEqual(pieces, ['<p><emphasis>One two. </emphasis></p>', '<p><emphasis>Three four.</emphasis></p>'])
+
+
+if __name__ == '__main__':
+    unittest.main()
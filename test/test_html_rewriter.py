@@ -0,0 +1,62 @@
+import unittest
+
+from src.html_rewriter import EXPLAIN_BUTTON, MARKDOWN_BUNDLE, rewrite_html, static_mathml
+from test.corpus import generate_latexml_html
+from test.process_html_soup import canonical, process_html_soup
+
+
+def page(body):
+    return f'<!DOCTYPE html><html lang="en"><head><title>T</title></head><body>{body}</body></html>'
+
+
+class TestHTMLRewriter(unittest.TestCase):
+    def assertSameAsSoup(self, content):
+        self.assertEqual(canonical(rewrite_html(content)), canonical(process_html_soup(content)))
+
+    def test_same_as_soup(self):
+        for seed in range(5):
+            self.assertSameAsSoup(generate_latexml_html(10, seed))
+
+    def test_theorem_sections(self):
+        content = page('<div class="ltx_para">Intro</div>'
+                       '<div class="ltx_para ltx_noindent"> <b>Lemma</b> 1.</div><div class="ltx_para">Proof.</div>'
+                       '<p>Theorem without ltx_para</p><div class="ltx_para">After</div>')
+        self.assertSameAsSoup(content)
+        self.assertIn('<section class="ltx_theorem">' + EXPLAIN_BUTTON + '<div class="ltx_para ltx_noindent"> '
+                      '<b>Lemma</b> 1.</div><div class="ltx_para">Proof.</div></section><p>Theorem',
+                      rewrite_html(content))
+
+    def test_nested_theorems(self):
+        self.assertSameAsSoup(page('<div class="ltx_para">Definition 1<div class="ltx_para">Remark 2</div>'
+                                   '<span>text</span></div><div class="ltx_para">Corollary 3</div>'))
+
+    def test_head_and_theme(self):
+        result = rewrite_html(page('<h2>Title</h2><h5>Not a button</h5>'))
+        self.assertTrue(result.startswith('<!DOCTYPE html><html lang="en" data-theme="dark"><head><title>T</title>'
+                                          '<link href='))
+        self.assertIn(EXPLAIN_BUTTON + '<h2>Title</h2><h5>', result)
+        self.assertIn('<script src="./script_latexml.js"></script></head>', result)
+
+    def test_keeps_markup(self):
+        body = ('<p>a &amp; b &#x3C; c<br>d<img src="x.png" alt="&quot;x&quot;"/></p><!-- comment -->'
+                '<math><annotation><![CDATA[x<y]]></annotation></math><script>if (a < b) {}</script>')
+        self.assertIn(body, rewrite_html(page(body)))
+
+    def test_static_math(self):
+        math = ('<math id="m1" alttext="x^{2}" display="inline"><semantics><msup><mi>x</mi><mn>2</mn></msup>'
+                '<annotation-xml encoding="MathML-Content"><apply><csymbol>superscript</csymbol></apply>'
+                '</annotation-xml><annotation encoding="application/x-tex">x^{2}</annotation></semantics></math>')
+        static = '<math id="m1" alttext="x^{2}" display="inline"><msup><mi>x</mi><mn>2</mn></msup></math>'
+        self.assertEqual(static_mathml(math), static)
+        content = page(f'<div class="ltx_para">Lemma 1. {math} is</div><div class="ltx_para">Proof {math}</div>')
+        result = rewrite_html(content, static_math=True, stylesheets=['./vendor/ar5iv.css'])
+        self.assertIn(f'<section class="ltx_theorem">{EXPLAIN_BUTTON}<div class="ltx_para">Lemma 1. {static} is</div>'
+                      f'<div class="ltx_para">Proof {static}</div></section>', result)
+        self.assertIn(f'<meta name="markdown-bundle" content="{MARKDOWN_BUNDLE}"/>', result)
+        self.assertNotIn(f'<script src="{MARKDOWN_BUNDLE}"', result)
+        self.assertIn('<link href="./vendor/ar5iv.css" rel="stylesheet"/><script src="./script_latexml.js">', result)
+        self.assertIn(math, rewrite_html(content))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from src import math_to_speech
+from src.math_to_speech import verbalize_math, _verbalize_normalized
+
+
+class TestVerbalizeMath(unittest.TestCase):
+    def test_symbols(self):
+        self.assertEqual(verbalize_math(r'z(x)=\sum_{l}r(x)_{l}z_{l}^{T}'),
+                         'z(x)= summation over l r(x) l z l transpose')
+        self.assertEqual(verbalize_math(r'\mathbb{E}[X] \leq \alpha x'),
+                         'expectation [X] less than or equal to alpha x')
+        self.assertEqual(verbalize_math(r'\lVert\cdot\rVert'), 'norm')
+
+    def test_nested_braces(self):
+        self.assertEqual(verbalize_math(r'\frac{\sqrt{x^{2}+1}}{2\pi}'), 'square root of x squared plus 1 over 2 pi')
+        self.assertEqual(verbalize_math(r'\sqrt[3]{\frac{a}{\hat{b}}}'), 'cube root of a over b hat')
+        self.assertEqual(verbalize_math(r'\sqrt[n]{x}'), 'n-th root of x')
+
+    def test_malformed(self):
+        self.assertEqual(verbalize_math(r'}\frac{a'), 'a over')
+        self.assertEqual(verbalize_math(r'x^'), 'x')
+
+    def test_whitespace_is_normalized(self):
+        _verbalize_normalized.cache_clear()
+        self.assertEqual(verbalize_math('\\alpha  +\n\\beta'), verbalize_math('\\alpha + \\beta'))
+        self.assertEqual(_verbalize_normalized.cache_info().hits, 1)
+
+    def test_deep_nesting(self):
+        self.assertEqual(verbalize_math('{' * 1200 + r'x \alpha' + '}' * 1200), 'x alpha')
+        self.assertEqual(verbalize_math(r'\sqrt' * 1200 + '{a+b}'), 'a plus b')
+
+    def test_long_run(self):
+        self.assertEqual(verbalize_math('x' * 100000), 'x' * 100000)
+
+    def test_parser_steps_are_linear(self):
+        def steps(repeat):
+            with mock.patch.object(math_to_speech, '_parse_argument', wraps=math_to_speech._parse_argument) as spy:
+                verbalize_math(r'\frac{a_{i}}{\sqrt{b^{2}}} + ' * repeat)
+            return spy.call_count
+
+        self.assertEqual(steps(2000), 2 * steps(1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import contextlib
+import sys
+import types
+import unittest
+from unittest import mock
+
+from src.ocr import NougatWorker, convert_sharded, join_pages, mmd_path, shard_pages
+
+
+class StubDataset:
+    """Stands in for nougat's LazyDataset: each item is a page and the file name on the last page of a PDF."""
+    def __init__(self, pdf_file, prepare, pages):
+        self.items = [(f'{pdf_file}:{page}', pdf_file if page == pages[-1] else '') for page in pages]
+
+    @staticmethod
+    def ignore_none_collate(batch):
+        return [image for image, _ in batch], [name for _, name in batch]
+
+
+def stub_modules():
+    """torch and nougat modules with only what NougatWorker uses to recognize pages."""
+    def data_loader(dataset, batch_size, shuffle, collate_fn):
+        return [collate_fn(dataset[i:i + batch_size]) for i in range(0, len(dataset), batch_size)]
+
+    names = ('torch', 'torch.utils', 'torch.utils.data', 'nougat', 'nougat.utils', 'nougat.utils.dataset',
+             'nougat.postprocessing')
+    modules = {name: types.ModuleType(name) for name in names}
+    modules['torch.utils.data'].ConcatDataset = lambda datasets: [item for d in datasets for item in d.items]
+    modules['torch.utils.data'].DataLoader = data_loader
+    modules['nougat.utils.dataset'].LazyDataset = StubDataset
+    modules['nougat.postprocessing'].markdown_compatible = lambda output: output + ' (compatible)'
+    return mock.patch.dict(sys.modules, modules)
+
+
+class StubModel:
+    encoder = types.SimpleNamespace(prepare_input=lambda image, random_padding: image)
+
+    def inference(self, image_tensors, early_stopping):
+        predictions = ['[MISSING_PAGE_POST]' if image.endswith(':1') else f'text of {image}' for image in image_tensors]
+        return {'predictions': predictions, 'repeats': [None] * len(image_tensors)}
+
+
+class TestOCR(unittest.TestCase):
+    def test_mmd_path(self):
+        self.assertEqual(mmd_path('papers/2310.1234.v2.pdf', 'out'), 'out/2310.1234.v2.mmd')
+
+    def test_join_pages(self):
+        pages = ['# Title\n\nFirst page\n', '\n\n[MISSING_PAGE_EMPTY:2]\n\n', '\n\n\nThird page\n\n']
+        self.assertEqual(join_pages(pages), '# Title\n\nFirst page\n\n[MISSING_PAGE_EMPTY:2]\n\nThird page')
+
+    def test_shard_pages(self):
+        self.assertEqual(shard_pages(10, 4), [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]])
+        self.assertEqual(shard_pages(2, 8), [[0], [1]])
+        self.assertEqual(shard_pages(0, 8), [])
+        for page_count in range(1, 50):
+            for shard_count in range(1, 12):
+                shards = shard_pages(page_count, shard_count)
+                self.assertEqual(sum(shards, []), list(range(page_count)))
+                self.assertLessEqual(max(map(len, shards)) - min(map(len, shards)), 1)
+
+    def test_convert_pages(self):
+        worker = NougatWorker.__new__(NougatWorker)
+        worker.model = StubModel()
+        worker.batch_size = 2
+        worker.skipping = False
+        worker._torch = types.SimpleNamespace(inference_mode=contextlib.nullcontext)
+        with stub_modules():
+            self.assertEqual(worker.convert_pages('paper.pdf', [0, 1, 2]),
+                             ['text of paper.pdf:0 (compatible)', '\n\n[MISSING_PAGE_EMPTY:2]\n\n',
+                              'text of paper.pdf:2 (compatible)'])
+
+    def test_empty_pdf(self):
+        pypdf = types.ModuleType('pypdf')
+        pypdf.PdfReader = lambda pdf_file: types.SimpleNamespace(pages=[])
+        with mock.patch.dict(sys.modules, {'pypdf': pypdf}), self.assertRaises(RuntimeError):
+            convert_sharded('empty.pdf', 'out', processes=2, recompute=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
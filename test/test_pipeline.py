@@ -0,0 +1,147 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from paper2speech import Job, get_args
+from src.pipeline import Pipeline, Stage
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.manifest = self.path('manifest.json')
+        self.calls = []
+        with open(self.path('paper.pdf'), 'w') as f:
+            f.write('pdf')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def convert(self, name, src, dst, suffix):
+        self.calls.append(name)
+        with open(src) as f:
+            content = f.read()
+        with open(dst, 'w') as f:
+            f.write(content + suffix)
+
+    def stages(self, fail=False, params=None):
+        def tex(src, dst):
+            if fail:
+                raise RuntimeError('mpx failed')
+            self.convert('tex', src, dst, ' tex')
+
+        mmd, tex_file = self.path('paper.mmd'), self.path('paper.tex')
+        return [
+            Stage('ocr', self.convert, ('ocr', self.path('paper.pdf'), mmd, ' mmd'), inputs=[self.path('paper.pdf')],
+                  outputs=[mmd], params=params),
+            # changes the markdown in place
+            Stage('refine', self.convert, ('refine', mmd, mmd, ' refined'), inputs=[mmd], outputs=[mmd]),
+            Stage('tex', tex, (mmd, tex_file), inputs=[mmd], outputs=[tex_file]),
+        ]
+
+    def test_skips_up_to_date_stages(self):
+        Pipeline(self.manifest).run(self.stages())
+        self.assertEqual(self.calls, ['ocr', 'refine', 'tex'])
+        pipeline = Pipeline(self.manifest)
+        pipeline.run(self.stages())
+        self.assertEqual(self.calls, ['ocr', 'refine', 'tex'])
+        self.assertEqual(pipeline.skipped, ['ocr', 'refine', 'tex'])
+        with open(self.path('paper.tex')) as f:
+            self.assertEqual(f.read(), 'pdf mmd refined tex')
+
+    def test_reruns_changed_stages(self):
+        Pipeline(self.manifest).run(self.stages())
+        with open(self.path('paper.pdf'), 'w') as f:
+            f.write('new pdf')
+        Pipeline(self.manifest).run(self.stages())
+        self.assertEqual(self.calls, ['ocr', 'refine', 'tex'] * 2)
+
+        # an edit of the markdown only reruns the stages after OCR
+        with open(self.path('paper.mmd'), 'a') as f:
+            f.write(' fixed')
+        Pipeline(self.manifest).run(self.stages())
+        self.assertEqual(self.calls[6:], ['refine', 'tex'])
+
+        os.remove(self.path('paper.tex'))
+        Pipeline(self.manifest).run(self.stages())
+        self.assertEqual(self.calls[8:], ['tex'])
+
+        Pipeline(self.manifest).run(self.stages(params={'model': 'other'}))
+        self.assertEqual(self.calls[9:], ['ocr', 'refine', 'tex'])
+
+    def test_resumes_after_failure(self):
+        with self.assertRaises(RuntimeError):
+            Pipeline(self.manifest).run(self.stages(fail=True))
+        self.assertEqual(self.calls, ['ocr', 'refine'])
+        Pipeline(self.manifest).run(self.stages())
+        self.assertEqual(self.calls, ['ocr', 'refine', 'tex'])
+
+    def test_force(self):
+        Pipeline(self.manifest).run(self.stages())
+        Pipeline(self.manifest, force=True).run(self.stages())
+        self.assertEqual(self.calls, ['ocr', 'refine', 'tex'] * 2)
+
+    def test_missing_input(self):
+        os.remove(self.path('paper.pdf'))
+        with self.assertRaises(FileNotFoundError):
+            Pipeline(self.manifest).run(self.stages())
+
+    def test_branches(self):
+        # both branches have to reach the barrier, so they run at the same time
+        barrier = threading.Barrier(2, timeout=10)
+
+        def branch(name, fail=False):
+            def wait_and_convert(src, dst):
+                barrier.wait()
+                if fail:
+                    raise RuntimeError(f'{name} failed')
+                self.convert(name, src, dst, f' {name}')
+            mmd = self.path('paper.mmd')
+            return [Stage(name, wait_and_convert, (mmd, self.path(f'paper.{name}')), inputs=[mmd],
+                          outputs=[self.path(f'paper.{name}')])]
+
+        ocr = self.stages()[:1]
+        pipeline = Pipeline(self.manifest)
+        pipeline.run(ocr)
+        with self.assertRaises(RuntimeError):
+            pipeline.run_branches([branch('mp3', fail=True), branch('html')])
+        self.assertEqual(self.calls, ['ocr', 'html'])
+
+        # only the failed branch runs again
+        barrier = threading.Barrier(1)
+        pipeline = Pipeline(self.manifest)
+        pipeline.run(ocr)
+        pipeline.run_branches([branch('mp3'), branch('html')])
+        self.assertEqual(self.calls[2:], ['mp3'])
+        self.assertEqual(pipeline.skipped, ['ocr', 'html'])
+        with open(self.path('paper.mp3')) as f:
+            self.assertEqual(f.read(), 'pdf mmd mp3')
+
+
+class TestJob(unittest.TestCase):
+    def test_outputs_share_stages(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdf = os.path.join(temp_dir, 'paper.pdf')
+            with open(pdf, 'w') as f:
+                f.write('pdf')
+            args = get_args([pdf, '-o', 'out/paper.mp3', '-o', 'out/html/paper.html', '--tts', 'piper', '--voice',
+                             'voice.onnx'])
+            job = Job(pdf, args.output_files, args)
+            self.assertEqual([stage.name for stage in job.shared_stages], ['ocr', 'refine_mmd'])
+            self.assertEqual([[stage.name for stage in cpu + io] for cpu, io in job.branches],
+                             [['verbalize', 'speech'], ['mmd_to_tex', 'tex_to_html', 'process_html']])
+            self.assertEqual(job.manifest_file, os.path.join('out', '.paper.pipeline.json'))
+            self.assertEqual(job.out_paths, ['out', os.path.join('out', 'html')])
+
+            self.assertEqual([stage.name for stage in Job(pdf, ['paper.mp3'], args).cpu_stages],
+                             ['ocr', 'refine_mmd', 'verbalize'])
+            with self.assertRaises(AssertionError):
+                get_args([pdf, '-o', 'a.mp3', '-o', 'b.mp3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
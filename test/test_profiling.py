@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from paper2speech import run_stages
+from src.pipeline import Stage
+from src.profiling import Profiler, profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        profiler.enabled = False
+        profiler.main_pid = None
+        profiler.drain()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def test_disabled(self):
+        with self.profiler.span('stage') as span:
+            span.set(cached=True)
+        self.assertEqual(self.profiler.events, [])
+
+    def test_spans(self):
+        self.profiler.enable(main=True)
+        with self.profiler.span('speech chunk', 'chunk', chunk='paper-0') as span:
+            with open(self.path('audio.mp3'), 'wb') as f:
+                f.write(bytes(10000))
+            span.set(cached=False)
+        with self.assertRaises(ValueError):
+            with self.profiler.span('speech chunk', 'chunk', chunk='paper-1'):
+                raise ValueError('quota')
+        thread = threading.Thread(target=lambda: self.profiler.span('gemma', 'request').__enter__().__exit__(
+            None, None, None))
+        thread.start()
+        thread.join()
+
+        first, second, third = self.profiler.events
+        self.assertEqual((first['name'], first['cat'], first['pid']), ('speech chunk', 'chunk', os.getpid()))
+        self.assertEqual(first['args']['chunk'], 'paper-0')
+        self.assertFalse(first['args']['cached'])
+        self.assertGreater(first['dur'], 0)
+        if 'process_written_bytes' in first['args']:
+            self.assertGreaterEqual(first['args']['process_written_bytes'], 10000)
+        self.assertEqual(second['args']['error'], "ValueError('quota')")
+        self.assertNotEqual(third['tid'], first['tid'])
+
+        report = self.profiler.report()
+        self.assertEqual(report['spans']['speech chunk']['count'], 2)
+        self.assertEqual(report['spans']['speech chunk']['errors'], 1)
+        self.assertEqual(report['spans']['gemma']['count'], 1)
+        self.assertGreaterEqual(report['wall_s'], report['spans']['speech chunk']['wall_s'])
+
+    def test_overlapping_spans_have_no_io(self):
+        self.profiler.enable(main=True)
+        entered, done = threading.Event(), threading.Event()
+
+        def chunk():
+            with self.profiler.span('speech chunk', 'chunk'):
+                entered.set()
+                done.wait()
+
+        thread = threading.Thread(target=chunk)
+        thread.start()
+        entered.wait()
+        with self.profiler.span('speech chunk', 'chunk'):
+            done.set()
+            thread.join()
+        with self.profiler.span('merge', 'stage'):
+            pass
+        events = {event['name']: event for event in self.profiler.events}
+        self.assertEqual(len(self.profiler.events), 3)
+        for event in self.profiler.events[:2]:
+            self.assertNotIn('process_read_bytes', event['args'])
+        if os.path.exists('/proc/self/io'):
+            self.assertIn('process_read_bytes', events['merge']['args'])
+
+    def test_peak_rss_once_per_process(self):
+        self.profiler.enable(main=True)
+        with self.profiler.span('ocr', 'stage'):
+            pass
+        self.assertNotIn('peak_rss', self.profiler.events[0]['args'])
+        self.profiler.events += self.profiler.drain()
+        report = self.profiler.report()
+        self.assertGreater(report['peak_rss'], 0)
+        self.assertEqual(list(report['spans']), ['ocr'])
+
+    def test_write(self):
+        self.profiler.enable(main=True)
+        with self.profiler.span('ocr', 'stage'):
+            pass
+        self.profiler.write(self.path('profile/run'))
+        with open(self.path('profile/run.json')) as f:
+            self.assertEqual(json.load(f)['spans']['ocr']['category'], 'stage')
+        with open(self.path('profile/run.trace.json')) as f:
+            span, counter = json.load(f)['traceEvents']
+        self.assertEqual((span['name'], span['ph']), ('ocr', 'X'))
+        self.assertEqual((counter['name'], counter['ph']), ('peak_rss', 'C'))
+
+    def test_events_of_worker_processes(self):
+        with open(self.path('paper.mmd'), 'w') as f:
+            f.write('text')
+        stages = [Stage('copy', shutil.copyfile, (self.path('paper.mmd'), self.path('paper.tex')),
+                        inputs=[self.path('paper.mmd')], outputs=[self.path('paper.tex')])]
+        profiler.enable(main=True)
+        with profiler.span('main', 'stage'):
+            pass
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            ran, events = executor.submit(run_stages, stages, self.path('manifest.json'), False, True).result()
+        self.assertEqual(ran, ['copy'])
+        # the events of the worker only, without those the main process recorded before the fork
+        self.assertEqual([event['name'] for event in events], ['copy', 'peak_rss'])
+        self.assertNotEqual(events[0]['pid'], os.getpid())
+        # the main process keeps its events
+        ran, events = run_stages(stages, self.path('manifest.json'), False, True)
+        self.assertEqual((ran, events), ([], []))
+        self.assertEqual([event['name'] for event in profiler.events], ['main', 'copy'])
+        self.assertTrue(profiler.events[1]['args']['skipped'])
+
+
+if __name__ == '__main__':
+    unittest.main()
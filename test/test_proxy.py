@@ -0,0 +1,153 @@
+import http.client
+import json
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.cache import DiskCache
+from src.proxy import TOKEN_HEADER, TOKEN_PATH, Proxy, make_server
+
+
+class Upstream(BaseHTTPRequestHandler):
+    """Stand-in for the API: answers in two chunks, the second one only once released if the request asks to wait."""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    release = threading.Event()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        request = json.loads(body)
+        Upstream.requests.append((self.path, self.headers.get('Authorization')))
+        if request.get('status', 200) != 200:
+            self.send_error(request['status'])
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunks = [b'first-', b'second']
+        for i, chunk in enumerate(chunks):
+            if i and request.get('wait'):
+                Upstream.release.wait(5)
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestProxy(unittest.TestCase):
+    def setUp(self):
+        Upstream.requests = []
+        Upstream.release = threading.Event()
+        self.upstream = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+        self.upstream.daemon_threads = True
+        threading.Thread(target=self.upstream.serve_forever, args=(0.05,), daemon=True).start()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.temp_dir.name, 'paper.index.json'), 'w') as f:
+            f.write('{}')
+        self.proxy = Proxy(f'http://127.0.0.1:{self.upstream.server_address[1]}',
+                           DiskCache(os.path.join(self.temp_dir.name, 'cache')), api_key='sk-env')
+        self.server = make_server(self.temp_dir.name, self.proxy, port=0, token='run-token')
+        self.origin = f'http://localhost:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def tearDown(self):
+        Upstream.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.upstream.shutdown()
+        self.upstream.server_close()
+        self.temp_dir.cleanup()
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+
+    def page_headers(self, **headers):
+        """The headers of a request of a page served by the proxy."""
+        return {'Origin': self.origin, TOKEN_HEADER: 'run-token', **headers}
+
+    def post(self, request, path='/v1/audio/speech', headers=None):
+        connection = self.connect()
+        connection.request('POST', path, json.dumps(request), self.page_headers() if headers is None else headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def test_caches_responses(self):
+        self.assertEqual(self.post({'input': 'a', 'voice': 'echo'}), (200, b'first-second'))
+        # the same json with another key order and another API key
+        headers = self.page_headers(Authorization='Bearer sk-page')
+        self.assertEqual(self.post({'voice': 'echo', 'input': 'a'}, headers=headers), (200, b'first-second'))
+        self.assertEqual(self.post({'input': 'b'}, path='/v1/chat/completions'), (200, b'first-second'))
+        self.assertEqual(Upstream.requests, [('/v1/audio/speech', 'Bearer sk-env'),
+                                             ('/v1/chat/completions', 'Bearer sk-env')])
+
+    def test_expired_responses_are_requested_again(self):
+        self.post({'input': 'a'})
+        self.proxy.ttl = -1
+        self.post({'input': 'a'})
+        self.assertEqual(len(Upstream.requests), 2)
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.post({'status': 500})[0], 500)
+        self.assertEqual(self.post({'status': 500})[0], 500)
+        self.assertEqual(len(Upstream.requests), 2)
+
+    def test_identical_requests_in_flight_are_sent_once(self):
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            responses = [executor.submit(self.post, {'input': 'slow', 'wait': True}) for _ in range(5)]
+            # all requests are waiting for the second chunk of the same upstream response
+            while self.proxy.upstream_requests < 1 or not self.proxy._flights:
+                pass
+            Upstream.release.set()
+            self.assertEqual([response.result() for response in responses], [(200, b'first-second')] * 5)
+        self.assertEqual(len(Upstream.requests), 1)
+
+    def test_streams_chunks_as_they_arrive(self):
+        connection = self.connect()
+        connection.request('POST', '/v1/audio/speech', json.dumps({'input': 'stream', 'wait': True}),
+                           self.page_headers())
+        response = connection.getresponse()
+        # the first chunk arrives while the upstream response is held back
+        self.assertEqual(response.read1(100), b'first-')
+        Upstream.release.set()
+        self.assertEqual(response.read(), b'second')
+
+    def test_serves_files(self):
+        connection = self.connect()
+        connection.request('GET', '/paper.index.json')
+        response = connection.getresponse()
+        self.assertEqual((response.status, response.read()), (200, b'{}'))
+
+    def test_rejects_other_origins_and_paths(self):
+        for headers in ({'Origin': 'https://example.com', TOKEN_HEADER: 'run-token'},
+                        # sandboxed frames and data: urls
+                        {'Origin': 'null', TOKEN_HEADER: 'run-token'}, {TOKEN_HEADER: 'run-token'},
+                        {'Origin': self.origin}, self.page_headers(**{TOKEN_HEADER: 'guess'})):
+            self.assertEqual(self.post({}, headers=headers)[0], 403, headers)
+        self.assertEqual(self.post({}, path='/v1/files')[0], 404)
+        for origin, status in (('null', 403), (self.origin, 204)):
+            connection = self.connect()
+            connection.request('OPTIONS', '/v1/audio/speech', headers={'Origin': origin})
+            response = connection.getresponse()
+            self.assertEqual(response.status, status)
+        self.assertEqual(response.getheader('Access-Control-Allow-Origin'), self.origin)
+        self.assertEqual(Upstream.requests, [])
+
+    def test_token(self):
+        for headers, status in (({}, 200), ({'Origin': self.origin}, 200), ({'Origin': 'null'}, 403),
+                                ({'Origin': 'https://example.com'}, 403)):
+            connection = self.connect()
+            connection.request('GET', TOKEN_PATH, headers=headers)
+            self.assertEqual(connection.getresponse().status, status, headers)
+        connection = self.connect()
+        connection.request('GET', TOKEN_PATH)
+        self.assertEqual(json.loads(connection.getresponse().read()), {'token': 'run-token'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import random
+import re
+import unittest
+
+from src.replacements import text_replacements
+from src.rules import RuleEngine, can_overlap, literal_pattern
+
+
+def apply_sequentially(rules, text):
+    for pattern, replacement, *_ in rules:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+class TestRuleEngine(unittest.TestCase):
+    def test_literal_pattern(self):
+        self.assertEqual(literal_pattern(r'w\.r\.t\.'), 'w.r.t.')
+        self.assertEqual(literal_pattern(r'e\. g\.'), 'e. g.')
+        self.assertIsNone(literal_pattern(r' et al.'))
+        self.assertIsNone(literal_pattern(r'\n'))
+        self.assertIsNone(literal_pattern(r'(\w+)\.(\d+)$'))
+
+    def test_can_overlap(self):
+        self.assertTrue(can_overlap('w.r.t.', 'w.r.t'))
+        self.assertTrue(can_overlap('that is', 'sec.'))
+        self.assertFalse(can_overlap('Fig.', 'Tab.'))
+
+    def test_literal_gates(self):
+        rules = [(r'(\w+)\.(\d+)$', r'\1', '.'), (r'x+', 'y')]
+        engine = RuleEngine(rules)
+        self.assertEqual([literal for _, _, literal in engine.passes], ['.', None])
+        self.assertEqual(engine.apply('training.4'), 'training')
+        self.assertEqual(engine.apply('xx'), 'y')
+
+    def test_gates_of_the_text_rules(self):
+        # the literal of each rule with regex syntax occurs in every match of it
+        texts = ['(k)-th', 'of training.4', '## 1.2 Title', 'Smith et al. (2019)', '[Smith, 2019]',
+                 '(Smith, 2019; Doe, 2020a)', 'see https://a.b/c.', 'a\nb', '[3, 4]', '(12, pp. 3-4)']
+        for pattern, _, *gate in text_replacements:
+            for text in texts:
+                for match in re.finditer(pattern, text):
+                    if gate and match.group():
+                        self.assertIn(gate[0], match.group(), pattern)
+
+    def test_dependent_rules(self):
+        # each rule creates or destroys matches of the next one, so the order matters
+        rules = [('ab', 'c'), ('cd', 'e'), ('e', 'ab'), (r'b\.', 'x')]
+        engine = RuleEngine(rules)
+        for text in ['abd', 'ecd', 'cab.', 'abdb.e', 'aabdd']:
+            self.assertEqual(engine.apply(text), apply_sequentially(rules, text))
+
+    def test_matches_sequential_application(self):
+        # texts made of fragments of patterns and replacements, so that rules interact
+        fragments = ['i.e.', 'e.g.', 'e. g.', 'sec.', 'Sec.', 'w.r.t', '.', ' ', 'that is', '(1)', '[2, 3]', '-th',
+                     ' et al.', 'Smith et al. (2019)', '(Smith et al., 2019)', 'https://a.b/c', '\n', 'tion', '4',
+                     '<break time="0.5s"></break>', '# 1.2 ', 'x']
+        engine = RuleEngine(text_replacements)
+        rng = random.Random(0)
+        for _ in range(2000):
+            text = ''.join(rng.choice(fragments) for _ in range(rng.randint(1, 12)))
+            self.assertEqual(engine.apply(text), apply_sequentially(text_replacements, text), repr(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.convert import process_html, section_index_path
+from src.html_rewriter import rewrite_html
+from src.section_index import SectionIndexer, search, tokenize
+
+PAGE = ('<!DOCTYPE html><html><head><title>Notes</title><script>var x = "hidden";</script></head><body>'
+        '<section id="S1" class="ltx_section"><h2 class="ltx_title"><span class="ltx_tag">1</span>Heat</h2>'
+        '<div id="S1.p1" class="ltx_para"><p>Definition 1. A <em class="ltx_emph">heat kernel</em> solves '
+        'the equation <math alttext="\\partial_t u = \\Delta u"><mi>u</mi></math>.</p></div>'
+        '<section id="S1.SS1" class="ltx_subsection"><h3>Bounds</h3>'
+        '<div id="S1.SS1.p1" class="ltx_para"><p>Gaussian bounds for the kernel &amp; its gradient.</p>'
+        '<div class="ltx_para">nested</div></div></section></section>'
+        '<section id="S2" class="ltx_section"><h2>Waves</h2>'
+        '<div id="S2.p1" class="ltx_para">The wave equation has finite speed.</div>'
+        '<div id="S2.p2" class="ltx_para">Lemma 2. The heat kernel is positive.</div></section>'
+        '</body></html>')
+
+
+class TestSectionIndex(unittest.TestCase):
+    def build(self, page=PAGE):
+        indexer = SectionIndexer()
+        rewrite_html(page, indexer=indexer)
+        return indexer.build()
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('The L2-norm of a Gaussian is 1.'), ['l2', 'norm', 'gaussian'])
+
+    def test_passages_and_sections(self):
+        index = self.build()
+        self.assertEqual(index['passages'], [
+            ['S1.p1', 'S1', 'Definition 1. A heat kernel solves the equation \\partial_t u = \\Delta u .'],
+            ['S1.SS1.p1', 'S1.SS1', 'Gaussian bounds for the kernel & its gradient. nested'],
+            ['S2.p1', 'S2', 'The wave equation has finite speed.'],
+            ['S2.p2', 'S2', 'Lemma 2. The heat kernel is positive.'],
+        ])
+        self.assertEqual(index['sections']['S1']['title'], '1 Heat')
+        self.assertEqual(index['sections']['S1']['passages'], [0, 2])
+        self.assertEqual(index['sections']['S1.SS1']['passages'], [1, 2])
+        self.assertEqual(index['sections']['S2']['passages'], [2, 4])
+        self.assertIn('gaussian', index['sections']['S1']['terms'])
+        self.assertEqual(index['definitions'], {'heat kernel': 0})
+        self.assertEqual(index['lengths'][2], 4)
+        self.assertEqual(index['postings']['kernel'], [0, 1, 1, 1, 3, 1])
+
+    def test_search(self):
+        index = self.build()
+        self.assertEqual(search(index, 'heat kernel', limit=2), [3, 0])
+        self.assertEqual(search(index, 'heat kernel', exclude=range(0, 2)), [3])
+        self.assertEqual(search(index, 'unrelated words'), [])
+
+    def test_rewrite_is_unchanged(self):
+        self.assertEqual(rewrite_html(PAGE, indexer=SectionIndexer()), rewrite_html(PAGE))
+
+    def test_process_html_writes_sidecar(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            html_file = os.path.join(temp_dir, 'notes.html')
+            with open(html_file, 'w') as f:
+                f.write(PAGE)
+            process_html(html_file)
+            with open(html_file) as f:
+                self.assertIn('<meta name="section-index" content="notes.index.json"/>', f.read())
+            with open(section_index_path(html_file)) as f:
+                index = json.load(f)
+            self.assertEqual(index['passages'][2][0], 'S2.p1')
+            self.assertEqual(index['stopwords'], sorted(index['stopwords']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import http.client
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from src.audio import mp3_duration
+from src.service import JobQueue, Service, make_server, request
+from src.speech_backends import BACKENDS
+from test.fake_tts import FakeSpeech
+
+# stand-in for latexmlc, which writes a minimal LaTeXML page to --dest
+LATEXMLC = f'''#!{sys.executable}
+import sys
+dest = [arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--dest=')][0]
+with open(dest, 'w') as f:
+    f.write('<html><head><title>Notes</title></head><body><section class="ltx_section">'
+            '<h2 class="ltx_title">1 Heat</h2><div class="ltx_para"><p class="ltx_p">Theorem 1. It holds.</p></div>'
+            '</section></body></html>')
+'''
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_queue_survives_restarts(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'service.db')
+            queue = JobQueue(path)
+            first, second, third = (queue.submit([name, '-o', 'out.mp3']) for name in ('a.mmd', 'b.mmd', 'c.mmd'))
+            self.assertEqual(queue.claim()['id'], first)
+            self.assertTrue(queue.cancel(third))
+            self.assertFalse(queue.cancel(first))
+            queue.close()
+
+            queue = JobQueue(path)
+            # the job that was running is queued again, before the next one
+            self.assertEqual([job['status'] for job in queue.list()], ['cancelled', 'queued', 'queued'])
+            self.assertEqual(queue.claim()['id'], first)
+            self.assertEqual(queue.claim()['id'], second)
+            self.assertIsNone(queue.claim())
+            queue.close()
+
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        bin_dir = os.path.join(self.temp_dir.name, 'bin')
+        os.makedirs(bin_dir)
+        latexmlc = os.path.join(bin_dir, 'latexmlc')
+        with open(latexmlc, 'w') as f:
+            f.write(LATEXMLC)
+        os.chmod(latexmlc, os.stat(latexmlc).st_mode | stat.S_IEXEC)
+        with open(self.path('paper.mmd'), 'w') as f:
+            f.write('# Heat\n\nWe consider the heat equation \\(u_t = \\Delta u\\).\n\n'
+                    '* first item\n* second item\n')
+        with open(self.path('notes.tex'), 'w') as f:
+            f.write('\\documentclass{article}\\begin{document}\\section{Heat}It holds.\\end{document}\n')
+
+        patches = [mock.patch.dict(os.environ, {'PATH': bin_dir + os.pathsep + os.environ['PATH']}),
+                   mock.patch.dict(BACKENDS, {'fake': lambda voice=None: FakeSpeech(latency=0)})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.queue = JobQueue(self.path('service.db'))
+        self.service = Service(self.queue, processes=1, concurrency=2)
+        self.server = make_server(self.service, port=0)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.service.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.stop()
+        self.queue.close()
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def submit(self, args):
+        return request('POST', '/jobs', {'args': args, 'cwd': self.temp_dir.name}, port=self.port)
+
+    def wait(self, id, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status, job = request('GET', f'/jobs/{id}', port=self.port)
+            self.assertEqual(status, 200)
+            if job['status'] in ('done', 'failed'):
+                return job
+            time.sleep(0.05)
+        self.fail(f'job {id} did not finish')
+
+    def test_end_to_end(self):
+        status, speech_job = self.submit(['paper.mmd', '-o', 'out/paper.mp3', '--tts', 'fake', '--no-cache'])
+        self.assertEqual((status, speech_job['status']), (201, 'queued'))
+        status, html_job = self.submit(['notes.tex', '-o', 'out/notes.html'])
+        self.assertEqual(status, 201)
+
+        speech_job = self.wait(speech_job['id'])
+        self.assertEqual(speech_job['status'], 'done', speech_job['error'])
+        self.assertEqual(speech_job['progress'], 1.0)
+        file, = speech_job['files']
+        self.assertEqual(file['output_files'], [self.path('out/paper.mp3')])
+        self.assertEqual([(stage['name'], stage['status']) for stage in file['stages']],
+                         [('refine_mmd', 'ran'), ('verbalize', 'ran'), ('speech', 'ran')])
+        self.assertTrue(all(stage['seconds'] >= 0 for stage in file['stages']))
+        with open(self.path('out/paper.mp3'), 'rb') as f:
+            self.assertGreater(mp3_duration(f.read()), 0)
+
+        html_job = self.wait(html_job['id'])
+        self.assertEqual(html_job['status'], 'done', html_job['error'])
+        self.assertEqual([stage['name'] for stage in html_job['files'][0]['stages']], ['tex_to_html', 'process_html'])
+        with open(self.path('out/notes.html')) as f:
+            self.assertIn('ltx_theorem', f.read())
+        self.assertTrue(os.path.exists(self.path('out/notes.index.json')))
+
+        # the same conversion again only skips stages
+        _, again = self.submit(['paper.mmd', '-o', 'out/paper.mp3', '--tts', 'fake', '--no-cache'])
+        again = self.wait(again['id'])
+        self.assertEqual([stage['status'] for stage in again['files'][0]['stages']], ['skipped'] * 3)
+
+        status, jobs = request('GET', '/jobs', port=self.port)
+        self.assertEqual([job['id'] for job in jobs], [again['id'], html_job['id'], speech_job['id']])
+
+    def test_failures(self):
+        status, response = self.submit(['missing.mmd', '-o', 'out/missing.mp3'])
+        self.assertEqual(status, 400)
+        self.assertIn('does not exist', response['error'])
+        self.assertEqual(self.submit(['paper.mmd', '-o', 'out/paper.mp3', '--tts', 'unknown'])[0], 400)
+        self.assertEqual(request('GET', '/jobs/99', port=self.port)[0], 404)
+
+        # the input is removed after the job was queued
+        with open(self.path('gone.mmd'), 'w') as f:
+            f.write('text')
+        with mock.patch.object(self.service, 'notify'):
+            _, job = self.submit(['gone.mmd', '-o', 'out/gone.mp3', '--tts', 'fake'])
+        os.remove(self.path('gone.mmd'))
+        self.service.notify()
+        job = self.wait(job['id'])
+        self.assertEqual((job['status'], job['files']), ('failed', []))
+        self.assertIn('gone.mmd does not exist', job['error'])
+
+        # the Mathpix CLI is not installed
+        _, job = self.submit(['paper.mmd', '-o', 'out/paper.html'])
+        job = self.wait(job['id'])
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual([(stage['name'], stage['status']) for stage in job['files'][0]['stages']],
+                         [('refine_mmd', 'ran'), ('mmd_to_tex', 'failed'), ('tex_to_html', 'queued'),
+                          ('process_html', 'queued')])
+        self.assertIn('Mathpix CLI conversion failed', job['files'][0]['stages'][1]['error'])
+
+    def test_unix_socket(self):
+        socket_path = self.path('service.sock')
+        server = make_server(self.service, socket_path=socket_path)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        try:
+            status, job = request('POST', '/jobs', {'args': ['notes.tex', '-o', 'out/notes.html'],
+                                                    'cwd': self.temp_dir.name}, socket_path=socket_path)
+            self.assertEqual(status, 201)
+            self.assertEqual(self.wait(job['id'])['status'], 'done')
+            self.assertEqual(request('GET', '/jobs', socket_path=socket_path)[1][0]['id'], job['id'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_rejects_web_pages(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        connection.request('POST', '/jobs', '{"args": ["notes.tex", "-o", "notes.html"]}',
+                           {'Origin': 'https://example.com', 'Content-Type': 'text/plain'})
+        self.assertEqual(connection.getresponse().status, 403)
+        self.assertEqual(self.queue.list(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
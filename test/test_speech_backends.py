@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.audio import SegmentPlaylist
+from src.cache import DiskCache
+from src.speech_backends import (GoogleSpeech, PiperSpeech, SpeechBackend, get_backend, ssml_pieces, AUDIO_ENCODING,
+                                 FALLBACK_VOICE_NAME, LANGUAGE_CODE, SPEAKING_RATE, VOICE_NAME)
+from src.text_to_speech import MP3Generator, synthesize_chunk
+
+
+class Recorder(SpeechBackend):
+    name = 'recorder'
+    ssml_tags = frozenset({'speak', 'p'})
+    max_request_bytes = 100
+    max_workers = 2
+    rate_limited = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def synthesize(self, ssml, name, before_request=None):
+        assert before_request is None
+        self.chunks.append(ssml)
+        return b'\xff\xf3\x44\xc4' + bytes(92)
+
+
+class TestSpeechBackends(unittest.TestCase):
+    def test_google_cache_key(self):
+        # the keys of chunks cached before there were several backends
+        self.assertEqual(GoogleSpeech().cache_key('<speak>a</speak>'),
+                         DiskCache.key('<speak>a</speak>', VOICE_NAME, LANGUAGE_CODE, SPEAKING_RATE, AUDIO_ENCODING))
+        self.assertEqual(GoogleSpeech().params, {'voice': VOICE_NAME, 'language': LANGUAGE_CODE, 'rate': SPEAKING_RATE})
+        voice = get_backend('google', 'en-US-Neural2-J')
+        self.assertEqual((voice.language, voice.fallback_voice), ('en-US', None))
+
+    def test_piper_needs_a_voice(self):
+        with self.assertRaises(ValueError):
+            PiperSpeech(None)
+        self.assertEqual(PiperSpeech('voices/en_GB-alan-medium.onnx').params['voice'], 'en_GB-alan-medium.onnx')
+
+    def test_piper_voices_with_the_same_name(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            backends = []
+            for directory, model in (('old', b'old model'), ('new', b'updated model')):
+                os.makedirs(os.path.join(temp_dir, directory))
+                voice = os.path.join(temp_dir, directory, 'en_GB-alan-medium.onnx')
+                with open(voice, 'wb') as f:
+                    f.write(model)
+                backends.append(PiperSpeech(voice))
+            old, new = backends
+            self.assertEqual(old.params['voice'], new.params['voice'])
+            self.assertNotEqual(old.params, new.params)
+            self.assertNotEqual(old.cache_key('<speak>a</speak>'), new.cache_key('<speak>a</speak>'))
+
+    def test_backends_have_to_synthesize(self):
+        class Silent(SpeechBackend):
+            name = 'silent'
+
+        with self.assertRaises(TypeError):
+            Silent()
+
+    def test_prepare(self):
+        ssml = '<p>A <emphasis>bold</emphasis> claim<sup>[1]</sup></p><break time="0.5s"/>'
+        self.assertEqual(GoogleSpeech().prepare(ssml), ssml)
+        self.assertEqual(PiperSpeech('voice.onnx').prepare(ssml), '<p>A bold claim[1]</p><break time="0.5s"/>')
+
+    def test_ssml_pieces(self):
+        ssml = ('<speak>\n<break time="0.5s"/><p>Title</p><break time="500ms"/><p>A &amp; B\nare <emphasis>equal'
+                '</emphasis>.</p><p>Next</p>\n</speak>\n')
+        self.assertEqual(ssml_pieces(ssml), [('', 0.5), ('Title', 0.3), ('', 0.5), ('A & B are equal .', 0.3),
+                                             ('Next', 0.3)])
+
+    def test_generator_uses_the_backend(self):
+        backend = Recorder()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            markdown_file = os.path.join(temp_dir, 'paper.mmd')
+            with open(markdown_file, 'w') as f:
+                f.write('# Title\n\nA *short* paragraph.\n\n' + 'Another sentence of the paragraph. ' * 5)
+            generator = MP3Generator(markdown_file, backend=backend, requests_per_minute=1)
+            self.assertEqual(generator.max_workers, 2)
+            self.assertEqual(generator.write_mp3(os.path.join(temp_dir, 'paper.mp3')), len(backend.chunks))
+        self.assertGreater(len(backend.chunks), 1)
+        for chunk in backend.chunks:
+            self.assertLessEqual(len(chunk.encode()), 100)
+            self.assertNotIn('emphasis', chunk)
+
+    def test_progressive(self):
+        backend = Recorder()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            markdown_file = os.path.join(temp_dir, 'paper.mmd')
+            with open(markdown_file, 'w') as f:
+                f.write('Another sentence of the paragraph. ' * 5)
+            playlist = SegmentPlaylist(os.path.join(temp_dir, 'paper.m3u8'))
+            written = MP3Generator(markdown_file, backend=backend, chunk_bytes=60).write_mp3(
+                os.path.join(temp_dir, 'paper.mp3'), playlist)
+            for chunk in backend.chunks:
+                self.assertLessEqual(len(chunk.encode()), 60)
+            # the segments are kept next to the complete mp3 file for players of the playlist
+            self.assertEqual(len(os.listdir(playlist.segment_dir)), written)
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, 'paper.mp3')))
+
+    def test_playlist_is_closed_on_failure(self):
+        backend = Recorder()
+        backend.synthesize = mock.Mock(side_effect=RuntimeError('quota exceeded'))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            markdown_file = os.path.join(temp_dir, 'paper.mmd')
+            with open(markdown_file, 'w') as f:
+                f.write('A paragraph.')
+            playlist = SegmentPlaylist(os.path.join(temp_dir, 'paper.m3u8'), 10)
+            with self.assertRaises(RuntimeError):
+                MP3Generator(markdown_file, backend=backend).write_mp3(os.path.join(temp_dir, 'paper.mp3'), playlist)
+            with open(playlist.path) as f:
+                self.assertIn('#EXT-X-ENDLIST', f.read().splitlines())
+
+    def test_fallback_audio_is_not_cached(self):
+        backend = GoogleSpeech()
+        backend._client = mock.Mock()
+        # the Neural2 voice fails once, the WaveNet audio is used for that request only
+        backend._client.synthesize_speech.side_effect = [
+            RuntimeError('sentence too long'), mock.Mock(audio_content=b'wavenet'), mock.Mock(audio_content=b'neural2')]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = DiskCache(temp_dir)
+            self.assertEqual(synthesize_chunk('<p>a</p>', 'paper-0', backend, cache=cache), b'wavenet')
+            self.assertEqual(synthesize_chunk('<p>a</p>', 'paper-0', backend, cache=cache), b'neural2')
+            self.assertEqual(synthesize_chunk('<p>a</p>', 'paper-0', backend, cache=cache), b'neural2')
+        voices = [call.kwargs['request']['voice'].name for call in backend._client.synthesize_speech.call_args_list]
+        self.assertEqual(voices, [VOICE_NAME, FALLBACK_VOICE_NAME, VOICE_NAME])
+
+    def test_cache_is_per_backend(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = DiskCache(temp_dir)
+            backend = Recorder()
+            synthesize_chunk('<p>a</p>', 'paper-0', backend, cache=cache)
+            synthesize_chunk('<p>a</p>', 'paper-0', backend, cache=cache)
+            self.assertEqual(len(backend.chunks), 1)
+            self.assertIsNone(cache.get(GoogleSpeech().cache_key('<speak>\n<p>a</p></speak>\n')))
+
+
+if __name__ == '__main__':
+    unittest.main()
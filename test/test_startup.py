@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from test.helpers import PROJECT_DIR, heavy_imports
+
+
+class TestStartup(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        self.assertEqual(heavy_imports(), [])
+
+    def test_help_without_credentials(self):
+        env = {key: value for key, value in os.environ.items() if key != 'GOOGLE_APPLICATION_CREDENTIALS'}
+        result = subprocess.run([sys.executable, 'paper2speech.py', '--help'], cwd=PROJECT_DIR, env=env,
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('input_file', result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
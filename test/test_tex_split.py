@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from src.tex_split import convert_parts, included_files, merge_parts, split_tex, tex_to_html_parallel
+
+BOOK = r"""\documentclass{book}
+\title{Notes}
+\begin{document}
+\maketitle
+\chapter{Introduction}\label{ch:intro}
+See Chapter~\ref{ch:methods}.
+\begin{equation}x\end{equation}
+% \chapter{Commented out}
+\chapter{Methods}\label{ch:methods}
+\begin{verbatim}
+\chapter{Not a chapter}
+\end{verbatim}
+\include{results}
+\appendix
+\chapter{Proofs}
+\end{document}
+"""
+ARTICLE = r"""\documentclass{article}
+\begin{document}
+\newcommand{\R}{\mathbb{R}}
+\section{One}
+\begin{equation}a\end{equation}
+\begin{figure}\caption{A}\end{figure}
+Real\footnote{In \R.} numbers\footnote[7]{Set by hand.}.
+\section*{Unnumbered}
+\renewcommand{\R}{%
+  \mathbf{R}}
+Text\footnotemark.
+\section{Two}
+More\footnote {Third.}
+\section{Three}
+\end{document}
+"""
+
+# writes a LaTeXML-like xml document for the tex file given as last argument
+FAKE_LATEXML = r"""
+import sys
+args = dict(arg[2:].split('=', 1) for arg in sys.argv[1:-1])
+with open(sys.argv[-1]) as f:
+    tex = f.read()
+with open(sys.argv[-1] + '.log', 'a') as f:
+    f.write('converted\n')
+content = '<para>front</para>'
+if '\\chapter{' in tex:
+    content = '<chapter><title>' + tex.split('\\chapter{')[1].split('}')[0] + '</title></chapter>'
+with open(args['dest'], 'w') as f:
+    f.write('<?xml version="1.0"?>\n<document xmlns="http://dlmf.nist.gov/LaTeXML"><title>Notes</title>'
+            + content + '</document>\n')
+"""
+
+
+class TestTexSplit(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def write(self, name, content):
+        with open(self.path(name), 'w') as f:
+            f.write(content)
+        return self.path(name)
+
+    def test_split_chapters(self):
+        self.write('results.tex', '\\chapter{Results}\nDone.\n')
+        preamble, unit, parts = split_tex(BOOK, self.temp_dir.name)
+        self.assertEqual(unit, 'chapter')
+        self.assertEqual(preamble, '\\documentclass{book}\n\\title{Notes}\n')
+        self.assertEqual(len(parts), 5)
+        self.assertIn('\\maketitle', parts[0].body)
+        self.assertTrue(parts[1].body.lstrip().startswith('\\chapter{Introduction}'))
+        self.assertIn('% \\chapter{Commented out}', parts[1].body)
+        self.assertIn('\\chapter{Not a chapter}', parts[2].body)
+        self.assertIn('Done.', parts[3].body)
+        self.assertEqual([part.counters for part in parts], [{'chapter': 0}, {'chapter': 0}, {'chapter': 1},
+                                                             {'chapter': 2}, {'chapter': 0}])
+        self.assertEqual([part.appendix for part in parts], [False, False, False, False, True])
+        document = parts[4].document(preamble)
+        self.assertTrue(document.startswith(preamble + '\\begin{document}\n\\appendix\n\\setcounter{chapter}{0}\n'))
+        self.assertTrue(document.endswith('\\end{document}\n'))
+
+    def test_split_sections_carries_counters(self):
+        preamble, unit, parts = split_tex(ARTICLE)
+        self.assertEqual(unit, 'section')
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(parts[2].counters, {'section': 1, 'equation': 1, 'figure': 1, 'table': 0, 'footnote': 1})
+        self.assertEqual(parts[3].counters['section'], 1)
+        # footnotes keep counting across sections
+        self.assertEqual([part.counters['footnote'] for part in parts], [0, 0, 1, 2, 3])
+
+        # macros defined in the body are repeated in the later parts
+        self.assertEqual(parts[1].definitions, '\\newcommand{\\R}{\\mathbb{R}}\n')
+        self.assertEqual(parts[3].definitions, '\\newcommand{\\R}{\\mathbb{R}}\n\\renewcommand{\\R}{\n  \\mathbf{R}}\n')
+        self.assertIn('\\begin{document}\n\\newcommand{\\R}{\\mathbb{R}}\n\\renewcommand{\\R}{\n  \\mathbf{R}}\n'
+                      '\\setcounter{section}{1}', parts[3].document(preamble))
+        self.assertEqual(parts[0].definitions, '')
+
+        _, _, parts = split_tex(ARTICLE.replace('\\section{Two}', '\\appendix\n\\section{Two}'))
+        self.assertEqual(parts[3].counters, {'section': 0, 'equation': 1, 'figure': 1, 'table': 0, 'footnote': 2})
+        self.assertTrue(parts[3].appendix)
+
+    def test_included_files(self):
+        self.write('results.tex', '\\input{details}\n')
+        self.write('details.tex', 'x\n')
+        main = self.write('book.tex', BOOK)
+        self.assertEqual(included_files(main), [self.path('results.tex'), self.path('details.tex')])
+
+    def test_merge_parts(self):
+        head = '<?xml version="1.0"?>\n<?latexml class="book"?>\n<document xmlns="http://dlmf.nist.gov/LaTeXML">'
+        documents = [head + '<title>Notes</title><para>front</para></document>\n',
+                     head + '<title>Notes</title><chapter xml:id="Ch1"><section/></chapter></document>\n',
+                     head + '<title>Notes</title><chapter xml:id="Ch2"/></document>\n']
+        self.assertEqual(merge_parts(documents, 'chapter'),
+                         head + '<title>Notes</title><para>front</para><chapter xml:id="Ch1"><section/></chapter>'
+                                '<chapter xml:id="Ch2"/></document>\n')
+        with self.assertRaises(RuntimeError):
+            merge_parts(documents[:1] + [head + '<para/></document>'], 'chapter')
+
+    def test_convert_parts_reuses_unchanged_parts(self):
+        command = [sys.executable, self.write('latexml.py', FAKE_LATEXML)]
+        parts_dir = self.path('book.parts')
+        documents = ['\\chapter{A}', '\\chapter{B}']
+        xml = convert_parts(documents, parts_dir, self.temp_dir.name, 2, command)
+        self.assertIn('<title>B</title>', xml[1])
+        xml = convert_parts(['\\chapter{A}', '\\chapter{C}'], parts_dir, self.temp_dir.name, 2, command)
+        self.assertIn('<title>C</title>', xml[1])
+        logs = [entry for entry in os.listdir(parts_dir) if entry.endswith('.log')]
+        # the log of the part that changed has been removed with its other files
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(len([entry for entry in os.listdir(parts_dir) if entry.endswith('.xml')]), 2)
+
+    def test_tex_to_html_parallel(self):
+        self.write('results.tex', '\\chapter{Results}\n')
+        tex_file = self.write('book.tex', BOOK)
+        latexml = [sys.executable, self.write('latexml.py', FAKE_LATEXML)]
+        # copies the merged xml to the destination
+        post = [sys.executable, self.write('post.py', 'import shutil, sys\n'
+                                                      'shutil.copy(sys.argv[-1], sys.argv[-2].split("=", 1)[1])\n')]
+        self.assertTrue(tex_to_html_parallel(tex_file, self.temp_dir.name, 3, post, latexml))
+        with open(self.path('book.html')) as f:
+            html = f.read()
+        self.assertEqual(html.count('<document'), 1)
+        self.assertEqual(html.count('<title>Notes</title>'), 1)
+        for title in ['Introduction', 'Methods', 'Results', 'Proofs']:
+            self.assertIn(f'<chapter><title>{title}</title></chapter>', html)
+
+    def test_single_part_is_not_split(self):
+        tex_file = self.write('note.tex', '\\documentclass{article}\n\\begin{document}\nHi\n\\end{document}\n')
+        self.assertFalse(tex_to_html_parallel(tex_file, self.temp_dir.name, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
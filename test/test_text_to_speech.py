@@ -1,7 +1,13 @@
+import json
+import os
+import tempfile
 import unittest
 from unittest.mock import patch
 
 from src import MarkdownModel
+from src.markdown_to_html import load_segments, markdown_file_segments, save_segments, split_sections
+from test.corpus import generate_markdown
+from test.helpers import heuristic_author_detection
 
 
 class TestMarkdownModel(unittest.TestCase):
@@ -46,6 +52,40 @@ Ferran Alet\({}^{\,1}\)  Adarsh K. Jeewajee\({}^{\,1}\)  Maria Bauza\({}^{\,2}\)
         expected_output = "<p>Code can be found at.</p>"
         self.assertEqual(self.markdown_model.ssml.strip(), expected_output)
 
+    def test_skipped_blocks(self):
+        test_input = """Before ![figure](figure.png) image.
+
+\\[ E = mc^2 \\]
+
+After block math & <more>."""
+        self.markdown_model.markdown_to_html(test_input)
+        expected_output = "<p>Before  image.</p><p>After block math &amp; .</p>"
+        self.assertEqual(self.markdown_model.ssml.strip(), expected_output)
+
+    def test_raw_html(self):
+        test_input = """<div class="note">
+Hello &amp; <b onclick="x()">world</b> <3
+</div>
+
+A <span style="color:red">red</span> word<!-- hidden -->.
+
+<script>var a = 1;</script>
+
+<!-- comment -->"""
+        self.markdown_model.markdown_to_html(test_input)
+        expected_output = ['<p>Hello &amp; world &lt;3</p>', '<p>A red word.</p>']
+        self.assertEqual(self.markdown_model.segments, expected_output)
+
+    def test_segments(self):
+        test_input = """# Title
+
+* first
+* second"""
+        self.markdown_model.markdown_to_html(test_input)
+        expected_output = ['<break time="0.5s"/>', '<p>Title</p>', '<break time="0.5s"/>', '<p>first</p>',
+                           '<p>second</p>']
+        self.assertEqual(self.markdown_model.segments, expected_output)
+
     def test_authors(self):
         test_input = """# Graph Element Networks: adaptive, structured computation and memory
 
@@ -59,6 +99,39 @@ Ferran Alet\({}^{\,1}\)  Adarsh K. Jeewajee\({}^{\,1}\)  Maria Bauza\({}^{\,2}\)
         self.assertEqual(self.markdown_model.ssml.strip(), expected_output)
 
 
+class TestStreaming(unittest.TestCase):
+    def test_split_sections(self):
+        lines = ['# Title\n', 'Authors\n', '\n', '## One\n', 'text\n', '```\n', '\n', '# comment\n', '```\n', '\n',
+                 '\\[\n', '\n', '# not a heading\n', '\\]\n', 'text\n', '# Lazy\n', '\n', '#hashtag\n', '\n',
+                 '## Two\n']
+        self.assertEqual(list(split_sections(lines)), [''.join(lines[:3]), ''.join(lines[3:19]), '## Two\n'])
+
+    def test_sections_render_like_the_document(self):
+        content = generate_markdown(12, seed=3) + '\n```\ncode\n\n# not a heading\n```\n\n## Last\n\nText.\n'
+        with tempfile.TemporaryDirectory() as temp_dir, heuristic_author_detection():
+            markdown_file = os.path.join(temp_dir, 'paper.mmd')
+            with open(markdown_file, 'w', encoding='utf-8') as f:
+                f.write(content)
+            model = MarkdownModel()
+            model.markdown_to_html(content)
+            self.assertEqual(list(markdown_file_segments(markdown_file)), model.segments)
+
+    def test_save_and_load(self):
+        segments = ['<p>a, "b"</p>', '<p>line\nbreak ,</p>', '<break time="0.5s"/>']
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'paper.json')
+            save_segments(iter(segments), path)
+            self.assertEqual(list(load_segments(path)), segments)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f), segments)
+            # files saved on one line before segments were streamed
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(segments, f)
+            self.assertEqual(MarkdownModel.load(path).segments, segments)
+            save_segments([], path)
+            self.assertEqual(list(load_segments(path)), [])
+
+
 # for debugging
 def run_text_to_speech(ssml):
     import os
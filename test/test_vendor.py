@@ -0,0 +1,81 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.vendor import local_name, vendor_stylesheets
+
+FILES = {
+    '/assets/site.css': b'@font-face { src: url(fonts/a.woff2) format("woff2"), url(\'data:font/woff;base64,AA\'); }'
+                        b'.icon { background: url("/img/icon.svg"); }',
+    '/assets/fonts/a.woff2': b'font',
+    '/img/icon.svg': b'<svg/>',
+    '/icon': b'.material-icons-round { src: url(/assets/fonts/a.woff2); }',
+}
+
+
+class Server(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        Server.requests.append(self.path)
+        path = self.path.split('?')[0]
+        if path not in FILES:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(FILES[path])))
+        self.end_headers()
+        self.wfile.write(FILES[path])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestVendor(unittest.TestCase):
+    def setUp(self):
+        Server.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Server)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def read(self, name):
+        with open(os.path.join(self.temp_dir.name, 'vendor', name), 'rb') as f:
+            return f.read()
+
+    def test_local_name(self):
+        self.assertEqual(local_name('https://a.org/assets/ar5iv.0.7.9.min.css', '.css'), 'ar5iv.0.7.9.min.css')
+        name = local_name('https://fonts.googleapis.com/icon?family=Material+Icons+Round', '.css')
+        self.assertRegex(name, r'^[0-9a-f]{16}\.css$')
+
+    def test_vendor_stylesheets(self):
+        urls = [self.url + '/assets/site.css', self.url + '/icon?family=Icons', './styles_latexml.css']
+        hrefs = vendor_stylesheets(urls, self.temp_dir.name)
+        self.assertEqual(hrefs[0], './vendor/site.css')
+        self.assertRegex(hrefs[1], r'^\./vendor/[0-9a-f]{16}\.css$')
+        self.assertEqual(hrefs[2], './styles_latexml.css')
+        self.assertEqual(self.read('site.css'), b'@font-face { src: url("a.woff2") format("woff2"), '
+                                                b'url(\'data:font/woff;base64,AA\'); }'
+                                                b'.icon { background: url("icon.svg"); }')
+        self.assertEqual(self.read('a.woff2'), b'font')
+        self.assertEqual(self.read('icon.svg'), b'<svg/>')
+        # downloaded once, for all pages in the directory
+        requests = len(Server.requests)
+        self.assertEqual(vendor_stylesheets(urls, self.temp_dir.name), hrefs)
+        self.assertEqual(len(Server.requests), requests)
+
+    def test_missing_stylesheet_keeps_url(self):
+        url = self.url + '/assets/missing.css'
+        self.assertEqual(vendor_stylesheets([url], self.temp_dir.name), [url])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, 'vendor', 'missing.css')))
+
+
+if __name__ == '__main__':
+    unittest.main()